@@ -11,223 +11,59 @@
 # - 对新生成的购买欲分离散字段进行字典排序编码；
 # - 最后对多表进行拼接，并且通过month_lag字段是否大于0来进行区分。
 
-import logging
-import gc
-import numpy as np
+import argparse
 import pandas as pd
-from datetime import datetime
 
-# 创建logger对象
-logger = logging.getLogger('mylogger')
-logger.setLevel(logging.DEBUG)
-# 创建FileHandler对象
-fh = logging.FileHandler('./log/04_date_analysis.log', "w")
-fh.setLevel(logging.DEBUG)
-# 创建Formatter对象
-formatter = logging.Formatter()
-fh.setFormatter(formatter)
-# 将FileHandler对象添加到Logger对象中
-logger.addHandler(fh)
+import incremental
+import lazy_backend
+import preprocess
+from log_config import setup_logger
+from profiling import setup_profiler
+
 pd.set_option('display.max_columns', None)  # 显示完整的列
 pd.set_option('display.max_rows', None)  # 显示完整的行
 
-train = pd.read_csv('../data/primeval/train.csv')
-test = pd.read_csv('../data/primeval/test.csv')
-merchant = pd.read_csv('../data/primeval/merchants.csv')
-new_transaction = pd.read_csv('../data/primeval/new_merchant_transactions.csv')
-history_transaction = pd.read_csv('../data/primeval/historical_transactions.csv')
-
-
-def change_object_cols(se):
-    value = se.unique().tolist()
-    value.sort()
-    return se.map(pd.Series(range(len(value)), index=value)).values
-
-
-# 对首次活跃月份进行编码
-train["first_active_month"] = change_object_cols(train["first_active_month"].astype(str))
-test["first_active_month"] = change_object_cols(test["first_active_month"].astype(str))
-
-train.to_csv("../data/primeval/preprocess/train_pre.csv", index=False)
-test.to_csv("../data/primeval/preprocess/test_pre.csv", index=False)
-
-del train
-del test
-gc.collect()
-
-# 商户信息预处理
-# 1、根据业务含义划分离散字段category_cols与连续字段numeric_cols。
-category_cols = ['merchant_id', 'merchant_group_id', 'merchant_category_id',
-                 'subsector_id', 'category_1',
-                 'most_recent_sales_range', 'most_recent_purchases_range',
-                 'category_4', 'city_id', 'state_id', 'category_2']
-numeric_cols = ['numerical_1', 'numerical_2',
-                'avg_sales_lag3', 'avg_purchases_lag3', 'active_months_lag3',
-                'avg_sales_lag6', 'avg_purchases_lag6', 'active_months_lag6',
-                'avg_sales_lag12', 'avg_purchases_lag12', 'active_months_lag12']
-
-# 2、对非数值型的离散字段进行字典排序编码。
-for col in ['category_1', 'most_recent_sales_range', 'most_recent_purchases_range', 'category_4']:
-    merchant[col] = change_object_cols(merchant[col])
-
-# 3、为了能够更方便统计，进行缺失值的处理，对离散字段统一用-1进行填充。
-merchant[category_cols] = merchant[category_cols].fillna(-1)
-
-# 4、对离散型字段探查发现有正无穷值，这是特征提取以及模型所不能接受的，因此需要对无限值进行处理，此处采用最大值进行替换。
-inf_cols = ['avg_purchases_lag3', 'avg_purchases_lag6', 'avg_purchases_lag12']
-merchant[inf_cols] = merchant[inf_cols].replace(np.inf, merchant[inf_cols].replace(np.inf, -99).max().max())
-
-# 5、平均值进行填充，后续有需要再进行优化处理。
-for col in numeric_cols:
-    merchant[col] = merchant[col].fillna(merchant[col].mean())
-
-# 6、去除与transaction交易记录表格重复的列，以及merchant_id的重复记录。
-duplicate_cols = ['merchant_id', 'merchant_category_id', 'subsector_id', 'category_1', 'city_id', 'state_id',
-                  'category_2']
-merchant = merchant.drop(duplicate_cols[1:], axis=1)
-merchant = merchant.loc[merchant['merchant_id'].drop_duplicates().index.tolist()].reset_index(drop=True)
-
-# 交易数据预处理
-# 1、为了统一处理，首先拼接new和history两张表格，后续可以month_lag>=0进行区分。
-transaction = pd.concat([new_transaction, history_transaction], axis=0, ignore_index=True)
-del new_transaction
-del history_transaction
-gc.collect()
-
-# 2、同样划分离散字段、连续字段以及时间字段。
-numeric_cols = ['installments', 'month_lag', 'purchase_amount']
-category_cols = ['authorized_flag', 'card_id', 'city_id', 'category_1',
-                 'category_3', 'merchant_category_id', 'merchant_id', 'category_2', 'state_id',
-                 'subsector_id']
-time_cols = ['purchase_date']
-
-# 3、可仿照merchant的处理方式对字符型的离散特征进行字典序编码以及缺失值填充。
-for col in ['authorized_flag', 'category_1', 'category_3']:
-    transaction[col] = change_object_cols(transaction[col].fillna(-1).astype(str))
-transaction[category_cols] = transaction[category_cols].fillna(-1)
-transaction['category_2'] = transaction['category_2'].astype(int)
-
-# 4、进行时间段的处理，简单起见进行月份、日期的星期数（工作日与周末）、以及
-# 时间段（上午、下午、晚上、凌晨）的信息提取。
-transaction['purchase_month'] = transaction['purchase_date'].apply(lambda x: '-'.join(x.split(' ')[0].split('-')[:2]))
-transaction['purchase_hour_section'] = transaction['purchase_date'].apply(
-    lambda x: x.split(' ')[1].split(':')[0]).astype(int) // 6
-transaction['purchase_day'] = transaction['purchase_date'].apply(
-    lambda x: datetime.strptime(x.split(" ")[0], "%Y-%m-%d").weekday()) // 5
-del transaction['purchase_date']
-
-# 5、对新生成的购买月份离散字段进行字典序编码。
-transaction['purchase_month'] = change_object_cols(transaction['purchase_month'].fillna(-1).astype(str))
-
-# 在合并的过程中，有两种处理方案，其一是对缺失值进行-1填补，然后将所有离散型字段化为字符串类型（为了后续字典合并做准备），
-# 其二则是新增两列，分别是purchase_day_diff和purchase_month_diff，其数据为交易数据以card_id进行groupby并最终提取出purchase_day/month并进行差分的结果。
-
-# 方案1
-# 为了方便特征的统一计算将其merge合并，重新划分相应字段种类。
-cols = ['merchant_id', 'most_recent_sales_range', 'most_recent_purchases_range', 'category_4']
-transaction = pd.merge(transaction, merchant[cols], how='left', on='merchant_id')
-
-numeric_cols = ['purchase_amount', 'installments']
-
-category_cols = ['authorized_flag', 'city_id', 'category_1',
-                 'category_3', 'merchant_category_id', 'month_lag', 'most_recent_sales_range',
-                 'most_recent_purchases_range', 'category_4',
-                 'purchase_month', 'purchase_hour_section', 'purchase_day']
-
-id_cols = ['card_id', 'merchant_id']
-
-transaction[cols[1:]] = transaction[cols[1:]].fillna(-1).astype(int)
-transaction[category_cols] = transaction[category_cols].fillna(-1).astype(str)
-
-transaction.to_csv("../data/primeval/preprocess/transaction_d_pre.csv", index=False)
-
-del transaction
-gc.collect()
-
-# 方案二
-
-merchant = pd.read_csv('../data/primeval/merchants.csv')
-new_transaction = pd.read_csv('../data/primeval/new_merchant_transactions.csv')
-history_transaction = pd.read_csv('../data/primeval/historical_transactions.csv')
-
-# 1、根据业务含义划分离散字段category_cols与连续字段numeric_cols。
-category_cols = ['merchant_id', 'merchant_group_id', 'merchant_category_id',
-                 'subsector_id', 'category_1',
-                 'most_recent_sales_range', 'most_recent_purchases_range',
-                 'category_4', 'city_id', 'state_id', 'category_2']
-numeric_cols = ['numerical_1', 'numerical_2',
-                'avg_sales_lag3', 'avg_purchases_lag3', 'active_months_lag3',
-                'avg_sales_lag6', 'avg_purchases_lag6', 'active_months_lag6',
-                'avg_sales_lag12', 'avg_purchases_lag12', 'active_months_lag12']
-
-# 2、对非数值型的离散字段进行字典排序编码。
-for col in ['category_1', 'most_recent_sales_range', 'most_recent_purchases_range', 'category_4']:
-    merchant[col] = change_object_cols(merchant[col])
-
-# 3、为了能够更方便统计，进行缺失值的处理，对离散字段统一用-1进行填充。
-merchant[category_cols] = merchant[category_cols].fillna(-1)
-
-# 4、对离散型字段探查发现有正无穷值，这是特征提取以及模型所不能接受的，因此需要对无限值进行处理，此处采用最大值进行替换。
-inf_cols = ['avg_purchases_lag3', 'avg_purchases_lag6', 'avg_purchases_lag12']
-merchant[inf_cols] = merchant[inf_cols].replace(np.inf, merchant[inf_cols].replace(np.inf, -99).max().max())
-
-# 5、平均值进行填充，后续有需要再进行优化处理。
-for col in numeric_cols:
-    merchant[col] = merchant[col].fillna(merchant[col].mean())
-
-# 6、去除与transaction交易记录表格重复的列，以及merchant_id的重复记录。
-duplicate_cols = ['merchant_id', 'merchant_category_id', 'subsector_id', 'category_1', 'city_id', 'state_id',
-                  'category_2']
-merchant = merchant.drop(duplicate_cols[1:], axis=1)
-merchant = merchant.loc[merchant['merchant_id'].drop_duplicates().index.tolist()].reset_index(drop=True)
-
-# 1、为了统一处理，首先拼接new和history两张表格，后续可以month_lag>=0进行区分。
-transaction = pd.concat([new_transaction, history_transaction], axis=0, ignore_index=True)
-del new_transaction
-del history_transaction
-gc.collect()
-
-# 2、同样划分离散字段、连续字段以及时间字段。
-numeric_cols = ['installments', 'month_lag', 'purchase_amount']
-category_cols = ['authorized_flag', 'card_id', 'city_id', 'category_1',
-                 'category_3', 'merchant_category_id', 'merchant_id', 'category_2', 'state_id',
-                 'subsector_id']
-time_cols = ['purchase_date']
-
-# 3、可仿照merchant的处理方式对字符型的离散特征进行字典序编码以及缺失值填充。
-for col in ['authorized_flag', 'category_1', 'category_3']:
-    transaction[col] = change_object_cols(transaction[col].fillna(-1).astype(str))
-transaction[category_cols] = transaction[category_cols].fillna(-1)
-transaction['category_2'] = transaction['category_2'].astype(int)
-
-# 4、进行时间段的处理，简单起见进行月份、日期的星期数（工作日与周末）、以及
-# 时间段（上午、下午、晚上、凌晨）的信息提取。
-transaction['purchase_month'] = transaction['purchase_date'].apply(lambda x: '-'.join(x.split(' ')[0].split('-')[:2]))
-transaction['purchase_hour_section'] = transaction['purchase_date'].apply(
-    lambda x: x.split(' ')[1].split(':')[0]).astype(int) // 6
-transaction['purchase_day'] = transaction['purchase_date'].apply(
-    lambda x: datetime.strptime(x.split(" ")[0], "%Y-%m-%d").weekday()) // 5
-del transaction['purchase_date']
-
-# 5、对新生成的购买月份离散字段进行字典序编码。
-transaction['purchase_month'] = change_object_cols(transaction['purchase_month'].fillna(-1).astype(str))
-
-cols = ['merchant_id', 'most_recent_sales_range', 'most_recent_purchases_range', 'category_4']
-transaction = pd.merge(transaction, merchant[cols], how='left', on='merchant_id')
-
-numeric_cols = ['purchase_amount', 'installments']
-
-category_cols = ['authorized_flag', 'city_id', 'category_1',
-                 'category_3', 'merchant_category_id', 'month_lag', 'most_recent_sales_range',
-                 'most_recent_purchases_range', 'category_4',
-                 'purchase_month', 'purchase_hour_section', 'purchase_day']
-
-id_cols = ['card_id', 'merchant_id']
-
-transaction['purchase_day_diff'] = transaction.groupby("card_id")['purchase_day'].diff()
-transaction['purchase_month_diff'] = transaction.groupby("card_id")['purchase_month'].diff()
-
-transaction.to_csv("../data/primeval/preprocess/transaction_g_pre.csv", index=False)
-
-del transaction
-gc.collect()
+# 商户清洗、交易编码、日期特征与商户字段合并只计算一次，方案1与方案2在公共中间表上分别输出：
+# 方案1 transaction_d_pre：对缺失值进行-1填补，离散型字段为后续字典合并做准备；
+# 方案2 transaction_g_pre：新增purchase_day_diff和purchase_month_diff，为以card_id进行groupby后purchase_day/month的差分结果。
+# card_features：以card_id为粒度的交易聚合特征，可与train_pre/test_pre按card_id关联。
+# transaction_card_pre：按(card_id, purchase_date)排序的交易表与每张卡的行区间，差分按时间顺序计算，
+# 可用card_layout.open_card_layout按卡号内存映射查询（lazy后端不生成）。
+# 具体步骤见preprocess.py。
+# 默认以列式二进制格式输出（每个输出一个目录，每列一个.npy，见columnar.py），下游可用columnar.read_table按列内存映射读取；
+# --format csv保持原先的csv输出。
+# --incremental只重新处理新增或变化的月份分区，并只对有新交易的卡重新计算差分，见incremental.py。
+# --backend lazy以polars惰性查询执行相同步骤，流式输出csv/parquet，--partitions按card_id分区以处理超过内存的数据，见lazy_backend.py。
+# 每个步骤结束时在日志中输出一行json（耗时、CPU时间、行数、RSS），--profile-memory额外记录memory_usage(deep=True)，
+# --profile-dir对每个步骤用cProfile采集调用剖析并保存.prof文件，见profiling.py。
+parser = argparse.ArgumentParser()
+parser.add_argument('--backend', choices=['pandas', 'lazy'], default='pandas')
+parser.add_argument('--format', choices=preprocess.OUTPUT_FORMATS + lazy_backend.LAZY_OUTPUT_FORMATS, default=None)
+parser.add_argument('--incremental', action='store_true')
+parser.add_argument('--partitions', type=int, default=1)
+parser.add_argument('--log-file', default='./log/04_date_analysis.log')
+parser.add_argument('--console', action='store_true')
+parser.add_argument('--profile-memory', action='store_true')
+parser.add_argument('--profile-dir', default=None)
+# 沿用上次保存的商户清洗参数（../data/model/merchant_stats.json），不在当前商户表上重新拟合
+parser.add_argument('--frozen-merchant-stats', action='store_true')
+args = parser.parse_args()
+formats = lazy_backend.LAZY_OUTPUT_FORMATS if args.backend == 'lazy' else preprocess.OUTPUT_FORMATS
+args.format = args.format or ('csv' if args.backend == 'lazy' else 'npy')
+if args.format not in formats:
+    parser.error('--format %s is not supported by the %s backend' % (args.format, args.backend))
+if args.backend == 'lazy' and args.incremental:
+    parser.error('--incremental requires the pandas backend')
+
+setup_logger(args.log_file, console=args.console)
+setup_profiler(memory=args.profile_memory, profile_dir=args.profile_dir)
+
+if args.backend == 'lazy':
+    lazy_backend.run_lazy(outputs=('d', 'g', 'card'), fmt=args.format, partitions=args.partitions,
+                          refit_merchant=not args.frozen_merchant_stats)
+elif args.incremental:
+    incremental.run_incremental(outputs=('d', 'g', 'card', 'layout', 'window'), fmt=args.format,
+                                refit_merchant=not args.frozen_merchant_stats)
+else:
+    preprocess.run(outputs=('d', 'g', 'card', 'layout', 'window'), fmt=args.format,
+                   refit_merchant=not args.frozen_merchant_stats)
@@ -0,0 +1,52 @@
+# 卡粒度聚合特征的一致性校验与耗时
+# 用法: python bench_card_features.py --rows 31000000 --cards 325000
+# 输入为synthetic.make_encoded_transaction得到的公共中间表（与preprocess.build_transaction的输出相同），
+# 先在小样本上与pandas groupby的结果逐列比对，再在给定规模的合成数据上计时。
+
+import argparse
+
+import numpy as np
+
+from bench_utils import timed
+from card_features import AGG_COLS, NUNIQUE_COLS, card_features
+from synthetic import MERCHANT_ROWS, make_encoded_transaction
+
+
+def check_parity(transaction):
+    features = card_features(transaction).set_index('card_id')
+    grouped = transaction.groupby(transaction['card_id'].astype(str))
+    expected = {'transaction_count': grouped.size()}
+    for col in AGG_COLS:
+        agg = grouped[col].agg(['sum', 'mean', 'std', 'min', 'max'])
+        for stat in agg.columns:
+            expected['%s_%s' % (col, stat)] = agg[stat]
+    for col in NUNIQUE_COLS:
+        expected[col + '_nunique'] = grouped[col].nunique()
+    lag = transaction.pivot_table(index=transaction['card_id'].astype(str), columns='month_lag',
+                                  values='purchase_amount', aggfunc=['count', 'sum'], fill_value=0)
+    for value in lag.columns.levels[1]:
+        expected['month_lag_%d_count' % value] = lag[('count', value)]
+        expected['month_lag_%d_purchase_amount_sum' % value] = lag[('sum', value)]
+    for name, se in expected.items():
+        np.testing.assert_allclose(features.loc[se.index, name].values.astype(np.float64),
+                                   se.values.astype(np.float64), rtol=1e-5, atol=1e-6, err_msg=name)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000000)
+    parser.add_argument('--cards', type=int, default=325000)
+    parser.add_argument('--merchants', type=int, default=MERCHANT_ROWS)
+    args = parser.parse_args()
+
+    check_parity(make_encoded_transaction(200000, 5000, 5000, seed=1)[0])
+    print('parity ok')
+
+    transaction, _ = make_encoded_transaction(args.rows, args.cards, args.merchants)
+    features, elapsed = timed(card_features, transaction)
+    print('rows: %d, cards: %d, features: %d' % (args.rows, len(features), features.shape[1] - 1))
+    print('card_features: %.2fs' % elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+# 按卡布局的正确性校验与按卡查询耗时对比
+# 用法: python bench_card_layout.py --rows 2000000 --lookups 1000
+# 以synthetic.py生成数据并运行预处理（含transaction_card_pre），校验：
+# - 布局与pandas按(card_id, purchase_date)稳定排序的结果一致，差分列与排序后groupby(card_id).diff()一致；
+# - 按卡查询的结果与按card_id过滤整张表的结果一致；
+# - 在布局上用分段归约计算的卡粒度特征与card_features一致（浮点列允许求和顺序带来的舍入差异）。
+# 并对比按卡查询（内存映射切片 vs 整表过滤）与卡粒度特征（已排序分段 vs 重新分组）的耗时。
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from card_features import card_features
+from card_layout import CARD_LAYOUT_NAME, TIME_DIFF_COLS, open_card_layout
+from preprocess import run
+from synthetic import generate
+
+
+def expected_layout(transaction):
+    # pandas参考实现：按卡号字符串与购买时间稳定排序后分组差分
+    expected = transaction.assign(card_id=transaction['card_id'].astype(str))
+    expected = expected.sort_values(['card_id', 'purchase_date'], kind='mergesort').reset_index(drop=True)
+    for diff_col, col in TIME_DIFF_COLS.items():
+        expected[diff_col] = expected.groupby('card_id')[col].diff()
+    return expected
+
+
+def assert_same_layout(layout, expected):
+    result = layout.table.to_frame()
+    result['card_id'] = result['card_id'].astype(str)
+    pd.testing.assert_frame_equal(result, expected[result.columns], check_dtype=False, check_categorical=False)
+    assert np.all(np.diff(layout.offsets) > 0)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--cards', type=int, default=50000)
+    parser.add_argument('--merchants', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--lookups', type=int, default=1000)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        primeval_dir = os.path.join(root, 'primeval')
+        generate(primeval_dir, args.rows, args.cards, args.merchants, args.seed)
+        for name in ['cache', 'preprocess']:
+            os.makedirs(os.path.join(root, name))
+        transaction = run(('layout',), primeval_dir, os.path.join(root, 'cache'), os.path.join(root, 'preprocess'),
+                          os.path.join(root, 'codebook.json'), fmt='npy')
+        layout = open_card_layout(os.path.join(root, 'preprocess', CARD_LAYOUT_NAME))
+        expected = expected_layout(transaction)
+        assert_same_layout(layout, expected)
+        print('layout: %d rows, %d cards, sorted and time-ordered diffs match' % (layout.table.rows, layout.cards))
+
+        rng = np.random.RandomState(args.seed)
+        cards = rng.choice(np.asarray(layout.card_ids), min(args.lookups, layout.cards), replace=False)
+        card_id = transaction['card_id']
+        start = time.perf_counter()
+        scans = [np.flatnonzero((card_id == card).values) for card in cards]
+        scan_time = time.perf_counter() - start
+        start = time.perf_counter()
+        slices = [layout.lookup(card, ['purchase_amount']) for card in cards]
+        lookup_time = time.perf_counter() - start
+        amount = transaction['purchase_amount'].values
+        for rows, values in zip(scans, slices):
+            assert np.array_equal(np.sort(amount[rows]), np.sort(values['purchase_amount']))
+        print('per-card lookup x%d: scan %.3fs, layout %.4fs (%.0fx)'
+              % (len(cards), scan_time, lookup_time, scan_time / max(lookup_time, 1e-9)))
+
+        start = time.perf_counter()
+        grouped = card_features(transaction)
+        group_time = time.perf_counter() - start
+        start = time.perf_counter()
+        segmented = layout.card_features()
+        segment_time = time.perf_counter() - start
+        grouped = grouped.assign(card_id=grouped['card_id'].astype(str)).sort_values('card_id').reset_index(drop=True)
+        segmented['card_id'] = segmented['card_id'].astype(str)
+        pd.testing.assert_frame_equal(segmented, grouped, check_dtype=False, rtol=1e-9)
+        print('card features: group %.3fs, layout segments %.3fs, match' % (group_time, segment_time))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# 列式二进制输出与csv输出的对比
+# 用法: python bench_columnar.py --rows 5000000 --columns card_id purchase_amount month_lag
+# 以synthetic.py生成数据并经loader加载，构建方案1输出，分别写为csv与列式目录，校验读回结果一致，并记录写入耗时、文件大小以及只读取部分列的耗时。
+
+import argparse
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+
+from bench_utils import timed
+from columnar import read_table, write_table
+from encoder import CategoryEncoder
+from loader import load_table, load_transactions
+from preprocess import build_transaction, clean_merchant, output_codebooks, transaction_d
+from synthetic import CARDS, MERCHANT_ROWS, generate
+
+
+def dir_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--cards', type=int, default=CARDS)
+    parser.add_argument('--merchants', type=int, default=MERCHANT_ROWS)
+    parser.add_argument('--columns', nargs='+', default=['card_id', 'purchase_amount', 'month_lag'])
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        primeval_dir = os.path.join(directory, 'primeval')
+        cache_dir = os.path.join(directory, 'cache')
+        generate(primeval_dir, args.rows, args.cards, args.merchants)
+        encoder = CategoryEncoder()
+        merchant = clean_merchant(load_table('merchants', primeval_dir=primeval_dir, cache_dir=cache_dir), encoder)
+        transaction = load_transactions(primeval_dir=primeval_dir, cache_dir=cache_dir)
+        transaction = transaction_d(build_transaction(transaction, merchant, encoder))
+
+        csv_path = os.path.join(directory, 'transaction_d_pre.csv')
+        npy_path = os.path.join(directory, 'transaction_d_pre')
+        _, csv_write = timed(transaction.to_csv, csv_path, index=False)
+        _, npy_write = timed(write_table, transaction, npy_path, output_codebooks(encoder))
+
+        csv_frame, csv_read = timed(pd.read_csv, csv_path, usecols=args.columns)
+        npy_frame, npy_read = timed(read_table, npy_path, args.columns)
+        pd.testing.assert_frame_equal(npy_frame.astype(str), csv_frame[args.columns].astype(str))
+        full, _ = timed(read_table, npy_path)
+        pd.testing.assert_frame_equal(full, transaction, check_dtype=False, check_categorical=False)
+
+        print('write  csv: %.2fs  npy: %.2fs' % (csv_write, npy_write))
+        print('size   csv: %.1fMB  npy: %.1fMB' % (dir_size(csv_path) / 2 ** 20, dir_size(npy_path) / 2 ** 20))
+        print('read %s  csv: %.2fs  npy: %.3fs' % (','.join(args.columns), csv_read, npy_read))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# 稀疏计数矩阵与字符串转换+透视写法的一致性校验、耗时与内存对比
+# 用法: python bench_crosstab.py --rows 31000000 --cards 325000
+# 输入为方案1的交易表：synthetic.make_encoded_transaction得到的公共中间表经preprocess.transaction_d填充缺失值。
+# 另校验训练集与测试集字段类型不同时沿用词表的结果：训练集为填充前的中间表（合并商户字段为含缺失值的浮点列），
+# 测试集为填充后的整数列，经save/load后转换测试集，应与在填充后的训练集上拟合的结果一致。
+
+import argparse
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from bench_utils import timed
+from crosstab import CrossTab
+from preprocess import TRANSACTION_D_CATEGORY_COLS, transaction_d
+from synthetic import MERCHANT_ROWS, make_encoded_transaction
+
+COLS = TRANSACTION_D_CATEGORY_COLS
+
+
+def make_transaction(rows, cards, merchants, seed=0):
+    return transaction_d(make_encoded_transaction(rows, cards, merchants, seed)[0])
+
+
+def string_pivot(transaction):
+    # 原先的写法：离散字段转字符串后逐字段按卡统计各取值出现次数
+    blocks = []
+    for col in COLS:
+        values = col + '=' + transaction[col].astype(str)
+        blocks.append(pd.crosstab(transaction['card_id'].astype(str), values))
+    return pd.concat(blocks, axis=1).fillna(0)
+
+
+def reapply_check():
+    encoded = make_encoded_transaction(100000, 2000, 2000, seed=2)[0]
+    float_cols = [col for col in COLS if encoded[col].dtype.kind == 'f' and encoded[col].isnull().any()]
+    assert float_cols, 'no float column with missing values in the train sample'
+    train, test = encoded.iloc[:50000], transaction_d(encoded.iloc[50000:].copy())
+
+    expected, _ = CrossTab(COLS).fit(transaction_d(train.copy())).transform(test)
+    path = os.path.join(tempfile.mkdtemp(), 'crosstab_vocab.json')
+    CrossTab(COLS).fit(train).save(path)
+    actual, _ = CrossTab.load(path, COLS).transform(test)
+    os.remove(path)
+    os.rmdir(os.path.dirname(path))
+    assert (actual != expected).nnz == 0
+    print('reapply ok (float train columns: %s)' % ', '.join(float_cols))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--cards', type=int, default=100000)
+    parser.add_argument('--merchants', type=int, default=MERCHANT_ROWS)
+    args = parser.parse_args()
+
+    sample = make_transaction(100000, 2000, 2000, seed=1)
+    crosstab = CrossTab(COLS).fit(sample)
+    matrix, card_ids = crosstab.transform(sample)
+    expected = string_pivot(sample)
+    actual = pd.DataFrame(matrix.toarray(), index=card_ids.astype(str), columns=crosstab.feature_names())
+    actual = actual.loc[expected.index, expected.columns]
+    assert np.array_equal(actual.values, expected.values)
+    print('parity ok')
+    reapply_check()
+
+    transaction = make_transaction(args.rows, args.cards, args.merchants)
+    (matrix, _), sparse_time = timed(CrossTab(COLS).fit_transform, transaction)
+    sparse_mb = (matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes) / 2 ** 20
+
+    dense, pivot_time = timed(string_pivot, transaction)
+    pivot_mb = dense.memory_usage(deep=True).sum() / 2 ** 20
+
+    print('rows: %d, cards: %d, columns: %d, nnz: %d' % (args.rows, matrix.shape[0], matrix.shape[1], matrix.nnz))
+    print('%-8s %10s %12s' % ('', 'seconds', 'result_mb'))
+    print('%-8s %10.2f %12.1f' % ('pivot', pivot_time, pivot_mb))
+    print('%-8s %10.2f %12.1f' % ('sparse', sparse_time, sparse_mb))
+
+
+if __name__ == '__main__':
+    main()
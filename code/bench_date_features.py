@@ -0,0 +1,63 @@
+# 日期特征提取的一致性校验与耗时对比
+# 用法: python bench_date_features.py --rows 31000000
+# 先用与04完全相同的逐行apply写法计算一遍作为基准，再与date_features的向量化结果逐列比对，最后输出两者耗时。
+
+import argparse
+from datetime import datetime
+
+import pandas as pd
+
+from bench_utils import timed
+from date_features import date_features
+from synthetic import make_purchase_dates
+
+
+def change_object_cols(se):
+    value = se.unique().tolist()
+    value.sort()
+    return se.map(pd.Series(range(len(value)), index=value)).values
+
+
+def legacy_date_features(se):
+    # 04中原有的逐行实现
+    purchase_month = se.apply(lambda x: '-'.join(x.split(' ')[0].split('-')[:2]))
+    purchase_hour_section = se.apply(lambda x: x.split(' ')[1].split(':')[0]).astype(int) // 6
+    purchase_day = se.apply(lambda x: datetime.strptime(x.split(" ")[0], "%Y-%m-%d").weekday()) // 5
+    return {
+        'purchase_month': purchase_month,
+        'purchase_hour_section': purchase_hour_section.values,
+        'purchase_day': purchase_day.values,
+    }
+
+
+def check_parity(se):
+    legacy = legacy_date_features(se)
+    fast = date_features(se)
+    # 月份经过字典序编码后需要得到完全相同的编码
+    assert (change_object_cols(legacy['purchase_month'].fillna(-1).astype(str)) ==
+            change_object_cols(pd.Series(fast['purchase_month']).astype(str))).all()
+    assert (legacy['purchase_hour_section'] == fast['purchase_hour_section']).all()
+    assert (legacy['purchase_day'] == fast['purchase_day']).all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--parity-rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    check_parity(make_purchase_dates(args.parity_rows, seed=1))
+    print('parity ok on %d rows' % args.parity_rows)
+
+    se = make_purchase_dates(args.rows)
+    _, legacy_time = timed(legacy_date_features, se)
+    _, fast_time = timed(date_features, se)
+
+    print('rows: %d' % args.rows)
+    print('apply:      %.3fs' % legacy_time)
+    print('vectorized: %.3fs' % fast_time)
+    print('speedup:    %.1fx' % (legacy_time / fast_time))
+
+
+if __name__ == '__main__':
+    main()
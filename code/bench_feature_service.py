@@ -0,0 +1,193 @@
+# 在线特征服务的一致性校验与延迟基准
+# 用法: python bench_feature_service.py --rows 2000000 --requests 2000
+# 以synthetic.py生成数据并离线运行预处理，载入FeatureStore后：
+# - 以new_merchant_transactions中各卡的交易作为请求，校验在线编码清洗结果与preprocess.build_transaction一致，
+#   本次请求的聚合特征与card_features一致；
+# - 分别统计进程内调用与经本地HTTP服务（keep-alive连接）的单卡请求延迟p50/p99；
+# - 校验载入FeatureStore不写任何文件，格式错误的请求行、Content-Length以及不是json对象或字段类型不符的请求体返回400，
+#   商户文件变化或清洗缓存缺失时FeatureStore报错而不是重新清洗。
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from card_features import card_features
+from encoder import CategoryEncoder
+from feature_service import BATCH_PREFIX, FeatureStore, start_server
+from loader import load_table
+from preprocess import TRANSACTION_DTYPES, build_transaction, clean_merchant, run
+from synthetic import generate
+
+
+def make_requests(primeval_dir, count, seed):
+    # 每个请求为一张卡在new_merchant_transactions中的全部交易，取值经过json往返，与线上请求一致
+    raw = pd.read_csv(os.path.join(primeval_dir, 'new_merchant_transactions.csv'), dtype=TRANSACTION_DTYPES)
+    cards = raw['card_id'].unique()
+    cards = np.random.RandomState(seed).choice(cards, min(count, len(cards)), replace=False)
+    groups = [group for _, group in raw[raw['card_id'].isin(cards)].groupby('card_id', sort=False)]
+    # 返回的原始交易与请求中的交易顺序相同
+    return pd.concat(groups, ignore_index=True), [json.loads(group.to_json(orient='records')) for group in groups]
+
+
+def check_parity(store, raw, requests, primeval_dir, cache_dir, codebook_path):
+    encoder = CategoryEncoder.load(codebook_path)
+    merchant = clean_merchant(load_table('merchants', primeval_dir=primeval_dir, cache_dir=cache_dir), encoder)
+    records = [record for request in requests for record in request]
+    expected = build_transaction(raw.copy(), merchant, encoder, diffs=False)
+    result = store.transform(records)
+    for col in ['card_id', 'merchant_id']:
+        expected[col] = expected[col].astype(str)
+        result[col] = result[col].astype(str)
+    pd.testing.assert_frame_equal(result, expected[result.columns], check_dtype=False)
+
+    features = card_features(expected, lags=store.lags)
+    card_ids, values = store.features(records=records)
+    batch = pd.DataFrame(values[:, -len(store.feature_cols):], columns=store.feature_cols)
+    batch.insert(0, 'card_id', card_ids)
+    features = features.set_index('card_id').loc[card_ids].reset_index()
+    pd.testing.assert_frame_equal(batch, features[batch.columns], check_dtype=False, rtol=1e-9)
+
+
+def percentiles(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return 'p50 %.2fms  p99 %.2fms  mean %.2fms' % (np.percentile(latencies, 50), np.percentile(latencies, 99),
+                                                    latencies.mean())
+
+
+async def http_latencies(store, requests):
+    server = await start_server(store, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    latencies = []
+    try:
+        for request in requests:
+            body = json.dumps({'transactions': request}).encode()
+            start = time.perf_counter()
+            writer.write(b'POST /features HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                         b'Content-Length: %d\r\n\r\n' % len(body) + body)
+            await writer.drain()
+            assert (await reader.readline()).startswith(b'HTTP/1.1 200')
+            length = 0
+            while True:
+                header = await reader.readline()
+                if header == b'\r\n':
+                    break
+                if header.lower().startswith(b'content-length:'):
+                    length = int(header.split(b':')[1])
+            response = json.loads(await reader.readexactly(length))
+            latencies.append(time.perf_counter() - start)
+            assert len(response['features']) == 1
+    finally:
+        # 先关闭客户端连接，服务端读到EOF后结束该连接的处理
+        writer.close()
+        await writer.wait_closed()
+        await asyncio.sleep(0.01)
+        server.close()
+        await server.wait_closed()
+    return latencies
+
+
+def snapshot(root):
+    # 目录下全部文件的修改时间
+    return {os.path.join(path, name): os.stat(os.path.join(path, name)).st_mtime_ns
+            for path, _, names in os.walk(root) for name in names}
+
+
+def post_features(body):
+    return b'POST /features HTTP/1.1\r\nContent-Length: %d\r\n\r\n' % len(body) + body
+
+
+# 格式错误的请求行、Content-Length，以及不是json对象或card_ids、transactions类型不符的请求体
+MALFORMED_REQUESTS = [b'\r\n', b'GET\r\n\r\n', b'POST /features HTTP/1.1\r\nContent-Length: abc\r\n\r\n',
+                      post_features(b'[1, 2]'), post_features(b'"C_ID_0"'), post_features(b'{"card_ids": "C_ID_0"}'),
+                      post_features(b'{"card_ids": [1]}'), post_features(b'{"transactions": [1, 2]}')]
+
+
+async def malformed_statuses(store):
+    server = await start_server(store, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    statuses = []
+    try:
+        for request in MALFORMED_REQUESTS:
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(request)
+            await writer.drain()
+            statuses.append((await reader.readline()).split()[1])
+            writer.close()
+            await writer.wait_closed()
+    finally:
+        server.close()
+        await server.wait_closed()
+    return statuses
+
+
+def check_read_only(root, preprocess_dir, codebook_path, primeval_dir, cache_dir):
+    before = snapshot(root)
+    FeatureStore(preprocess_dir, codebook_path, primeval_dir, cache_dir)
+    assert snapshot(root) == before
+    # 商户文件变化后缓存过期，删除缓存后缓存缺失，两种情况都报错且不写文件
+    with open(os.path.join(primeval_dir, 'merchants.csv'), 'a') as f:
+        f.write('\n')
+    for error in [ValueError, FileNotFoundError]:
+        if error is FileNotFoundError:
+            shutil.rmtree(os.path.join(cache_dir, 'merchant_clean'))
+        before = snapshot(root)
+        try:
+            FeatureStore(preprocess_dir, codebook_path, primeval_dir, cache_dir)
+            raise AssertionError('stale or missing merchant cache was not rejected')
+        except error:
+            pass
+        assert snapshot(root) == before
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--cards', type=int, default=50000)
+    parser.add_argument('--merchants', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        primeval_dir, cache_dir, preprocess_dir = [os.path.join(root, name) for name in
+                                                   ['primeval', 'cache', 'preprocess']]
+        codebook_path = os.path.join(root, 'codebook.json')
+        generate(primeval_dir, args.rows, args.cards, args.merchants, args.seed)
+        for path in [cache_dir, preprocess_dir]:
+            os.makedirs(path)
+        run(('card',), primeval_dir, cache_dir, preprocess_dir, codebook_path, fmt='npy')
+
+        start = time.perf_counter()
+        store = FeatureStore(preprocess_dir, codebook_path, primeval_dir, cache_dir)
+        print('store loaded in %.2fs: %d cards, %d features'
+              % (time.perf_counter() - start, len(store.card_rows), len(store.feature_names)))
+        raw, requests = make_requests(primeval_dir, args.requests, args.seed)
+        check_parity(store, raw, requests, primeval_dir, cache_dir, codebook_path)
+        print('online transform and %s features match offline (%d requests, %d transactions)'
+              % (BATCH_PREFIX, len(requests), len(raw)))
+
+        latencies = []
+        for request in requests:
+            start = time.perf_counter()
+            store.features(records=request)
+            latencies.append(time.perf_counter() - start)
+        print('in-process: ' + percentiles(latencies))
+        print('http:       ' + percentiles(asyncio.run(http_latencies(store, requests))))
+        assert asyncio.run(malformed_statuses(store)) == [b'400'] * len(MALFORMED_REQUESTS)
+        check_read_only(root, preprocess_dir, codebook_path, primeval_dir, cache_dir)
+        print('malformed requests get 400; store loading writes nothing and rejects a stale or missing cache')
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
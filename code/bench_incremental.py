@@ -0,0 +1,96 @@
+# 增量预处理与全量重建的一致性校验与耗时对比
+# 用法: python bench_incremental.py --rows 2000000
+# 以synthetic.py生成数据，先去掉new_merchant_transactions中的最后一个月，依次模拟以下数据更新：
+# - 首次运行（没有增量状态）；
+# - new_merchant_transactions追加最后一个月；
+# - historical_transactions中修改两行、删除一行；
+# - 数据没有变化时重新运行。
+# 每一步分别运行incremental.run_incremental与preprocess.run（全量重建，从增量运行前的同一份码表开始），
+# 校验各csv输出与码表逐字节一致，并记录两者的耗时。
+
+import argparse
+import filecmp
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+from incremental import run_incremental
+from loader import TABLE_FILES
+from preprocess import run
+from synthetic import generate
+
+OUTPUTS = ('d', 'g', 'card', 'window')
+OUTPUT_FILES = ['train_pre.csv', 'test_pre.csv', 'transaction_d_pre.csv', 'transaction_g_pre.csv',
+                'card_features.csv', 'card_window_features.csv', 'codebook.json']
+
+
+def drop_last_month(path):
+    # 返回被去掉的最后一个月的行，之后可原样追加回去
+    df = pd.read_csv(path)
+    month = df['purchase_date'].str[:7]
+    df[month != month.max()].to_csv(path, index=False)
+    return df[month == month.max()]
+
+
+def edit_history(path):
+    df = pd.read_csv(path)
+    df.loc[100, 'purchase_amount'] = 1.5
+    df.loc[200, 'installments'] = 7
+    df.drop(index=300).to_csv(path, index=False)
+
+
+def run_both(primeval_dir, root, step):
+    # 增量运行沿用root/incremental下的状态与码表；全量重建从增量运行前的码表开始，输出写到各自的目录
+    inc_dir = os.path.join(root, 'incremental')
+    full_dir = os.path.join(root, 'full_%s' % step)
+    os.makedirs(full_dir)
+    inc_codebook = os.path.join(inc_dir, 'codebook.json')
+    if os.path.exists(inc_codebook):
+        shutil.copy(inc_codebook, os.path.join(full_dir, 'codebook.json'))
+
+    start = time.perf_counter()
+    run_incremental(OUTPUTS, primeval_dir, os.path.join(root, 'cache_incremental'), inc_dir, inc_codebook,
+                    os.path.join(root, 'state'), fmt='csv')
+    inc_time = time.perf_counter() - start
+    start = time.perf_counter()
+    run(OUTPUTS, primeval_dir, os.path.join(root, 'cache_full'), full_dir, os.path.join(full_dir, 'codebook.json'),
+        fmt='csv')
+    full_time = time.perf_counter() - start
+
+    differ = [name for name in OUTPUT_FILES
+              if not filecmp.cmp(os.path.join(inc_dir, name), os.path.join(full_dir, name), shallow=False)]
+    assert not differ, '%s: incremental differs from full rebuild in %s' % (step, differ)
+    print('%-14s incremental %.2fs  full %.2fs  outputs and codebook match' % (step, inc_time, full_time))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--cards', type=int, default=50000)
+    parser.add_argument('--merchants', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        primeval_dir = os.path.join(root, 'primeval')
+        generate(primeval_dir, args.rows, args.cards, args.merchants, args.seed)
+        os.makedirs(os.path.join(root, 'incremental'))
+        new_path = os.path.join(primeval_dir, TABLE_FILES['new_merchant_transactions'])
+        last_month = drop_last_month(new_path)
+
+        run_both(primeval_dir, root, 'initial')
+        last_month.to_csv(new_path, mode='a', header=False, index=False)
+        run_both(primeval_dir, root, 'new_month')
+        edit_history(os.path.join(primeval_dir, TABLE_FILES['historical_transactions']))
+        run_both(primeval_dir, root, 'edit_history')
+        run_both(primeval_dir, root, 'no_change')
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
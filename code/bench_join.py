@@ -0,0 +1,55 @@
+# 商户字段关联：字符串hash merge与整数代理键gather的耗时、临时内存对比
+# 用法: python bench_join.py --rows 31000000 --merchants 335000
+# 数据由synthetic.make_tables生成（约0.5%的交易商户缺失），商户表经clean_merchant编码后关联；
+# 临时内存使用tracemalloc统计峰值（numpy与pandas的数组分配均会计入）。
+
+import argparse
+
+import pandas as pd
+
+from bench_utils import traced
+from encoder import CategoryEncoder
+from join import MerchantAttributes, merge_merchant
+from preprocess import MERCHANT_MERGE_COLS, clean_merchant
+from synthetic import CARDS, make_tables
+
+MERGE_COLS = MERCHANT_MERGE_COLS[1:]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000000)
+    parser.add_argument('--cards', type=int, default=CARDS)
+    parser.add_argument('--merchants', type=int, default=335000)
+    args = parser.parse_args()
+
+    categorical, merchant = make_tables(args.rows, args.cards, args.merchants)
+    categorical = categorical[['merchant_id', 'purchase_amount']]
+    merchant = clean_merchant(merchant, CategoryEncoder())
+    merchant['merchant_id'] = merchant['merchant_id'].astype(object)
+    # 原先字符串形式的merchant_id
+    transaction = categorical.assign(merchant_id=categorical['merchant_id'].astype(object))
+    deduped = merchant.drop_duplicates('merchant_id')
+
+    merged, merge_time, merge_mb = traced(
+        lambda: pd.merge(transaction, deduped[['merchant_id'] + MERGE_COLS], how='left', on='merchant_id'))
+    attributes = MerchantAttributes(merchant, MERGE_COLS)
+    gathered, gather_time, gather_mb = traced(
+        lambda: merge_merchant(transaction.copy(deep=False), attributes, MERGE_COLS))
+
+    # loader加载的merchant_id为category类型，代理键只需对类别查找一次
+    _, category_time, category_mb = traced(
+        lambda: merge_merchant(categorical.copy(deep=False), attributes, MERGE_COLS))
+
+    for col in MERGE_COLS:
+        assert merged[col].equals(gathered[col])
+
+    print('rows: %d, merchants: %d' % (args.rows, len(merchant)))
+    print('%-8s %10s %12s' % ('', 'seconds', 'peak_mb'))
+    print('%-8s %10.2f %12.1f' % ('merge', merge_time, merge_mb))
+    print('%-8s %10.2f %12.1f' % ('gather', gather_time, gather_mb))
+    print('%-8s %10.2f %12.1f' % ('category', category_time, category_mb))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# 原始csv与列式缓存的加载耗时、内存对比
+# 用法: python bench_loader.py --table historical_transactions
+# 每种方式在独立子进程中运行，分别记录加载耗时、DataFrame内存占用(memory_usage(deep=True))与进程峰值RSS。
+# csv为pandas默认类型（int64/float64/object），cache为声明类型并经downcast.py压缩后的结果；
+# --table all依次对比全部表并输出内存合计，即04等脚本加载原始数据后的工作集大小。
+
+import argparse
+import os
+
+import pandas as pd
+
+import loader
+from bench_utils import isolated
+
+
+def load(method, name):
+    # 返回加载后DataFrame的内存占用
+    if method == 'csv':
+        df = pd.read_csv(os.path.join(loader.PRIMEVAL_DIR, loader.TABLE_FILES[name]))
+    else:
+        df = loader.load_table(name)
+    return df.memory_usage(deep=True).sum() / 2 ** 20
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--table', default='historical_transactions', choices=list(loader.TABLE_FILES) + ['all'])
+    args = parser.parse_args()
+
+    tables = list(loader.TABLE_FILES) if args.table == 'all' else [args.table]
+    totals = {'csv': 0.0, 'cache': 0.0}
+    for name in tables:
+        if not loader.is_fresh(name):
+            loader.build_cache(name)
+
+        csv = isolated(load, 'csv', name)
+        cache = isolated(load, 'cache', name)
+        print(name)
+        print('%-8s %10s %12s %14s' % ('', 'seconds', 'frame_mb', 'peak_rss_mb'))
+        for method, result in [('csv', csv), ('cache', cache)]:
+            print('%-8s %10.2f %12.1f %14.1f' % (method, result['seconds'], result['result'], result['peak_rss_mb']))
+            totals[method] += result['result']
+        print('load time: %.1fx faster, frame memory: %.1fx smaller'
+              % (csv['seconds'] / cache['seconds'], csv['result'] / cache['result']))
+    if len(tables) > 1:
+        print('total frame memory: csv %.1fMB, cache %.1fMB, %.1fx smaller'
+              % (totals['csv'], totals['cache'], totals['csv'] / totals['cache']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+# 商户清洗的一致性校验与耗时对比
+# 用法: python bench_merchant_cleaner.py --merchants 335000
+# 以synthetic.py生成商户表（含无穷值与缺失值），校验：
+# - MerchantCleaner的fit/transform与原先逐列replace/fillna的实现一致（统计量在float32块上计算，允许1e-6的相对误差）；
+# - 用保存的参数transform与重新拟合的结果一致，缓存命中时读取的商户表与清洗结果一致。
+# 并对比原实现、fit/transform与读取缓存的耗时。
+
+import argparse
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from bench_utils import timed
+from encoder import CategoryEncoder
+from loader import load_table
+from preprocess import (MERCHANT_CATEGORY_COLS, MERCHANT_DUPLICATE_COLS, MERCHANT_INF_COLS, MERCHANT_NUMERIC_COLS,
+                        MERCHANT_OBJECT_COLS, MerchantCleaner, fillna_cols, load_clean_merchant)
+from synthetic import generate
+
+
+def reference_clean(merchant, encoder):
+    # 原先preprocess.clean_merchant的实现
+    for col in MERCHANT_OBJECT_COLS:
+        merchant[col] = encoder.encode('merchants.' + col, merchant[col])
+    merchant = fillna_cols(merchant, MERCHANT_CATEGORY_COLS)
+    inf_cols = MERCHANT_INF_COLS
+    merchant[inf_cols] = merchant[inf_cols].replace(np.inf, merchant[inf_cols].replace(np.inf, -99).max().max())
+    for col in MERCHANT_NUMERIC_COLS:
+        merchant[col] = merchant[col].fillna(merchant[col].mean())
+    merchant = merchant.drop(MERCHANT_DUPLICATE_COLS[1:], axis=1)
+    return merchant.drop_duplicates('merchant_id').reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--merchants', type=int, default=335000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        primeval_dir, cache_dir = os.path.join(root, 'primeval'), os.path.join(root, 'cache')
+        stats_path = os.path.join(root, 'merchant_stats.json')
+        generate(primeval_dir, 1000, 1000, args.merchants, args.seed)
+        merchant = load_table('merchants', primeval_dir=primeval_dir, cache_dir=cache_dir)
+        print('merchants: %d rows, %d inf, %d missing numeric values'
+              % (len(merchant), np.isposinf(merchant[MERCHANT_INF_COLS].values).sum(),
+                 merchant[MERCHANT_NUMERIC_COLS].isnull().values.sum()))
+
+        expected, reference_time = timed(reference_clean, merchant.copy(), CategoryEncoder())
+        cleaner, fit_time = timed(MerchantCleaner().fit, merchant)
+        result, transform_time = timed(cleaner.transform, merchant.copy(), CategoryEncoder())
+        pd.testing.assert_frame_equal(result, expected, rtol=1e-6)
+        print('reference %.3fs, fit %.3fs + transform %.3fs, match' % (reference_time, fit_time, transform_time))
+
+        cleaner.save(stats_path)
+        frozen = MerchantCleaner.load(stats_path).transform(merchant.copy(), CategoryEncoder())
+        pd.testing.assert_frame_equal(frozen, result)
+
+        encoder = CategoryEncoder()
+        cold, cold_time = timed(load_clean_merchant, encoder, primeval_dir, cache_dir, stats_path)
+        cached, cached_time = timed(load_clean_merchant, encoder, primeval_dir, cache_dir, stats_path)
+        pd.testing.assert_frame_equal(cached, cold, check_dtype=False, check_categorical=False)
+        print('load and clean %.3fs, cached %.3fs, match' % (cold_time, cached_time))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+# 端到端性能基准
+# 用法: python bench_pipeline.py --rows 10000000 --report ./log/bench.json --baseline ./log/bench_prev.json
+# 在临时目录中按与仓库相同的目录结构(data/primeval、data/model、code)生成合成数据，
+# 依次在独立子进程中运行各阶段，记录耗时、CPU时间与子进程峰值内存(RSS)，以及profiling输出的各步骤汇总，结果写入json报告；
+# 指定--baseline时与上一次的报告逐阶段比较，耗时或峰值内存超出容忍比例的阶段视为退化，以非零状态退出。
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+# 阶段名 -> 在子进程（工作目录为<root>/code）中执行的函数
+STAGES = ['generate', 'cache', 'eda', 'drift', 'preprocess', 'preprocess_csv', 'stream', 'lazy']
+
+
+def stage_generate(args):
+    from synthetic import generate
+    generate('../data/primeval', args.rows, args.cards, args.merchants, args.seed)
+
+
+def stage_cache(args):
+    from loader import TABLE_FILES, build_cache
+    for name in TABLE_FILES:
+        build_cache(name)
+
+
+def stage_eda(args):
+    from eda import run
+    run()
+
+
+def stage_drift(args):
+    from drift import drift_report
+    from loader import load_table
+    drift_report(load_table('train'), load_table('test'), order=2)
+
+
+def stage_preprocess(args):
+    from preprocess import run
+    run(outputs=('d', 'g', 'card', 'layout', 'window'), fmt='npy')
+
+
+def stage_preprocess_csv(args):
+    from preprocess import run
+    run(outputs=('d', 'g', 'card'), fmt='csv')
+
+
+def stage_stream(args):
+    from stream_preprocess import stream_transaction_d
+    stream_transaction_d('../data/primeval', '../data/primeval/preprocess/transaction_d_stream.csv',
+                         memory_limit_mb=args.memory_limit_mb)
+
+
+def stage_lazy(args):
+    from lazy_backend import run_lazy
+    run_lazy(outputs=('d', 'g', 'card'), fmt='parquet')
+
+
+def lazy_available():
+    from lazy_backend import HAS_POLARS
+    return HAS_POLARS
+
+
+def run_stage(name, args):
+    # 子进程入口：执行单个阶段并输出一行json
+    from log_config import setup_logger
+    from profiling import read_records, summarize
+    log_file = os.path.join('log', 'bench_%s.log' % name)
+    setup_logger(log_file)
+    start, cpu = time.perf_counter(), time.process_time()
+    globals()['stage_' + name](args)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    print(json.dumps({
+        'wall_s': round(time.perf_counter() - start, 3),
+        'cpu_s': round(time.process_time() - cpu, 3),
+        'peak_rss_mb': round(usage.ru_maxrss / 1024, 1),
+        'steps': summarize(read_records(log_file)),
+    }))
+
+
+def spawn(name, args, root):
+    command = [sys.executable, os.path.abspath(__file__), '--stage', name, '--rows', str(args.rows),
+               '--cards', str(args.cards), '--merchants', str(args.merchants), '--seed', str(args.seed),
+               '--memory-limit-mb', str(args.memory_limit_mb)]
+    result = subprocess.run(command, cwd=os.path.join(root, 'code'), stdout=subprocess.PIPE, check=True)
+    return json.loads(result.stdout.decode().strip().splitlines()[-1])
+
+
+def data_sizes(root):
+    primeval = os.path.join(root, 'data', 'primeval')
+    return {name: round(os.path.getsize(os.path.join(primeval, name)) / 2 ** 20, 1)
+            for name in sorted(os.listdir(primeval)) if name.endswith('.csv')}
+
+
+def compare(report, baseline, tolerance):
+    # 返回退化的(阶段, 指标, 本次, 基准)列表
+    regressions = []
+    for name, result in report['stages'].items():
+        previous = baseline.get('stages', {}).get(name)
+        if previous is None:
+            continue
+        for metric in ['wall_s', 'peak_rss_mb']:
+            ratio = result[metric] / max(previous[metric], 1e-9)
+            print('%-16s %-12s %10.2f %10.2f  %+.0f%%' % (name, metric, previous[metric], result[metric],
+                                                          (ratio - 1) * 100))
+            if ratio > 1 + tolerance:
+                regressions.append((name, metric, result[metric], previous[metric]))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--cards', type=int, default=325540)
+    parser.add_argument('--merchants', type=int, default=334696)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--memory-limit-mb', type=int, default=512, help='stream阶段的内存上限')
+    parser.add_argument('--stages', nargs='+', default=STAGES)
+    parser.add_argument('--report', default='./log/bench_pipeline.json')
+    parser.add_argument('--baseline', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许的退化比例')
+    parser.add_argument('--workdir', default=None, help='保留生成的数据与输出的目录，默认使用临时目录')
+    parser.add_argument('--stage', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        run_stage(args.stage, args)
+        return
+
+    root = args.workdir or tempfile.mkdtemp()
+    for path in ['code/log', 'data/primeval/preprocess', 'data/model']:
+        os.makedirs(os.path.join(root, path), exist_ok=True)
+    stages = [name for name in STAGES if name in args.stages]
+    if 'lazy' in stages and not lazy_available():
+        print('polars not installed, skip stage: lazy')
+        stages.remove('lazy')
+
+    report = {
+        'rows': args.rows, 'cards': args.cards, 'merchants': args.merchants, 'seed': args.seed,
+        'memory_limit_mb': args.memory_limit_mb, 'python': platform.python_version(), 'pandas': pd.__version__,
+        'numpy': np.__version__, 'cpu_count': os.cpu_count(), 'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'stages': {},
+    }
+    try:
+        for name in stages:
+            report['stages'][name] = spawn(name, args, root)
+            print('%-16s %8.2fs  cpu %8.2fs  peak %8.1fMB' % (name, report['stages'][name]['wall_s'],
+                                                            report['stages'][name]['cpu_s'],
+                                                            report['stages'][name]['peak_rss_mb']))
+        report['data_mb'] = data_sizes(root)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(root)
+
+    if os.path.dirname(args.report):
+        os.makedirs(os.path.dirname(args.report), exist_ok=True)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for name, metric, value, previous in regressions:
+            print('regression: %s %s %.2f -> %.2f' % (name, metric, previous, value))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# 流式EDA与整表EDA的汇总一致性与耗时、内存对比
+# 用法: python bench_stream_eda.py --rows 5000000 --workers 4
+# 以synthetic.py生成数据，分别在独立子进程中运行eda.run（整表加载，不绘图）与stream_eda.run（1个及workers个进程），
+# 记录耗时与进程峰值RSS（多进程时为各子进程中的最大值），并校验：
+# - 精确统计的字段（行数、缺失值、无穷值、异常值个数、3σ范围、PSI等）与整表EDA一致；
+# - HyperLogLog估计的字段与精确值的相对误差在3倍标准误差以内；
+# - 不同进程数的HyperLogLog估计完全相同（按寄存器取最大值合并，与切分方式无关），其余字段只有求和顺序带来的舍入差异。
+
+import argparse
+import os
+import shutil
+import tempfile
+
+import eda
+import stream_eda
+from bench_utils import isolated
+from loader import build_cache
+from sketches import HyperLogLog
+from synthetic import generate
+
+# 汇总中由HyperLogLog估计的字段
+APPROXIMATE = {('merchants', 'merchant_id_nunique'), ('transactions', 'duplicate_rows'),
+               ('transactions', 'merchant_id_nunique')}
+
+
+def run(mode, root, workers=1, chunksize=stream_eda.CHUNKSIZE):
+    # 返回汇总
+    primeval_dir = os.path.join(root, 'primeval')
+    if mode == 'full':
+        return eda.run(eda.STEPS, primeval_dir=primeval_dir, cache_dir=os.path.join(root, 'cache'))
+    return stream_eda.run(eda.STEPS, primeval_dir, chunksize, workers)
+
+
+def compare(full, streaming):
+    error = 3 * HyperLogLog().error
+    for step, values in full.items():
+        for key, value in values.items():
+            result = streaming[step][key]
+            if (step, key) in APPROXIMATE:
+                assert abs(result - value) <= error * value, (step, key, value, result)
+            elif isinstance(value, float) or (isinstance(value, list) and value and isinstance(value[0], float)):
+                assert max(abs(a - b) for a, b in zip(value if isinstance(value, list) else [value],
+                                                      result if isinstance(result, list) else [result])) < 1e-9
+            else:
+                assert result == value, (step, key, value, result)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--chunksize', type=int, default=stream_eda.CHUNKSIZE)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        primeval_dir, cache_dir = os.path.join(root, 'primeval'), os.path.join(root, 'cache')
+        generate(primeval_dir, args.rows, seed=args.seed)
+        # 整表EDA读取列式缓存，缓存提前构建，不计入耗时
+        for name in ['train', 'test', 'merchants', 'historical_transactions', 'new_merchant_transactions']:
+            build_cache(name, primeval_dir, cache_dir)
+
+        full = isolated(run, 'full', root)
+        single = isolated(run, 'streaming', root, 1, args.chunksize)
+        parallel = isolated(run, 'streaming', root, args.workers, args.chunksize)
+        print('%-16s %10s %14s' % ('', 'seconds', 'peak_rss_mb'))
+        for name, result in [('full', full), ('streaming', single), ('streaming x%d' % args.workers, parallel)]:
+            print('%-16s %10.2f %14.1f' % (name, result['seconds'], result['peak_rss_mb']))
+        compare(full['result'], single['result'])
+        compare(full['result'], parallel['result'])
+        for step, key in APPROXIMATE:
+            assert single['result'][step][key] == parallel['result'][step][key]
+        print('summaries match (approximate fields within 3 standard errors), %d workers agree with 1' % args.workers)
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# 基准脚本共用的计时与内存测量
+# - timed：单次调用的耗时；
+# - traced：耗时与tracemalloc统计的峰值分配（numpy与pandas的数组分配均会计入），用于比较同一进程中不同写法的临时内存；
+# - isolated：在独立子进程中运行，返回耗时与进程峰值RSS，各次测量互不影响（子进程自身再启动的进程取其中的最大值）。
+
+import multiprocessing
+import resource
+import time
+import tracemalloc
+
+
+def timed(func, *args, **kwargs):
+    # 返回(结果, 秒)
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def traced(func, *args, **kwargs):
+    # 返回(结果, 秒, 峰值MB)
+    tracemalloc.start()
+    try:
+        result, elapsed = timed(func, *args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak / 2 ** 20
+
+
+def _run_isolated(func, args, queue):
+    result, elapsed = timed(func, *args)
+    queue.put({'result': result, 'seconds': elapsed,
+               'peak_rss_mb': max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024})
+
+
+def isolated(func, *args):
+    # 返回{'result': func(*args)的结果, 'seconds': 秒, 'peak_rss_mb': 峰值RSS}；结果需要可以pickle
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run_isolated, args=(func, args, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
@@ -0,0 +1,123 @@
+# 时间窗口特征的正确性校验与耗时对比
+# 用法: python bench_window_features.py --rows 2000000 --reference-dates 2018-01-15 2017-09-10
+# 以synthetic.py生成数据并运行预处理得到按卡布局transaction_card_pre，与朴素的pandas实现对比：
+# - 逐行滚动窗口：groupby('card_id').rolling('<n>D', on='purchase_date')的次数与金额合计；
+# - 卡粒度的截止时间特征：先过滤出截止时间及之前的交易，再按卡分组逐个窗口计算，
+#   校验窗口引擎没有用到截止时间之后的交易；默认的截止时间都早于数据中的最后一个月（月份窗口不能以数据的最后一个月
+#   或month_lag为0的月份为准，而要以截止时间所在的自然月为准）；
+# 浮点列允许求和顺序带来的舍入差异。
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from card_layout import CARD_LAYOUT_NAME, open_card_layout
+from preprocess import run
+from synthetic import generate
+from window_features import (DAY_SECONDS, DAY_WINDOWS, HALFLIVES, MONTH_WINDOWS, layout_window_features,
+                             rolling_windows)
+
+
+def pandas_rolling(frame, windows):
+    grouped = frame.groupby('card_id', sort=False)
+    features = {}
+    for days in windows:
+        rolling = grouped.rolling('%dD' % days, on='purchase_date')['purchase_amount']
+        features['count_%dd' % days] = rolling.count().values
+        features['purchase_amount_sum_%dd' % days] = rolling.sum().values
+    return features
+
+
+def pandas_window_features(frame, reference_date):
+    # 朴素实现：截止时间之前的交易按卡分组，每个窗口单独过滤一次
+    reference = pd.Timestamp(reference_date)
+    visible = frame[frame['purchase_date'] <= reference]
+    months_ago = (reference.year - visible['purchase_date'].dt.year) * 12 + reference.month - \
+        visible['purchase_date'].dt.month
+    cards = pd.Index(frame['card_id'].unique())
+    features = pd.DataFrame({'card_id': cards})
+
+    def per_card(df, name, func):
+        features[name] = df.groupby('card_id', sort=False).apply(func).reindex(cards).values
+
+    for months in MONTH_WINDOWS:
+        window = visible[months_ago < months]
+        counts = window.groupby('card_id', sort=False).size().reindex(cards).fillna(0)
+        features['count_%dm' % months] = counts.values
+        per_card(window, 'purchase_amount_sum_%dm' % months, lambda df: df['purchase_amount'].sum())
+        features['purchase_amount_sum_%dm' % months] = features['purchase_amount_sum_%dm' % months].fillna(0)
+    for days in DAY_WINDOWS:
+        window = visible[visible['purchase_date'] > reference - pd.Timedelta(days=days)]
+        features['count_%dd' % days] = window.groupby('card_id', sort=False).size().reindex(cards).fillna(0).values
+        per_card(window, 'purchase_amount_sum_%dd' % days, lambda df: df['purchase_amount'].sum())
+        features['purchase_amount_sum_%dd' % days] = features['purchase_amount_sum_%dd' % days].fillna(0)
+    per_card(visible, 'days_since_last',
+             lambda df: (reference - df['purchase_date'].max()).total_seconds() / DAY_SECONDS)
+    for halflife in HALFLIVES:
+        per_card(visible, 'purchase_amount_recency_%dd' % halflife, lambda df: (df['purchase_amount'] * 0.5 ** (
+            (reference - df['purchase_date']).dt.total_seconds() / (halflife * DAY_SECONDS))).sum())
+        features['purchase_amount_recency_%dd' % halflife] = \
+            features['purchase_amount_recency_%dd' % halflife].fillna(0)
+    return features
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--cards', type=int, default=50000)
+    parser.add_argument('--merchants', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--reference-dates', nargs='+', default=['2018-01-15', '2017-09-10'])
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        primeval_dir = os.path.join(root, 'primeval')
+        generate(primeval_dir, args.rows, args.cards, args.merchants, args.seed)
+        for name in ['cache', 'preprocess']:
+            os.makedirs(os.path.join(root, name))
+        run(('layout',), primeval_dir, os.path.join(root, 'cache'), os.path.join(root, 'preprocess'),
+            os.path.join(root, 'codebook.json'), fmt='npy')
+        layout = open_card_layout(os.path.join(root, 'preprocess', CARD_LAYOUT_NAME))
+        frame = layout.table.to_frame(['card_id', 'purchase_date', 'purchase_amount'])
+        frame['purchase_amount'] = frame['purchase_amount'].astype(np.float64)
+        codes = frame['card_id'].cat.codes.values
+        print('layout: %d rows, %d cards, purchase_date from %s to %s'
+              % (len(frame), layout.cards, frame['purchase_date'].min(), frame['purchase_date'].max()))
+
+        start = time.perf_counter()
+        expected = pandas_rolling(frame, DAY_WINDOWS)
+        pandas_time = time.perf_counter() - start
+        start = time.perf_counter()
+        result = rolling_windows(codes, frame['purchase_date'].values, frame['purchase_amount'].values, DAY_WINDOWS)
+        engine_time = time.perf_counter() - start
+        for col, values in expected.items():
+            np.testing.assert_allclose(result[col], values, rtol=1e-9, atol=1e-9)
+        print('rolling %s days: pandas %.3fs, engine %.4fs (%.0fx), match'
+              % (DAY_WINDOWS, pandas_time, engine_time, pandas_time / max(engine_time, 1e-9)))
+
+        for reference_date in args.reference_dates:
+            start = time.perf_counter()
+            expected = pandas_window_features(frame, reference_date)
+            pandas_time = time.perf_counter() - start
+            start = time.perf_counter()
+            result = layout_window_features(layout, np.datetime64(reference_date))
+            engine_time = time.perf_counter() - start
+            result['card_id'] = result['card_id'].astype(str)
+            expected['card_id'] = expected['card_id'].astype(str)
+            # 截止时间所在月份有交易，最近1个月的窗口不应为空
+            assert expected['count_1m'].sum() > 0
+            pd.testing.assert_frame_equal(result, expected[result.columns], check_dtype=False, rtol=1e-9, atol=1e-9)
+            print('as-of %s features: pandas %.3fs, engine %.4fs (%.0fx), match'
+                  % (reference_date, pandas_time, engine_time, pandas_time / max(engine_time, 1e-9)))
+    finally:
+        shutil.rmtree(root)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+# 以card_id为粒度的交易聚合特征
+# 对编码后的交易表按card_id排序一次，得到每张卡连续的行区间，
+# 之后计数、sum/mean/std/min/max、nunique以及按month_lag切片的统计都用分段归约(reduceat/bincount)向量化完成，
+# 输出每张卡一行的宽表，可按card_id与train_pre.csv/test_pre.csv关联。
+
+import numpy as np
+import pandas as pd
+
+AGG_COLS = ['purchase_amount', 'installments']
+NUNIQUE_COLS = ['merchant_id', 'merchant_category_id', 'subsector_id', 'category_1', 'category_2', 'category_3']
+LAG_COL = 'month_lag'
+
+
+class CardSegments(object):
+    # 按card_id稳定排序后的行顺序与每张卡的起始位置
+
+    def __init__(self, card_id):
+        self.codes, uniques = pd.factorize(card_id)
+        self.card_ids = np.asarray(uniques)
+        self.order = np.argsort(self.codes, kind='stable')
+        self.counts = np.bincount(self.codes, minlength=len(self.card_ids))
+        self.starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+
+    @classmethod
+    def from_offsets(cls, card_ids, offsets):
+        # 行已按卡连续存储（见card_layout.py），offsets为每张卡的起点，不需要再分组排序
+        segments = cls.__new__(cls)
+        segments.card_ids = np.asarray(card_ids)
+        segments.counts = np.diff(offsets)
+        segments.starts = np.asarray(offsets[:-1])
+        segments.codes = np.repeat(np.arange(len(segments.card_ids)), segments.counts)
+        segments.order = None
+        return segments
+
+    def sorted_values(self, values):
+        values = np.asarray(values)
+        return values if self.order is None else values[self.order]
+
+
+def segment_stats(segments, values, prefix):
+    values = np.asarray(values, dtype=np.float64)
+    sorted_values = segments.sorted_values(values)
+    counts = segments.counts
+    total = np.add.reduceat(sorted_values, segments.starts)
+    mean = total / counts
+    # 两遍法计算方差，与pandas的std(ddof=1)一致，只有一条记录时为NaN
+    centered = sorted_values - np.repeat(mean, counts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std = np.sqrt(np.add.reduceat(centered * centered, segments.starts) / (counts - 1))
+    std[counts < 2] = np.nan
+    return {
+        prefix + '_sum': total,
+        prefix + '_mean': mean,
+        prefix + '_std': std,
+        prefix + '_min': np.minimum.reduceat(sorted_values, segments.starts),
+        prefix + '_max': np.maximum.reduceat(sorted_values, segments.starts),
+    }
+
+
+def segment_nunique(segments, values):
+    # (card, value)组合去重后按card计数，缺失值不计入
+    value_codes, uniques = pd.factorize(values)
+    width = len(uniques) + 1
+    pairs = np.unique(segments.codes.astype(np.int64) * width + (value_codes + 1))
+    pairs = pairs[pairs % width != 0]
+    return np.bincount(pairs // width, minlength=len(segments.card_ids))
+
+
+def lag_slices(segments, lags, amount, lag_values=None):
+    # 每个month_lag取值下的交易次数与金额合计，展开为宽表的列；
+    # lag_values给定时只输出这些取值对应的列（如在线服务中与离线特征对齐），其他取值的交易不计入
+    lags = np.asarray(lags)
+    amount = np.asarray(amount, dtype=np.float64)
+    codes = segments.codes.astype(np.int64)
+    if lag_values is None:
+        lag_values, lag_index = np.unique(lags, return_inverse=True)
+    else:
+        lag_values = np.asarray(lag_values)
+        lag_index = np.minimum(np.searchsorted(lag_values, lags), max(len(lag_values) - 1, 0))
+        known = lag_values[lag_index] == lags if len(lag_values) else np.zeros(len(lags), dtype=bool)
+        codes, lag_index, amount = codes[known], lag_index[known], amount[known]
+    n_lags = len(lag_values)
+    flat = codes * n_lags + lag_index
+    size = len(segments.card_ids) * n_lags
+    counts = np.bincount(flat, minlength=size).reshape(-1, n_lags)
+    totals = np.bincount(flat, weights=amount, minlength=size).reshape(-1, n_lags)
+    features = {}
+    for i, lag in enumerate(lag_values):
+        features['month_lag_%d_count' % lag] = counts[:, i]
+        features['month_lag_%d_purchase_amount_sum' % lag] = totals[:, i]
+    return features
+
+
+def card_feature_arrays(transaction, card_col='card_id', segments=None, lags=None):
+    # 返回 列名 -> 每张卡一个取值的数组；transaction可以是DataFrame或列名到数组的字典
+    # segments为None时按card_col分组；传入CardSegments.from_offsets时transaction须已按卡连续存储
+    # lags为按month_lag切片的取值（升序），默认取交易中出现的全部取值
+    segments = segments if segments is not None else CardSegments(transaction[card_col])
+    features = {card_col: segments.card_ids, 'transaction_count': segments.counts}
+    for col in AGG_COLS:
+        features.update(segment_stats(segments, transaction[col], col))
+    for col in NUNIQUE_COLS:
+        features[col + '_nunique'] = segment_nunique(segments, transaction[col])
+    features.update(lag_slices(segments, transaction[LAG_COL], transaction['purchase_amount'], lags))
+    return features
+
+
+def card_features(transaction, card_col='card_id', segments=None, lags=None):
+    return pd.DataFrame(card_feature_arrays(transaction, card_col, segments, lags))
@@ -0,0 +1,133 @@
+# 按卡连续存储的交易布局
+# 04中每个以card_id为粒度的操作（purchase_day_diff/purchase_month_diff、聚合特征）都要对card_id重新分组，
+# 打分服务按卡查询交易时也只能扫描整张表。这里将公共中间表按(card_id, purchase_date)物理排序后写为列式表：
+# card_id重新编码为按卡号排序的类别，编码即卡在布局中的序号，另存每张卡行区间的起点card_offsets.npy（长度为卡数+1）。
+# - 按卡查询：卡号到序号为一次hash查找，行区间为offsets[i]:offsets[i+1]，各列返回内存映射数组的切片，不拷贝；
+# - 以卡为粒度的特征都是连续分段上的归约(np.add.reduceat等)，不需要再分组或排序，见CardLayout.segments；
+# - 差分列按时间顺序计算，即每张卡内与时间上前一笔交易的差。transaction_g_pre按文件中的行顺序差分，
+#   行顺序并不保证是时间顺序，为兼容已有下游保持原定义不变。
+# 同一张卡内购买时间相同的交易保持原有的相对顺序（稳定排序）。
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from card_features import AGG_COLS, LAG_COL, NUNIQUE_COLS, CardSegments, card_features
+from columnar import ColumnTable, write_table
+
+CARD_LAYOUT_NAME = 'transaction_card_pre'
+OFFSETS_FILE = 'card_offsets.npy'
+# 差分列 -> 被差分的列
+TIME_DIFF_COLS = {'purchase_day_diff': 'purchase_day', 'purchase_month_diff': 'purchase_month'}
+
+
+def card_order(card_id, purchase_date):
+    # 返回按(卡号, 购买时间)稳定排序后的行顺序、每张卡的行区间起点offsets以及按卡号排序的卡号数组
+    if isinstance(card_id.dtype, pd.CategoricalDtype):
+        codes, categories = card_id.cat.codes.values, np.asarray(card_id.cat.categories, dtype=object)
+    else:
+        codes, categories = pd.factorize(card_id)
+        categories = np.asarray(categories, dtype=object)
+    # 类别按卡号的字典序排名，类别本身的顺序与拼接时的出现顺序有关
+    rank = np.empty(len(categories), dtype=np.int64)
+    rank[np.argsort(categories.astype(str), kind='stable')] = np.arange(len(categories))
+    keys = rank[codes]
+    order = np.lexsort((np.asarray(purchase_date).view(np.int64), keys))
+    sorted_keys = keys[order]
+    boundary = np.ones(len(keys), dtype=bool)
+    boundary[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    starts = np.flatnonzero(boundary)
+    offsets = np.append(starts, len(keys)).astype(np.int64)
+    card_ids = categories[np.argsort(rank)][sorted_keys[starts]]
+    return order, offsets, card_ids
+
+
+def segment_diff(values, offsets):
+    # 分段内相邻两行的差，每段第一行为NaN
+    values = np.asarray(values, dtype=np.float64)
+    diff = np.empty(len(values), dtype=np.float64)
+    diff[1:] = values[1:] - values[:-1]
+    diff[offsets[:-1]] = np.nan
+    return diff
+
+
+def build_card_layout(transaction, date_col='purchase_date'):
+    # 公共中间表 -> 按卡按时间排序的表，card_id为按卡号排序的category且编码单调不减，差分列按时间顺序重新计算
+    order, offsets, card_ids = card_order(transaction['card_id'], transaction[date_col])
+    layout = transaction.take(order).reset_index(drop=True)
+    codes = np.repeat(np.arange(len(card_ids), dtype=np.int32), np.diff(offsets))
+    layout['card_id'] = pd.Categorical.from_codes(codes, card_ids)
+    for diff_col, col in TIME_DIFF_COLS.items():
+        layout[diff_col] = segment_diff(layout[col].values, offsets)
+    return layout
+
+
+def layout_offsets(card_codes, cards):
+    # 编码单调不减，第i张卡的起点即第一个编码不小于i的位置
+    return np.searchsorted(card_codes, np.arange(cards + 1)).astype(np.int64)
+
+
+def write_card_layout(layout, path, codebooks=None):
+    manifest = write_table(layout, path, codebooks)
+    card_id = layout['card_id']
+    np.save(os.path.join(path, OFFSETS_FILE), layout_offsets(card_id.cat.codes.values, len(card_id.cat.categories)))
+    return manifest
+
+
+class CardLayout(object):
+    # 按卡查询write_card_layout写出的布局；mmap时各列为只读内存映射，查询结果是其切片
+
+    def __init__(self, path, mmap=True):
+        self.table = ColumnTable(path, mmap)
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE))
+        self.card_ids = pd.Index(self.table.categories('card_id'))
+        self._arrays = {}
+
+    @property
+    def cards(self):
+        return len(self.card_ids)
+
+    @property
+    def columns(self):
+        return self.table.columns
+
+    def array(self, col):
+        # category列为整数编码，datetime列按原类型视图返回
+        if col not in self._arrays:
+            values = self.table.array(col)
+            spec = self.table.specs[col]
+            if spec['kind'] == 'datetime':
+                values = values.view(spec['dtype'])
+            self._arrays[col] = values
+        return self._arrays[col]
+
+    def rows(self, card_id):
+        # 卡号不存在时抛出KeyError
+        i = self.card_ids.get_loc(card_id)
+        return slice(int(self.offsets[i]), int(self.offsets[i + 1]))
+
+    def lookup(self, card_id, columns=None):
+        # 列名 -> 该卡交易（按时间排序）的数组切片，不拷贝
+        rows = self.rows(card_id)
+        return {col: self.array(col)[rows] for col in (self.columns if columns is None else columns)}
+
+    def frame(self, card_id, columns=None):
+        # 该卡交易的DataFrame，category列还原为原取值
+        values = self.lookup(card_id, columns)
+        for col in values:
+            if self.table.specs[col]['kind'] == 'category':
+                values[col] = pd.Categorical.from_codes(values[col], self.table.categories(col))
+        return pd.DataFrame(values)
+
+    def segments(self):
+        return CardSegments.from_offsets(np.asarray(self.card_ids, dtype=object), self.offsets)
+
+    def card_features(self):
+        # 与card_features.card_features相同的特征，各卡按卡号排序输出
+        columns = ['card_id'] + AGG_COLS + NUNIQUE_COLS + [LAG_COL]
+        return card_features(self.table.to_frame(columns), segments=self.segments())
+
+
+def open_card_layout(path, mmap=True):
+    return CardLayout(path, mmap)
@@ -0,0 +1,130 @@
+# 预处理结果的列式二进制存储
+# 原先各输出用to_csv写成文本，千万行级别的交易表写入慢、体积大，下游每次使用都要重新解析。
+# 这里每张表写为一个目录：每列一个.npy文件，整数列按取值范围压缩为最小的整数类型，
+# category/object列只保存整数编码，类别另存为<列名>.categories.json；manifest.json记录行数、各列类型以及编码字段对应的码表。
+# 读取时按列np.load(mmap_mode='r')内存映射，只读取需要的列，数值列不经过拷贝。
+# manifest最后写入，目录中没有manifest即视为未写完。
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+MANIFEST = 'manifest.json'
+INT_DTYPES = [np.int8, np.int16, np.int32, np.int64]
+
+
+def downcast_int(values):
+    # 按取值范围选取能容纳的最小有符号整数类型，无损
+    values = np.asarray(values)
+    if len(values) == 0:
+        return values.astype(np.int8)
+    low, high = values.min(), values.max()
+    for dtype in INT_DTYPES:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return values.astype(dtype, copy=False)
+    return values
+
+
+def encode_column(se):
+    # 返回(数组, 列描述)，列描述写入manifest
+    dtype = se.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return downcast_int(se.cat.codes.values), {'kind': 'category', 'categories': se.cat.categories.tolist()}
+    if dtype == object:
+        codes, uniques = pd.factorize(se)
+        return downcast_int(codes), {'kind': 'category', 'categories': list(uniques)}
+    if pd.api.types.is_datetime64_dtype(dtype):
+        return se.values.view(np.int64), {'kind': 'datetime', 'dtype': str(dtype)}
+    if pd.api.types.is_extension_array_dtype(dtype):
+        # 可空整数：无缺失时按整数保存，有缺失时转为float并以NaN表示
+        if se.hasnans:
+            return se.to_numpy(dtype=np.float64, na_value=np.nan), {'kind': 'values'}
+        return downcast_int(se.to_numpy(dtype=np.int64)), {'kind': 'values'}
+    if pd.api.types.is_integer_dtype(dtype):
+        return downcast_int(se.values), {'kind': 'values'}
+    return se.values, {'kind': 'values'}
+
+
+def _json_value(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def write_table(df, path, codebooks=None):
+    # codebooks: 列名 -> 码表(取值列表，下标即编码)，只记录df中存在的列
+    os.makedirs(path, exist_ok=True)
+    manifest_path = os.path.join(path, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    columns = []
+    for col in df.columns:
+        values, spec = encode_column(df[col])
+        np.save(os.path.join(path, col + '.npy'), values)
+        if spec['kind'] == 'category':
+            with open(os.path.join(path, col + '.categories.json'), 'w') as f:
+                json.dump([_json_value(v) for v in spec.pop('categories')], f, ensure_ascii=False)
+        spec.update(name=col, dtype=spec.get('dtype', str(values.dtype)), source_dtype=str(df[col].dtype))
+        columns.append(spec)
+    manifest = {
+        'rows': len(df),
+        'columns': columns,
+        'codebooks': {col: list(values) for col, values in (codebooks or {}).items() if col in df.columns},
+    }
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    return manifest
+
+
+class ColumnTable(object):
+    # 按列内存映射读取write_table写出的目录
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        self.mmap_mode = 'r' if mmap else None
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.specs = {spec['name']: spec for spec in self.manifest['columns']}
+        self._categories = {}
+
+    @property
+    def rows(self):
+        return self.manifest['rows']
+
+    @property
+    def columns(self):
+        return [spec['name'] for spec in self.manifest['columns']]
+
+    def codebook(self, col):
+        return self.manifest['codebooks'].get(col)
+
+    def array(self, col):
+        # 原始数组（category列为整数编码），mmap时为只读内存映射
+        return np.load(os.path.join(self.path, col + '.npy'), mmap_mode=self.mmap_mode)
+
+    def categories(self, col):
+        if col not in self._categories:
+            with open(os.path.join(self.path, col + '.categories.json')) as f:
+                self._categories[col] = json.load(f)
+        return self._categories[col]
+
+    def column(self, col, categorical=True):
+        spec = self.specs[col]
+        values = self.array(col)
+        if spec['kind'] == 'category' and categorical:
+            return pd.Series(pd.Categorical.from_codes(values, self.categories(col)), name=col)
+        if spec['kind'] == 'datetime':
+            return pd.Series(np.asarray(values).view(spec['dtype']), name=col)
+        return pd.Series(values, name=col, copy=False)
+
+    def to_frame(self, columns=None, categorical=True):
+        columns = self.columns if columns is None else list(columns)
+        if not columns:
+            return pd.DataFrame(index=pd.RangeIndex(self.rows))
+        # 由内存映射的Series构造DataFrame时pd.DataFrame(dict)比按列concat慢一个数量级
+        return pd.concat([self.column(col, categorical) for col in columns], axis=1)
+
+
+def read_table(path, columns=None, categorical=True, mmap=True):
+    return ColumnTable(path, mmap).to_frame(columns, categorical)
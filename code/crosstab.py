@@ -0,0 +1,85 @@
+# 以card_id为行的离散取值计数（字典特征）稀疏矩阵
+# 方案1原先将全部离散字段转为字符串，以便后续按卡统计每个取值出现的次数；
+# 这里直接在整数编码的字段上构造scipy.sparse CSR矩阵，每个(字段, 取值)对应一列，构造代价为O(nnz)。
+# 列词表在训练数据上拟合后持久化，测试数据沿用同一词表，未出现过的取值直接忽略。
+# 词表以取值的字符串为键：因缺失值而为浮点类型的整数字段先转为可空整数，2.0与2得到同一个词'2'，
+# 缺失值与-1对应同一个词，训练集与测试集的字段类型不同（如合并商户字段填充前后）时仍可对齐。
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from encoder import CategoryEncoder
+from join import surrogate_keys
+from preprocess import TRANSACTION_D_CATEGORY_COLS
+
+CROSSTAB_VOCAB_PATH = '../data/model/crosstab_vocab.json'
+
+
+def integer_values(se):
+    # 取值全部为整数的浮点列转为可空整数，其他字段不变
+    if pd.api.types.is_float_dtype(se.dtype):
+        values = se.dropna().values
+        if np.array_equal(values, np.floor(values)):
+            return se.astype('Int64')
+    return se
+
+
+class CrossTab(object):
+
+    def __init__(self, cols=None, encoder=None):
+        self.cols = list(cols if cols is not None else TRANSACTION_D_CATEGORY_COLS)
+        self.encoder = encoder if encoder is not None else CategoryEncoder()
+
+    @property
+    def offsets(self):
+        sizes = [len(self.encoder.codebook[col]) for col in self.cols]
+        return np.concatenate([[0], np.cumsum(sizes)])
+
+    def feature_names(self):
+        return ['%s=%s' % (col, value) for col in self.cols for value in self.encoder.codebook[col]]
+
+    def fit(self, transaction):
+        for col in self.cols:
+            self.encoder.fit(col, integer_values(transaction[col]))
+        return self
+
+    def transform(self, transaction, card_ids=None, normalize=False, card_col='card_id'):
+        # card_ids给定时按其顺序排列行（如train_pre['card_id']），否则按交易中卡首次出现的顺序
+        if card_ids is None:
+            rows, card_ids = pd.factorize(transaction[card_col])
+            card_ids = np.asarray(card_ids)
+        else:
+            card_ids = np.asarray(card_ids)
+            rows = surrogate_keys(transaction[card_col], pd.Index(card_ids))
+        n_cards = len(card_ids)
+        offsets = self.offsets
+        valid_rows = rows >= 0
+
+        blocks = []
+        for i, col in enumerate(self.cols):
+            codes = self.encoder.transform(col, integer_values(transaction[col]))
+            mask = valid_rows & (codes >= 0)
+            # coo转csr时重复的(行, 列)自动求和，即为计数
+            blocks.append(sparse.coo_matrix(
+                (np.ones(mask.sum(), dtype=np.float32), (rows[mask], codes[mask])),
+                shape=(n_cards, offsets[i + 1] - offsets[i])).tocsr())
+        matrix = sparse.hstack(blocks, format='csr')
+
+        if normalize:
+            # 每个字段每笔交易恰好贡献一次，除以该卡交易数即为字段内各取值的占比
+            totals = np.bincount(rows[valid_rows], minlength=n_cards).astype(np.float32)
+            totals[totals == 0] = 1
+            matrix = sparse.diags(1 / totals).dot(matrix).tocsr()
+        return matrix, card_ids
+
+    def fit_transform(self, transaction, card_ids=None, normalize=False, card_col='card_id'):
+        return self.fit(transaction).transform(transaction, card_ids, normalize, card_col)
+
+    def save(self, path=CROSSTAB_VOCAB_PATH):
+        self.encoder.save(path)
+
+    @classmethod
+    def load(cls, path=CROSSTAB_VOCAB_PATH, cols=None):
+        encoder = CategoryEncoder.load(path)
+        return cls(cols if cols is not None else list(encoder.codebook), encoder)
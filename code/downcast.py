@@ -0,0 +1,74 @@
+# 按观测到的取值范围压缩DataFrame的内存占用
+# loader.py中声明了各表已知字段的紧凑类型，未声明的字段（训练集的first_active_month、target，商户表的数值字段等）
+# 以及表结构变化后新增的字段仍为pandas默认的int64/float64/object。这里对每个字段推断不丢失信息的最小类型：
+# - 整数（含可空整数Int64等）按最小值、最大值取能容纳的最小有符号类型；
+# - float64只有在全部取值转为float32后完全不变时才转换，不引入舍入误差；
+# - object字段中以_id结尾的编号以及不同取值个数不超过行数一定比例的字段转为category，
+#   相同字符串只保存一份，行上只保存整数编码。
+# 已是category、bool、日期等类型的字段保持不变，对已压缩的DataFrame重复调用不会再改变类型。
+# 由loader在读取原始csv与列式缓存后自动调用，并在日志中输出压缩前后的内存占用；
+# preprocess.build_transaction对编码、合并商户字段后得到的中间交易表同样调用一次。
+
+import logging
+
+import numpy as np
+import pandas as pd
+from pandas.api import types
+
+logger = logging.getLogger('mylogger')
+
+# 不同取值个数不超过行数的该比例时转为category
+CATEGORY_RATIO = 0.5
+
+INT_DTYPES = ['int8', 'int16', 'int32', 'int64']
+NULLABLE_INT_DTYPES = ['Int8', 'Int16', 'Int32', 'Int64']
+
+
+def frame_memory_mb(df):
+    return df.memory_usage(index=True, deep=True).sum() / 2 ** 20
+
+
+def _smallest_int(low, high, candidates):
+    for dtype in candidates:
+        info = np.iinfo(dtype.lower())
+        if info.min <= low and high <= info.max:
+            return dtype
+    return candidates[-1]
+
+
+def downcast_series(se, category_ratio=CATEGORY_RATIO):
+    dtype = se.dtype
+    if isinstance(dtype, pd.CategoricalDtype) or types.is_bool_dtype(dtype) or types.is_datetime64_any_dtype(dtype):
+        return se
+    if types.is_integer_dtype(dtype):
+        values = se.dropna()
+        if not len(values):
+            return se
+        candidates = NULLABLE_INT_DTYPES if isinstance(dtype, pd.api.extensions.ExtensionDtype) else INT_DTYPES
+        target = _smallest_int(int(values.min()), int(values.max()), candidates)
+        # 只缩小不放大；无符号类型换成有符号类型时位数可能变大
+        return se.astype(target) if np.dtype(target.lower()).itemsize < dtype.itemsize else se
+    if dtype == np.float64:
+        values = se.values
+        narrow = values.astype(np.float32)
+        return se.astype(np.float32) if np.array_equal(narrow, values, equal_nan=True) else se
+    if dtype == object:
+        unique = se.nunique(dropna=True)
+        if (se.name is not None and str(se.name).endswith('_id')) or unique <= category_ratio * len(se):
+            return se.astype('category')
+    return se
+
+
+def optimize_memory(df, name=None, category_ratio=CATEGORY_RATIO):
+    # 原地替换各字段并返回df；name为日志中显示的表名
+    before = frame_memory_mb(df)
+    changed = {}
+    for col in df.columns:
+        se = downcast_series(df[col], category_ratio)
+        if se.dtype != df[col].dtype:
+            changed[col] = '%s->%s' % (df[col].dtype, se.dtype)
+            df[col] = se
+    after = frame_memory_mb(df)
+    logger.info('memory: %s %.1fMB -> %.1fMB (%.1fx) %s'
+                % (name, before, after, before / after if after else 1.0, changed))
+    return df
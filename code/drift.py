@@ -0,0 +1,122 @@
+# 训练集/测试集分布一致性（漂移）检验
+# 原先01中的combine_feature将两列拼接成'a&b'字符串再value_counts，每对特征都要重复字符串拼接与索引合并；
+# 这里对每个特征在训练集与测试集上统一编码，多特征组合用整数编码运算(code_a * card_b + code_b)后bincount得到联合频数，
+# 输出训练/测试占比表以及PSI、KL散度、KS统计量，不依赖绘图，可作为每次数据更新后的无界面检查。
+# 用法: python drift.py --order 3 --max-psi 0.1
+
+import argparse
+import itertools
+import logging
+import sys
+
+import numpy as np
+import pandas as pd
+
+from loader import load_table
+from log_config import setup_logger
+
+logger = logging.getLogger('mylogger')
+
+FEATURES = ['first_active_month', 'feature_1', 'feature_2', 'feature_3']
+
+# 计算PSI与KL时对零占比的平滑
+EPSILON = 1e-6
+# 组合取值空间超过该大小时改为对出现过的组合排序计数，避免bincount分配过大的数组
+BINCOUNT_LIMIT = 10 ** 7
+
+
+class JointCodes(object):
+    # 各特征在训练集与测试集上统一编码，缺失值单独作为最后一个取值
+
+    def __init__(self, train, test, features):
+        self.features = list(features)
+        self.train_codes = {}
+        self.test_codes = {}
+        self.levels = {}
+        n_train = len(train)
+        for feature in self.features:
+            codes, uniques = pd.factorize(pd.concat([train[feature], test[feature]], ignore_index=True), sort=True)
+            codes = np.where(codes < 0, len(uniques), codes).astype(np.int64)
+            self.levels[feature] = [str(v) for v in uniques] + (['nan'] if (codes == len(uniques)).any() else [])
+            self.train_codes[feature] = codes[:n_train]
+            self.test_codes[feature] = codes[n_train:]
+
+    def _combine(self, codes, features):
+        combined = np.zeros(len(codes[features[0]]), dtype=np.int64)
+        for feature in features:
+            combined = combined * len(self.levels[feature]) + codes[feature]
+        return combined
+
+    def distribution(self, features):
+        # 返回联合取值的标签以及训练集、测试集占比，只保留至少在一侧出现过的组合
+        shape = [len(self.levels[feature]) for feature in features]
+        train_combined = self._combine(self.train_codes, features)
+        test_combined = self._combine(self.test_codes, features)
+        if np.prod(shape, dtype=np.float64) <= BINCOUNT_LIMIT:
+            size = int(np.prod(shape))
+            train_count = np.bincount(train_combined, minlength=size)
+            test_count = np.bincount(test_combined, minlength=size)
+            present = np.flatnonzero((train_count > 0) | (test_count > 0))
+            train_count, test_count = train_count[present], test_count[present]
+        else:
+            present = np.union1d(train_combined, test_combined)
+            train_count = np.bincount(np.searchsorted(present, train_combined), minlength=len(present))
+            test_count = np.bincount(np.searchsorted(present, test_combined), minlength=len(present))
+        positions = np.unravel_index(present, shape)
+        labels = ['&'.join(values) for values in zip(*[np.asarray(self.levels[feature], dtype=object)[position]
+                                                      for feature, position in zip(features, positions)])]
+        return pd.DataFrame({'train': train_count / max(train_count.sum(), 1),
+                             'test': test_count / max(test_count.sum(), 1)}, index=labels)
+
+
+def drift_scores(train_ratio, test_ratio):
+    p = np.asarray(train_ratio, dtype=np.float64)
+    q = np.asarray(test_ratio, dtype=np.float64)
+    p_smooth = np.clip(p, EPSILON, None)
+    q_smooth = np.clip(q, EPSILON, None)
+    return {
+        'psi': float(np.sum((p_smooth - q_smooth) * np.log(p_smooth / q_smooth))),
+        'kl': float(np.sum(p_smooth * np.log(p_smooth / q_smooth))),
+        # 取值按编码顺序排列，KS统计量为两侧累计分布的最大差
+        'ks': float(np.max(np.abs(np.cumsum(p) - np.cumsum(q)))) if len(p) else 0.0,
+    }
+
+
+def joint_distribution(train, test, features):
+    return JointCodes(train, test, features).distribution(list(features))
+
+
+def drift_report(train, test, features=None, order=2):
+    # 对全部1至order个特征的组合计算漂移指标
+    features = list(features if features is not None else FEATURES)
+    codes = JointCodes(train, test, features)
+    rows = []
+    for k in range(1, order + 1):
+        for combination in itertools.combinations(features, k):
+            distribution = codes.distribution(list(combination))
+            scores = drift_scores(distribution['train'], distribution['test'])
+            scores.update(features='&'.join(combination), levels=len(distribution))
+            rows.append(scores)
+    return pd.DataFrame(rows, columns=['features', 'levels', 'psi', 'kl', 'ks'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--features', nargs='+', default=FEATURES)
+    parser.add_argument('--order', type=int, default=2)
+    parser.add_argument('--max-psi', type=float, default=None)
+    parser.add_argument('--log-file', default=None)
+    args = parser.parse_args()
+
+    setup_logger(args.log_file, console=True, level=logging.INFO)
+
+    report = drift_report(load_table('train'), load_table('test'), args.features, args.order)
+    logger.info(report.to_string(index=False))
+    if args.max_psi is not None and (report['psi'] > args.max_psi).any():
+        drifted = report.loc[report['psi'] > args.max_psi, 'features']
+        logger.error('psi above %s: %s' % (args.max_psi, ', '.join(drifted)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+# 数据探索(EDA)
+# 原01~03脚本中的探索步骤整理为可导入的函数：analyze_cards(训练集/测试集)、analyze_merchants(商户)、
+# analyze_transactions(交易)，统计结果写入日志并以字典返回，可直接作为流水线中的数据检查步骤。
+# 绘图库只在请求输出图片时才导入，图片先登记、最后统一绘制并写入文件(Agg后端，无需界面)；不输出图片时启动无需加载matplotlib。
+# 用法: python eda.py cards merchants --figures ../data/result/figures --log-file ./log/eda.log --summary ./log/eda.json
+# --streaming时改为分块一遍读取、以可合并草图统计的近似模式，内存占用与表大小无关，见stream_eda.py。
+
+import argparse
+import io
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from drift import FEATURES, drift_report, joint_distribution
+from encoder import CategoryEncoder
+from loader import CACHE_DIR, PRIMEVAL_DIR, load_table
+from log_config import setup_logger
+from preprocess import (MERCHANT_CATEGORY_COLS, MERCHANT_INF_COLS, MERCHANT_NUMERIC_COLS, MERCHANT_OBJECT_COLS,
+                        TRANSACTION_CATEGORY_COLS, TRANSACTION_OBJECT_COLS, MerchantCleaner, fillna_cols)
+
+logger = logging.getLogger('mylogger')
+
+STEPS = ['cards', 'merchants', 'transactions']
+DICTIONARY_PATH = '../data/primeval/Data_Dictionary.xlsx'
+
+
+class FigureWriter(object):
+    # 图片先登记绘制函数，flush时统一绘制；directory为空且show为False时不登记，也不导入绘图库
+
+    def __init__(self, directory=None, show=False, fmt='png'):
+        self.directory = directory
+        self.show = show
+        self.fmt = fmt
+        self.pending = []
+        self.written = []
+
+    @property
+    def enabled(self):
+        return bool(self.directory) or self.show
+
+    def add(self, name, draw):
+        # draw(plt, sns)在当前figure上绘图
+        if self.enabled:
+            self.pending.append((name, draw))
+
+    def flush(self):
+        if not self.pending:
+            return self.written
+        import matplotlib
+        if not self.show:
+            matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        sns.set()
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        for name, draw in self.pending:
+            figure = plt.figure()
+            draw(plt, sns)
+            if self.directory:
+                path = os.path.join(self.directory, '%s.%s' % (name, self.fmt))
+                figure.savefig(path)
+                self.written.append(path)
+            if self.show:
+                plt.show()
+            plt.close(figure)
+        self.pending = []
+        return self.written
+
+
+def frame_info(df):
+    # DataFrame.info()默认打印到标准输出，这里写入日志
+    buf = io.StringIO()
+    df.info(buf=buf)
+    return buf.getvalue()
+
+
+def _ratio_plot(ratios, labels, feature):
+    def draw(plt, sns):
+        for ratio in ratios:
+            ratio.plot()
+        plt.legend(labels)
+        plt.xlabel(feature)
+        plt.ylabel('ratio')
+    return draw
+
+
+def analyze_cards(train, test, figures=None):
+    figures = figures or FigureWriter()
+    logger.info(train.shape)  # (201917, 6)
+    logger.info(test.shape)  # (123623, 5)
+    logger.info(train.head(5))
+    logger.info(test.head(5))
+    logger.info(frame_info(train))
+    logger.info(frame_info(test))
+
+    # 信用卡号 第一次激活月份 特征1,2,3 预测目标值忠诚度评分
+    for feature in ['feature_1', 'feature_2', 'feature_3']:
+        logger.info(train[feature].value_counts())
+
+    # 数据正确性校验
+    # 数据集id无重复
+    train_unique = train['card_id'].nunique() == train.shape[0]
+    test_unique = test['card_id'].nunique() == test.shape[0]
+    disjoint = train['card_id'].nunique() + test['card_id'].nunique() == len(
+        set(test['card_id'].values.tolist() + train['card_id'].values.tolist()))
+    logger.info(train_unique)  # True
+    logger.info(test_unique)  # True
+    logger.info(disjoint)  # True
+
+    # 缺失一条记录测试集缺失一条激活月份的记录
+    logger.info(train.isnull().sum())
+    logger.info(test.isnull().sum())  # first_active_month    1
+
+    # 异常值
+    statistics = train['target'].describe()
+    logger.info(statistics)
+    figures.add('target_hist', lambda plt, sns: sns.histplot(train['target'], kde=True))
+    outliers = int((train['target'] < -30).sum())
+    logger.info(outliers)  # 2207
+
+    # 对于连续变量服从正态分布 一般可以采用3*delta
+    # 原则进行异常值识别，此处我们也可以简单计算下异常值范围： 这里标签是人工的很可能有特殊的含义
+    lower = statistics.loc['mean'] - 3 * statistics.loc['std']
+    upper = statistics.loc['mean'] + 3 * statistics.loc['std']
+    logger.info(lower)  # -11.945136285536142
+    logger.info(upper)  # 11.157863687380166
+
+    # 规律一致性分析
+    # 所谓规律一致性，指的是需要对训练集和测试集特征数据的分布进行简单比对，以“确定”两组数据是否诞生于同一个总体
+    # 即两组数据是否都遵循着背后总体的规律，即两组数据是否存在着规律一致性。
+    train_count = train.shape[0]
+    test_count = test.shape[0]
+    figures.add('first_active_month_train', _ratio_plot(
+        [train['first_active_month'].value_counts().sort_index() / train_count], ['train'], 'first_active_month'))
+    for feature in FEATURES:
+        figures.add('ratio_' + feature, _ratio_plot(
+            [train[feature].value_counts().sort_index() / train_count,
+             test[feature].value_counts().sort_index() / test_count], ['train', 'test'], feature))
+
+    # 多变量联合分布
+    # 所谓联合概率分布，指的是将离散变量两两组合，然后查看这个新变量的相对占比分布。
+    # 例如特征1有0/1两个取值水平，特征2有A/B两个取值水平，则联合分布中就将存在0A、0B、1A、1B四种不同取值水平，
+    # 然后进一步查看这四种不同取值水平出现的分布情况；联合分布通过整数编码组合计数得到，见drift.py
+    for i in range(len(FEATURES) - 1):
+        for j in range(i + 1, len(FEATURES)):
+            cols = [FEATURES[i], FEATURES[j]]
+            # 索引为合并后取值 2017-07&3，两列分别为训练集、测试集占比，未出现的组合占比为0
+            dis = joint_distribution(train, test, cols)
+            logger.info(cols)
+            logger.info(dis['test'])
+            figures.add('ratio_' + '&'.join(cols), _ratio_plot([dis['train'], dis['test']], ['train', 'test'],
+                                                               '&'.join(cols)))
+
+    # 单特征及两两组合的漂移指标（PSI、KL、KS）
+    report = drift_report(train, test, FEATURES, order=2)
+    logger.info(report)
+
+    # 联合分布规律差不多一致可以训练
+    # 1.如果分布非常一致，则说明所有特征均取自同一整体，训练集和测试集规律拥有较高一致性，模型效果上限较高，建模过程中应该更加依靠特征工程方法和模型建模技巧提高最终预测效果；
+    # 2.如果分布不太一致，则说明训练集和测试集规律不太一致，此时模型预测效果上限会受此影响而被限制，并且模型大概率容易过拟合，
+    # 在实际建模过程中可以多考虑使用交叉验证等方式防止过拟合，并且需要注重除了通用特征工程和建模方法外的trick的使用
+
+    return {
+        'train_shape': list(train.shape),
+        'test_shape': list(test.shape),
+        'train_card_id_unique': bool(train_unique),
+        'test_card_id_unique': bool(test_unique),
+        'card_id_disjoint': bool(disjoint),
+        'train_null': {k: int(v) for k, v in train.isnull().sum().items()},
+        'test_null': {k: int(v) for k, v in test.isnull().sum().items()},
+        'target_outliers': outliers,
+        'target_3sigma': [float(lower), float(upper)],
+        'max_psi': float(report['psi'].max()),
+    }
+
+
+def match_dictionary(columns, dictionary_path=DICTIONARY_PATH):
+    # 商户表字段与数据字典中的字段是否一致，数据字典不存在时返回None
+    if not dictionary_path or not os.path.exists(dictionary_path):
+        return None
+    df = pd.read_excel(dictionary_path, header=2, sheet_name='merchant')
+    return bool((pd.Series(list(columns)).sort_values().values == pd.Series(
+        [va[0] for va in df.values]).sort_values().values).all())
+
+
+def analyze_merchants(merchant, encoder=None, dictionary_path=DICTIONARY_PATH):
+    # #merchant_id 商户id
+    # merchant_group_id 商户组id
+    # merchant_category_id 商户类别id
+    # subsector_id 商品种类群id
+    # numerical_1 匿名数值特征1
+    # numerical_2 匿名数值特征2
+    # category_1 匿名离散特征1
+    # most_recent_sales_range 上个活跃月份收入等级，有序分类变量A>B>...>E
+    # most_recent_purchases_range 上个活跃月份交易数量等级，有序分类变量A>B>...>E
+    # avg_sales_lag3/6/12 过去3、6、12个月的月平均收入除以上一个活跃月份的收入
+    # avg_purchases_lag3/6/12 过去3、6、12个月的月平均交易量除以上一个活跃月份的交易量
+    # active_months_lag3/6/12 过去3、6、12个月的活跃月份数量
+    # category_2 匿名离散特征2
+    merchant = merchant.copy()
+    logger.info(merchant.head(5))
+    logger.info(frame_info(merchant))
+    logger.info((merchant.shape, merchant['merchant_id'].nunique()))  # 在一个商户有多条记录
+
+    # 对比商户数据特征是否和数据字典中特征
+    dictionary_match = match_dictionary(merchant.columns, dictionary_path)
+    if dictionary_match is not None:
+        logger.info(dictionary_match)
+
+    # 第二个匿名分类变量存在较多缺失值  avg_sales_lag3/6/12缺失值数量一致，则很有可能是存在13个商户同时确实了这三方面信息
+    null = merchant.isnull().sum()
+    logger.info(null)
+
+    # 检验特征是否划分完全
+    logger.info(len(MERCHANT_CATEGORY_COLS) + len(MERCHANT_NUMERIC_COLS) == merchant.shape[1])
+    logger.info(merchant[MERCHANT_CATEGORY_COLS].nunique())
+    logger.info(merchant[MERCHANT_CATEGORY_COLS].dtypes)
+    # 查看离散变量的缺失值情况
+    logger.info(merchant[MERCHANT_CATEGORY_COLS].isnull().sum())
+    logger.info(merchant['category_2'].unique())
+    merchant = fillna_cols(merchant, ['category_2'])
+
+    # 离散变量编码
+    # 变量类型应该是有三类，分别是连续性变量、名义型变量以及有序变量。连续变量较好理解，
+    # 所谓名义变量，指的是没有数值大小意义的分类变量，例如用1表示女、0表示男，0、1只是作为性别的指代，而没有1>0的含义。 独热编码
+    # 而所有有序变量，其也是离散型变量，但却有数值大小含义，如上述most_recent_purchases_range字段，销售等级中A>B>C>D>E，该离散变量的5个取值水平是有严格大小意义的，该变量就被称为有序变量。
+    # 字典编码，复用04预处理持久化的码表
+    encoder = encoder if encoder is not None else CategoryEncoder.load()
+    for col in MERCHANT_OBJECT_COLS:
+        merchant[col] = encoder.encode('merchants.' + col, merchant[col])
+
+    # 连续变量的数据探索
+    logger.info(merchant[MERCHANT_NUMERIC_COLS].dtypes)
+    logger.info(merchant[MERCHANT_NUMERIC_COLS].isnull().sum())
+    logger.info(merchant[MERCHANT_NUMERIC_COLS].describe())
+
+    # 据此我们发现连续型变量中存在部分缺失值，并且部分连续变量还存在无穷值inf，需要对其进行简单处理。
+    # 无穷值用最大值替换，与04的商户清洗共用MerchantCleaner。
+    inf_count = int(np.isinf(merchant[MERCHANT_INF_COLS].values).sum())
+
+    # 缺失值处理
+    # 不同于无穷值的处理，缺失值处理方法有很多。但该数据集缺失数据较少，33万条数据中只有13条连续特征缺失值，此处我们先简单采用均值进行填补处理，后续若有需要再进行优化处理。
+    merchant = MerchantCleaner().fit(merchant).fill(merchant)
+    logger.info(merchant[MERCHANT_NUMERIC_COLS].describe())
+
+    return {
+        'shape': list(merchant.shape),
+        'merchant_id_nunique': int(merchant['merchant_id'].nunique()),
+        'dictionary_match': dictionary_match,
+        'null': {k: int(v) for k, v in null.items()},
+        'inf_count': inf_count,
+    }
+
+
+def analyze_transactions(history_transaction, new_transaction, merchant, encoder=None):
+    # | 字段 | 解释 |
+    # | ------ | ------ |
+    # | card_id | 独一无二的信用卡标志 |
+    # | authorized_flag | 是否授权，Y/N |
+    # | city_id | 城市id，经过匿名处理 |
+    # | category_1 | 匿名特征，Y/N |
+    # | installments | 分期付款的次数 |
+    # | category_3 | 匿名类别特征，A/.../E |
+    # | merchant_category_id | 商户类别，匿名特征 |
+    # | merchant_id | 商户id |
+    # | month_lag	 | 距离2018年月的2月数差 |
+    # | purchase_amount | 标准化后的付款金额 |
+    # | purchase_date | 付款时间 |
+    # | category_2 | 匿名类别特征2 |
+    # | state_id | 州id，经过匿名处理 |
+    # | subsector_id | 商户类别特征 |
+    logger.info(history_transaction.head(5))
+    logger.info(frame_info(history_transaction))
+    logger.info(new_transaction.head(5))
+    logger.info(frame_info(new_transaction))
+
+    # why 交易表商户id不能重复
+    duplicate_cols = [col for col in merchant.columns if col in new_transaction.columns]
+    logger.info(duplicate_cols)
+
+    # 取出和商户数据表重复字段并去重
+    duplicate_shape = new_transaction[duplicate_cols].drop_duplicates().shape
+    logger.info(duplicate_shape)  # (291242, 7)
+    # 在填充缺失值之前统计，缺失值不计入
+    merchant_id_nunique = int(new_transaction['merchant_id'].nunique())
+    logger.info(merchant_id_nunique)  # 226129
+
+    numeric_cols = ['installments', 'month_lag', 'purchase_amount']
+    time_cols = ['purchase_date']
+    partitioned = len(numeric_cols) + len(TRANSACTION_CATEGORY_COLS) + len(time_cols) == new_transaction.shape[1]
+    logger.info(partitioned)
+
+    logger.info(new_transaction[TRANSACTION_CATEGORY_COLS].dtypes)
+    null = new_transaction[TRANSACTION_CATEGORY_COLS].isnull().sum()
+    logger.info(null)
+
+    # 和此前的merchant处理类似，我们对其object类型对象进行字典编码（id除外），并对利用-1对缺失值进行填补
+    # 字典编码，复用04预处理持久化的码表
+    encoder = encoder if encoder is not None else CategoryEncoder.load()
+    new_transaction = new_transaction.copy()
+    for col in TRANSACTION_OBJECT_COLS:
+        new_transaction[col] = encoder.encode('transactions.' + col, new_transaction[col])
+    new_transaction = fillna_cols(new_transaction, TRANSACTION_CATEGORY_COLS)
+    logger.info(new_transaction[TRANSACTION_CATEGORY_COLS].dtypes)
+
+    return {
+        'history_shape': list(history_transaction.shape),
+        'new_shape': list(new_transaction.shape),
+        'duplicate_cols': duplicate_cols,
+        'duplicate_rows': int(duplicate_shape[0]),
+        'merchant_id_nunique': merchant_id_nunique,
+        'columns_partitioned': bool(partitioned),
+        'null': {k: int(v) for k, v in null.items()},
+    }
+
+
+def run(steps=STEPS, figures=None, primeval_dir=PRIMEVAL_DIR, cache_dir=CACHE_DIR):
+    figures = figures or FigureWriter()
+    summary = {}
+    with pd.option_context('display.max_columns', None, 'display.max_rows', None):
+        if 'cards' in steps:
+            summary['cards'] = analyze_cards(load_table('train', primeval_dir=primeval_dir, cache_dir=cache_dir),
+                                             load_table('test', primeval_dir=primeval_dir, cache_dir=cache_dir),
+                                             figures)
+        if 'merchants' in steps:
+            summary['merchants'] = analyze_merchants(
+                load_table('merchants', primeval_dir=primeval_dir, cache_dir=cache_dir),
+                dictionary_path=os.path.join(primeval_dir, 'Data_Dictionary.xlsx'))
+        if 'transactions' in steps:
+            summary['transactions'] = analyze_transactions(
+                load_table('historical_transactions', primeval_dir=primeval_dir, cache_dir=cache_dir),
+                load_table('new_merchant_transactions', primeval_dir=primeval_dir, cache_dir=cache_dir),
+                load_table('merchants', primeval_dir=primeval_dir, cache_dir=cache_dir))
+    for path in figures.flush():
+        logger.info('figure: %s' % path)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('steps', nargs='*', help='可选 %s，默认全部' % ' '.join(STEPS))
+    parser.add_argument('--primeval-dir', default=PRIMEVAL_DIR)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--figures', default=None, help='图片输出目录，不指定则不绘图')
+    parser.add_argument('--show', action='store_true', help='交互显示图片')
+    parser.add_argument('--log-file', default=None)
+    parser.add_argument('--console', action='store_true')
+    parser.add_argument('--summary', default=None, help='统计结果json输出路径')
+    parser.add_argument('--streaming', action='store_true', help='分块流式统计，不加载整张表，不绘图')
+    parser.add_argument('--chunksize', type=int, default=None, help='流式统计每块的行数，默认见stream_eda.CHUNKSIZE')
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args(argv)
+    unknown = [step for step in args.steps if step not in STEPS]
+    if unknown:
+        parser.error('unknown steps: %s' % ', '.join(unknown))
+
+    setup_logger(args.log_file, console=args.console or not args.log_file)
+    if args.streaming:
+        # stream_eda依赖本模块中的函数，在此处导入避免循环导入
+        import stream_eda
+        summary = stream_eda.run(args.steps or STEPS, args.primeval_dir, args.chunksize or stream_eda.CHUNKSIZE,
+                                 args.workers)
+    else:
+        summary = run(args.steps or STEPS, FigureWriter(args.figures, args.show), args.primeval_dir, args.cache_dir)
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# 离散字段字典编码
+# 替代各脚本中复制的change_object_cols：每个字段只拟合一次码表（训练集、测试集等各数据共用），
+# 码表持久化到磁盘，后续批次出现新取值时追加到码表末尾，已有取值的编码保持不变。
+# 编码时先对字段factorize，只对少量唯一值做字符串转换和码表查找，再按factorize结果向量化展开。
+
+import json
+import os
+
+import pandas as pd
+
+CODEBOOK_PATH = '../data/model/codebook.json'
+
+
+class CategoryEncoder(object):
+
+    def __init__(self, codebook=None):
+        # 字段名 -> 取值列表（统一转为字符串），列表下标即编码
+        self.codebook = codebook if codebook is not None else {}
+
+    @staticmethod
+    def _values(series, fill):
+        # 与原先se.fillna(fill).astype(str)的取值一致
+        values = set()
+        for se in series:
+            values.update(str(v) for v in se.dropna().unique())
+            if se.hasnans:
+                values.add(str(fill))
+        return values
+
+    def fit(self, key, *series, fill=-1):
+        # 按字典序生成码表，与change_object_cols的编码结果一致
+        self.codebook[key] = sorted(self._values(series, fill))
+        return self
+
+    def update(self, key, *series, fill=-1):
+        # 增量更新：新取值按字典序追加到末尾，返回新增的取值
+        if key not in self.codebook:
+            self.fit(key, *series, fill=fill)
+            return list(self.codebook[key])
+        new = sorted(self._values(series, fill) - set(self.codebook[key]))
+        self.codebook[key].extend(new)
+        return new
+
+    def transform(self, key, se, fill=-1):
+        # 码表中不存在的取值编码为-1
+        codes, uniques = pd.factorize(se)
+        index = pd.Index(self.codebook[key])
+        lookup = index.get_indexer([str(v) for v in uniques] + [str(fill)])
+        # factorize对缺失值返回-1，正好取到lookup最后一位即填充值的编码
+        return lookup[codes]
+
+    def encode(self, key, se, fill=-1):
+        self.update(key, se, fill=fill)
+        return self.transform(key, se, fill=fill)
+
+    def save(self, path=CODEBOOK_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(self.codebook, f, ensure_ascii=False, indent=1)
+
+    @classmethod
+    def load(cls, path=CODEBOOK_PATH):
+        # 码表文件不存在时返回空编码器
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            return cls(json.load(f))
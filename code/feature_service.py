@@ -0,0 +1,264 @@
+# 单卡在线特征服务
+# 仓库中的处理都是离线批量的，打分时需要在几毫秒内为单张卡给出特征。这里的FeatureStore常驻内存：
+# - 启动时载入码表、清洗后的商户属性以及离线输出的卡属性(train_pre/test_pre)与卡粒度聚合特征(card_features)，
+#   商户与卡各自映射为整数序号，属性与特征存为按序号取行的二维数组；
+# - 对请求中的原始交易（字段与取值格式同new_merchant_transactions.csv）按与04相同的规则编码与清洗：
+#   字符型字段按持久化的码表编码，缺失值记为'-1'的编码，其余离散字段缺失值填-1，提取日期特征并关联商户字段，
+#   码表中不存在的取值编码为-1（在线服务只读码表，不追加新取值）；
+# - 每张卡的特征向量 = 离线的卡属性与聚合特征 + 以card_features的同一套定义在本次请求交易上计算的聚合特征(batch_前缀)。
+# 逐条交易只做字典查找与numpy运算，不经过pandas的分组与merge。
+# serve()为基于asyncio的本地HTTP服务：GET /health、GET /schema、POST /features。
+# 用法: python feature_service.py --port 8080
+#      curl -d '{"card_ids": ["C_ID_..."], "transactions": [{...}]}' localhost:8080/features
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from card_features import card_feature_arrays
+from columnar import read_table
+from date_features import date_features
+from encoder import CODEBOOK_PATH, CategoryEncoder
+from join import MerchantAttributes
+from loader import CACHE_DIR, PRIMEVAL_DIR
+from log_config import setup_logger
+from preprocess import (MERCHANT_MERGE_COLS, PREPROCESS_DIR, TRANSACTION_CATEGORY_COLS, TRANSACTION_OBJECT_COLS,
+                        merchant_stats_path, read_clean_merchant)
+
+logger = logging.getLogger('mylogger')
+
+CARD_COLS = ['first_active_month', 'feature_1', 'feature_2', 'feature_3']
+BATCH_PREFIX = 'batch_'
+# 原始交易字段，与new_merchant_transactions.csv的列顺序一致
+RAW_COLS = ['authorized_flag', 'card_id', 'city_id', 'category_1', 'installments', 'category_3',
+            'merchant_category_id', 'merchant_id', 'month_lag', 'purchase_amount', 'purchase_date',
+            'category_2', 'state_id', 'subsector_id']
+ID_COLS = ['card_id', 'merchant_id']
+MERGED_COLS = MERCHANT_MERGE_COLS[1:]
+
+
+def read_output(preprocess_dir, name, columns=None):
+    # 预处理输出为列式目录或csv
+    path = os.path.join(preprocess_dir, name)
+    if os.path.isdir(path):
+        return read_table(path, columns)
+    return pd.read_csv(path + '.csv', usecols=columns)
+
+
+def is_missing(value):
+    return value is None or value != value
+
+
+class FeatureStore(object):
+
+    def __init__(self, preprocess_dir=PREPROCESS_DIR, codebook_path=CODEBOOK_PATH, primeval_dir=PRIMEVAL_DIR,
+                 cache_dir=CACHE_DIR):
+        encoder = CategoryEncoder.load(codebook_path)
+        # 字段 -> {取值: 编码}
+        self.codes = {col: {value: i for i, value in enumerate(encoder.codebook['transactions.' + col])}
+                      for col in TRANSACTION_OBJECT_COLS + ['purchase_month']}
+        # 直接读取04写出的清洗后商户缓存，服务不写码表、清洗参数与缓存；缓存缺失或过期时报错
+        merchant = read_clean_merchant(encoder, primeval_dir, cache_dir, merchant_stats_path(codebook_path))
+        attributes = MerchantAttributes(merchant, MERGED_COLS)
+        self.merchant_rows = {str(value): i for i, value in enumerate(attributes.index)}
+        self.merchant_values = np.column_stack([attributes.arrays[col] for col in MERGED_COLS]).astype(np.float64)
+
+        cards = pd.concat([read_output(preprocess_dir, name, ['card_id'] + CARD_COLS)
+                           for name in ['train_pre', 'test_pre']], ignore_index=True)
+        features = read_output(preprocess_dir, 'card_features')
+        card_ids = pd.Index(cards['card_id'].astype(str)).append(pd.Index(features['card_id'].astype(str))).unique()
+        self.card_rows = {card: i for i, card in enumerate(card_ids)}
+        self.feature_cols = [col for col in features.columns if col != 'card_id']
+        self.lags = sorted(int(col.split('_')[2]) for col in self.feature_cols
+                           if col.startswith('month_lag_') and col.endswith('_count'))
+        # 最后多一行缺失值，不存在的卡序号记为-1时正好取到该行
+        self.card_values = np.full((len(card_ids) + 1, len(CARD_COLS) + len(self.feature_cols)), np.nan)
+        self.card_values[card_ids.get_indexer(cards['card_id'].astype(str)), :len(CARD_COLS)] = \
+            cards[CARD_COLS].values.astype(np.float64)
+        self.card_values[card_ids.get_indexer(features['card_id'].astype(str)), len(CARD_COLS):] = \
+            features[self.feature_cols].values.astype(np.float64)
+        self.feature_names = CARD_COLS + self.feature_cols + [BATCH_PREFIX + col for col in self.feature_cols]
+        logger.info('feature store: %d cards, %d merchants, %d features'
+                    % (len(card_ids), len(self.merchant_rows), len(self.feature_names)))
+
+    def _encode_object(self, col, values):
+        codes = self.codes[col]
+        missing = codes.get('-1', -1)
+        return np.array([missing if is_missing(v) else codes.get(str(v), -1) for v in values], dtype=np.int64)
+
+    @staticmethod
+    def _numeric(col, values):
+        # 离散字段缺失值填-1，其他整数字段（installments、month_lag）有缺失时保留为NaN
+        fill = -1 if col in TRANSACTION_CATEGORY_COLS else np.nan
+        values = np.array([fill if is_missing(v) else v for v in values], dtype=np.float64)
+        return values if np.isnan(values).any() else values.astype(np.int64)
+
+    def transform_columns(self, records):
+        # 原始交易(字典列表) -> 与preprocess.build_transaction(diffs=False)相同的列与取值，列名 -> 数组
+        columns = {}
+        for col in RAW_COLS:
+            values = [record.get(col) for record in records]
+            if col in TRANSACTION_OBJECT_COLS:
+                columns[col] = self._encode_object(col, values)
+            elif col in ID_COLS:
+                columns[col] = np.array([-1 if is_missing(v) else v for v in values], dtype=object)
+            elif col == 'purchase_amount':
+                columns[col] = np.array([np.nan if is_missing(v) else v for v in values], dtype=np.float32)
+            elif col == 'purchase_date':
+                columns[col] = np.array(values, dtype='datetime64[ns]')
+            else:
+                columns[col] = self._numeric(col, values)
+        for name, values in date_features(columns['purchase_date']).items():
+            columns[name] = values
+        columns['purchase_month'] = self._encode_object('purchase_month', columns['purchase_month'])
+        rows = np.array([self.merchant_rows.get(str(v), -1) for v in columns['merchant_id']], dtype=np.int64)
+        merged = self.merchant_values[rows]
+        merged[rows < 0] = np.nan
+        for i, col in enumerate(MERGED_COLS):
+            columns[col] = merged[:, i]
+        return columns
+
+    def transform(self, records):
+        return pd.DataFrame(self.transform_columns(records))
+
+    def card_vectors(self, card_ids):
+        rows = np.array([self.card_rows.get(card, -1) for card in card_ids], dtype=np.int64)
+        return self.card_values[rows]
+
+    def features(self, card_ids=None, records=None):
+        # 返回(卡号列表, 特征矩阵)；card_ids为None时取请求交易中出现的卡，按首次出现顺序
+        records = records or []
+        if card_ids is None:
+            card_ids = list(dict.fromkeys(str(record['card_id']) for record in records))
+        batch = np.full((len(card_ids), len(self.feature_cols)), np.nan)
+        if records:
+            # 请求中的交易很少，不构造DataFrame，直接在数组上按card_features的定义计算
+            aggregated = card_feature_arrays(self.transform_columns(records), lags=self.lags)
+            rows = {str(card): i for i, card in enumerate(aggregated['card_id'])}
+            positions = np.array([rows.get(card, -1) for card in card_ids], dtype=np.int64)
+            found = positions >= 0
+            values = np.column_stack([aggregated[col] for col in self.feature_cols]).astype(np.float64)
+            batch[found] = values[positions[found]]
+        return card_ids, np.hstack([self.card_vectors(card_ids), batch])
+
+
+def _json_vector(values):
+    # json中没有NaN，缺失记为null
+    return [None if v != v else float(v) for v in values]
+
+
+def parse_features_request(body):
+    # 请求体须为json对象：card_ids为字符串列表、transactions为对象列表，两者均可省略；格式不符时抛出ValueError
+    request = json.loads(body or b'{}')
+    if not isinstance(request, dict):
+        raise ValueError('request body must be a JSON object, got %s' % type(request).__name__)
+    card_ids, records = request.get('card_ids'), request.get('transactions')
+    if card_ids is not None and not (isinstance(card_ids, list) and all(isinstance(c, str) for c in card_ids)):
+        raise ValueError('card_ids must be a list of strings')
+    if records is not None and not (isinstance(records, list) and all(isinstance(r, dict) for r in records)):
+        raise ValueError('transactions must be a list of objects')
+    return card_ids, records
+
+
+def handle_request(store, method, path, body):
+    # 返回(状态码, json对象)
+    if method == 'GET' and path == '/health':
+        return 200, {'status': 'ok', 'cards': len(store.card_rows)}
+    if method == 'GET' and path == '/schema':
+        return 200, {'features': store.feature_names}
+    if method == 'POST' and path == '/features':
+        try:
+            card_ids, values = store.features(*parse_features_request(body))
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {'error': '%s: %s' % (type(e).__name__, e)}
+        return 200, {'features': {card: _json_vector(row) for card, row in zip(card_ids, values)}}
+    return 404, {'error': 'not found: %s %s' % (method, path)}
+
+
+REASONS = {200: b'OK', 400: b'Bad Request', 404: b'Not Found'}
+
+
+async def write_response(writer, status, payload):
+    data = json.dumps(payload).encode()
+    writer.write(b'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n'
+                 % (status, REASONS[status], len(data)) + data)
+    await writer.drain()
+
+
+async def read_request(reader):
+    # 返回(方法, 路径, 请求头, 请求体)，连接已关闭时返回None；请求行或Content-Length格式错误时抛出ValueError
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode('latin-1').split()
+    if len(parts) < 2:
+        raise ValueError('malformed request line: %r' % line)
+    headers = {}
+    while True:
+        header = await reader.readline()
+        if header in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = header.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get('content-length', 0))
+    if length < 0:
+        raise ValueError('negative Content-Length: %d' % length)
+    return parts[0], parts[1], headers, await reader.readexactly(length)
+
+
+async def handle_connection(store, reader, writer):
+    # HTTP/1.1，支持keep-alive；特征计算是CPU密集的同步调用，单核上不需要另开线程
+    try:
+        while True:
+            try:
+                request = await read_request(reader)
+            except ValueError as e:
+                # 无法确定请求的边界，返回400后关闭连接
+                await write_response(writer, 400, {'error': '%s: %s' % (type(e).__name__, e)})
+                break
+            if request is None:
+                break
+            method, path, headers, body = request
+            status, payload = handle_request(store, method, path, body)
+            await write_response(writer, status, payload)
+            if headers.get('connection', '').lower() == 'close':
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(store, host='127.0.0.1', port=8080):
+    return await asyncio.start_server(lambda r, w: handle_connection(store, r, w), host, port)
+
+
+async def serve(store, host='127.0.0.1', port=8080):
+    server = await start_server(store, host, port)
+    logger.info('feature service listening on %s:%d' % (host, port))
+    async with server:
+        await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--preprocess-dir', default=PREPROCESS_DIR)
+    parser.add_argument('--codebook-path', default=CODEBOOK_PATH)
+    parser.add_argument('--log-file', default='./log/feature_service.log')
+    parser.add_argument('--console', action='store_true')
+    args = parser.parse_args()
+
+    setup_logger(args.log_file, console=args.console)
+    store = FeatureStore(args.preprocess_dir, args.codebook_path)
+    asyncio.run(serve(store, args.host, args.port))
+
+
+if __name__ == '__main__':
+    main()
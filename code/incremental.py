@@ -0,0 +1,208 @@
+# 增量预处理
+# 每次数据更新通常只是new_merchant_transactions新增一个月，历史交易几乎不变，04却每次都从头重建。
+# 这里对各输入文件计算sha1指纹，交易表再按(来源文件, 购买月份)划分分区并对每个分区的行内容计算指纹：
+# - 商户清洗结果由preprocess.load_clean_merchant按商户文件指纹缓存，码表沿用持久化的码表（新取值只会追加，已有编码不变）；
+# - 只对新增或内容变化的分区重新编码、提取日期特征并合并商户字段，未变化的分区直接取上次的中间表；
+# - purchase_day_diff/purchase_month_diff只依赖同一张卡内的行顺序，只对有行新增或删除的卡重新计算。
+# 上次的中间表（含每行的来源、文件内行号与分区月份）以列式格式保存在STATE_DIR下，
+# 输出与以相同码表全量运行04完全一致（见bench_incremental.py）；商户表或码表被改动时自动退化为全量重建。
+
+import gc
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from columnar import read_table, write_table
+from date_features import date_features
+from encoder import CODEBOOK_PATH, CategoryEncoder
+from loader import CACHE_DIR, PRIMEVAL_DIR, TABLE_FILES, concat_tables, file_fingerprint
+from preprocess import (CARD_DIFF_COLS, PREPROCESS_DIR, TRANSACTION_OUTPUTS, add_card_diffs, build_transaction,
+                        derive_output, encode_cards, load_clean_merchant, load_stage, merchant_stats_path,
+                        output_codebooks, write_output)
+from profiling import stage
+
+logger = logging.getLogger('mylogger')
+
+STATE_DIR = '../data/primeval/incremental'
+STATE_FILE = 'state.json'
+# 中间表的列发生变化（如保留purchase_date）时递增，旧版本的状态视为无效
+STATE_VERSION = 2
+# 与load_transactions一致，先new后history
+SOURCES = ['new_merchant_transactions', 'historical_transactions']
+# 中间表中记录来源文件序号、文件内行号与分区月份的辅助列
+SOURCE_COL, ROW_COL, MONTH_COL = '_source', '_row', '_month'
+HELPER_COLS = [SOURCE_COL, ROW_COL, MONTH_COL]
+
+
+def input_fingerprints(primeval_dir, state):
+    # 文件大小与修改时间都未变时沿用上次的sha1，避免每次重新读取数GB的历史交易文件
+    fingerprints, stats = {}, {}
+    for name, filename in TABLE_FILES.items():
+        path = os.path.join(primeval_dir, filename)
+        if not os.path.exists(path):
+            fingerprints[name] = None
+            continue
+        stat = os.stat(path)
+        stats[name] = [stat.st_size, stat.st_mtime_ns]
+        if state['stats'].get(name) == stats[name] and name in state['inputs']:
+            fingerprints[name] = state['inputs'][name]
+        else:
+            fingerprints[name] = file_fingerprint(path)
+    return fingerprints, stats
+
+
+def partition_rows(raw):
+    # 按购买月份(yyyymm)划分分区，返回 月份 -> 文件内行号(升序) 以及每个分区行内容的指纹
+    months = date_features(raw['purchase_date'])['purchase_month']
+    row_hashes = pd.util.hash_pandas_object(raw, index=False).values
+    order = np.argsort(months, kind='stable')
+    values, starts = np.unique(months[order], return_index=True)
+    ends = np.append(starts[1:], len(order))
+    rows, fingerprints = {}, {}
+    for month, start, end in zip(values, starts, ends):
+        rows[str(month)] = order[start:end]
+        fingerprints[str(month)] = hashlib.sha1(row_hashes[rows[str(month)]].tobytes()).hexdigest()
+    return months, rows, fingerprints
+
+
+def load_state(state_dir=STATE_DIR):
+    path = os.path.join(state_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {'version': STATE_VERSION, 'inputs': {}, 'stats': {}, 'codebook': None, 'partitions': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_state(state, state_dir=STATE_DIR):
+    with open(os.path.join(state_dir, STATE_FILE), 'w') as f:
+        json.dump(state, f, indent=1)
+
+
+def _reused_rows(previous, source, months, positions=None):
+    # 上次中间表中来源为source且月份在months中的行；positions给定时按当前文件内行号更新ROW_COL
+    mask = (previous[SOURCE_COL].values == source) & np.isin(previous[MONTH_COL].values, months)
+    reused = previous.loc[mask]
+    if positions is not None and len(reused):
+        # 未变化的分区行内容与相对顺序都不变，按原行号排序后与当前分区行号一一对应
+        reused = reused.sort_values(ROW_COL, kind='stable')
+        month_values = reused[MONTH_COL].values
+        rows = np.empty(len(reused), dtype=np.int64)
+        for month in months:
+            rows[month_values == month] = positions[str(month)]
+        reused = reused.assign(**{ROW_COL: rows})
+    return reused
+
+
+def update_transaction(merchant, encoder, state, inputs, previous, primeval_dir=PRIMEVAL_DIR, cache_dir=CACHE_DIR):
+    # inputs为本次各输入文件的指纹；返回拼接后的中间表（含差分列与辅助列）以及新的分区指纹
+    reused, changed, dropped_cards, partitions = [], [], [], {}
+    for source_index, source in enumerate(SOURCES):
+        known = state['partitions'].get(source, {})
+        if previous is not None and state['inputs'].get(source) == inputs[source] and known:
+            logger.info('%s: unchanged, reuse %d partitions' % (source, len(known)))
+            reused.append(_reused_rows(previous, source_index, [int(m) for m in known]))
+            partitions[source] = known
+            continue
+
+        raw = load_stage(source, primeval_dir, cache_dir)
+        with stage('partition', raw, table=source):
+            months, rows, fingerprints = partition_rows(raw)
+        partitions[source] = fingerprints
+        same = [m for m in fingerprints if previous is not None and known.get(m) == fingerprints[m]]
+        logger.info('%s: %d partitions, %d reused' % (source, len(fingerprints), len(same)))
+        if previous is not None:
+            reused.append(_reused_rows(previous, source_index, [int(m) for m in same], rows))
+            stale = (previous[SOURCE_COL].values == source_index) & ~np.isin(previous[MONTH_COL].values,
+                                                                             [int(m) for m in same])
+            dropped_cards.append(previous.loc[stale, 'card_id'].unique())
+        build_rows = np.sort(np.concatenate([rows[m] for m in fingerprints if m not in same] + [[]])).astype(np.int64)
+        if len(build_rows):
+            part = raw.iloc[build_rows].reset_index(drop=True)
+            part[SOURCE_COL] = np.int8(source_index)
+            part[ROW_COL] = build_rows
+            part[MONTH_COL] = months[build_rows]
+            changed.append(part)
+        del raw
+        gc.collect()
+
+    if changed:
+        transaction = build_transaction(concat_tables(changed), merchant, encoder, diffs=False)
+        for col in CARD_DIFF_COLS:
+            transaction[col] = np.nan
+        # 复用的行保留上次的差分值，列顺序以重新构建的部分为准
+        frames = [transaction] + [df[transaction.columns] for df in reused if len(df)]
+    else:
+        frames = [df for df in reused if len(df)]
+    transaction = concat_tables(frames) if len(frames) > 1 else frames[0].reset_index(drop=True)
+    order = np.lexsort((transaction[ROW_COL].values, transaction[SOURCE_COL].values))
+    transaction = transaction.iloc[order].reset_index(drop=True)
+    if previous is None:
+        return add_card_diffs(transaction), partitions
+
+    # 只对有行新增或删除的卡重新计算差分，其余卡的行及相对顺序不变，沿用上次结果
+    affected = [part['card_id'].unique() for part in changed] + dropped_cards
+    affected = pd.unique(np.concatenate([np.asarray(cards, dtype=object) for cards in affected] + [[]]))
+    logger.info('recompute diffs for %d cards' % len(affected))
+    mask = transaction['card_id'].isin(affected).values
+    if mask.any():
+        sub = add_card_diffs(transaction.loc[mask, ['card_id', 'purchase_day', 'purchase_month']].copy())
+        for col in CARD_DIFF_COLS:
+            transaction.loc[mask, col] = sub[col].values
+    return transaction, partitions
+
+
+def run_incremental(outputs=('d', 'g'), primeval_dir=PRIMEVAL_DIR, cache_dir=CACHE_DIR,
+                    preprocess_dir=PREPROCESS_DIR, codebook_path=CODEBOOK_PATH, state_dir=STATE_DIR, fmt='csv',
+                    refit_merchant=True):
+    os.makedirs(state_dir, exist_ok=True)
+    state = load_state(state_dir)
+    with stage('fingerprint'):
+        inputs, stats = input_fingerprints(primeval_dir, state)
+    table_path = os.path.join(state_dir, 'transaction')
+    # 商户表或码表与上次不一致时，上次的编码与商户字段都不再可用，全量重建
+    valid = (state.get('version') == STATE_VERSION and state['inputs'].get('merchants') == inputs['merchants']
+             and state['codebook'] is not None and state['codebook'] == file_fingerprint(codebook_path)
+             and os.path.exists(table_path))
+    if not valid:
+        logger.info('incremental state invalid, full rebuild')
+        state['partitions'] = {}
+        if os.path.exists(table_path):
+            shutil.rmtree(table_path)
+    encoder = CategoryEncoder.load(codebook_path)
+
+    # 训练集/测试集很小，每次直接重新编码
+    train, test = load_stage('train', primeval_dir, cache_dir), load_stage('test', primeval_dir, cache_dir)
+    with stage('encode_cards', [train, test]) as s:
+        train, test = s.output(encode_cards(train, test, encoder))
+    write_output(train, preprocess_dir, 'train_pre', fmt, output_codebooks(encoder))
+    write_output(test, preprocess_dir, 'test_pre', fmt, output_codebooks(encoder))
+    del train
+    del test
+
+    merchant = load_clean_merchant(encoder, primeval_dir, cache_dir, merchant_stats_path(codebook_path), refit_merchant)
+    with stage('load_state') as s:
+        previous = s.output(read_table(table_path) if valid else None)
+    transaction, partitions = update_transaction(merchant, encoder, state, inputs, previous, primeval_dir, cache_dir)
+    del merchant
+    del previous
+    gc.collect()
+
+    # 先写中间表与码表，最后更新指纹，中途失败时下次运行视为状态无效
+    with stage('save_state', transaction):
+        write_table(transaction, table_path)
+    encoder.save(codebook_path)
+    state.update(version=STATE_VERSION, inputs=inputs, stats=stats, codebook=file_fingerprint(codebook_path),
+                 partitions=partitions)
+    save_state(state, state_dir)
+
+    transaction = transaction.drop(columns=HELPER_COLS)
+    codebooks = output_codebooks(encoder)
+    for name in outputs:
+        write_output(derive_output(transaction, name), preprocess_dir, TRANSACTION_OUTPUTS[name][0], fmt, codebooks)
+        gc.collect()
+    return transaction
@@ -0,0 +1,59 @@
+# 整数代理键join
+# 将merchant_id映射为去重后商户表中的int32位置（代理键），商户属性按代理键存为数组，
+# 交易表与商户表的关联由字符串hash merge改为按代理键的向量化取值(gather)。
+# card_id在groupby中由dense_keys直接取category编码作为代理键，需要按给定卡号顺序排列时（如crosstab）用surrogate_keys查找。
+
+import numpy as np
+import pandas as pd
+
+
+def surrogate_keys(se, index):
+    # 将id映射为index中的位置，不存在或缺失的记为-1
+    if isinstance(se.dtype, pd.CategoricalDtype):
+        # category类型只需对类别做一次查找，再按codes展开
+        lookup = np.append(index.get_indexer(se.cat.categories), -1)
+        return lookup[se.cat.codes.values].astype(np.int32)
+    return index.get_indexer(se).astype(np.int32)
+
+
+def dense_keys(se):
+    # 单个字段的稠密代理键，用于groupby等只需要区分取值的场景
+    if isinstance(se.dtype, pd.CategoricalDtype):
+        return se.cat.codes.values.astype(np.int32)
+    return pd.factorize(se)[0].astype(np.int32)
+
+
+class MerchantAttributes(object):
+    # 去重后的商户属性，按代理键存为数组
+
+    def __init__(self, merchant, cols, id_col='merchant_id'):
+        merchant = merchant.drop_duplicates(id_col)
+        self.index = pd.Index(np.asarray(merchant[id_col]))
+        self.cols = list(cols)
+        self.arrays = {col: merchant[col].values for col in self.cols}
+
+    def keys(self, se):
+        return surrogate_keys(se, self.index)
+
+    def gather(self, keys):
+        # 与left merge一致：存在未匹配的行时结果转为float并以NaN表示
+        missing = keys < 0
+        has_missing = missing.any()
+        result = {}
+        for col, values in self.arrays.items():
+            taken = values.take(np.where(missing, 0, keys)) if len(values) else np.full(len(keys), np.nan)
+            if has_missing:
+                taken = taken.astype(np.float64)
+                taken[missing] = np.nan
+            result[col] = taken
+        return result
+
+
+def merge_merchant(transaction, merchant, cols, id_col='merchant_id'):
+    # 替代pd.merge(transaction, merchant[[id_col] + cols], how='left', on=id_col)，
+    # merchant可以是商户表或已构建好的MerchantAttributes
+    if not isinstance(merchant, MerchantAttributes):
+        merchant = MerchantAttributes(merchant, cols, id_col)
+    for col, values in merchant.gather(merchant.keys(transaction[id_col])).items():
+        transaction[col] = values
+    return transaction
@@ -0,0 +1,229 @@
+# 基于polars惰性查询的预处理后端
+# 04的pandas实现全程立即执行，拼接、合并等中间表都完整驻留内存。这里用polars的LazyFrame表达相同的逻辑步骤：
+# 商户清洗、交易编码、日期特征、商户字段合并、以card_id为粒度的差分与聚合特征，
+# 查询计划由polars做谓词/投影下推，输出通过流式引擎sink到文件，不需要在内存中物化整张交易表。
+# 码表与pandas后端共用CategoryEncoder：先对编码字段做一次流式去重更新码表，再以replace_strict映射为编码。
+# 差分与聚合依赖同一张卡的全部交易，partitions大于1时按card_id的hash分区逐个执行并暂存为parquet(spill_dir)，
+# 最后按原始行号流式排序合并，单个分区放得进内存即可处理超过内存的数据。
+# polars为可选依赖，未安装时只能使用pandas后端。
+# 各步骤在sink时才合并执行，profiling只能按码表拟合与各输出的写入分阶段记录。
+
+import logging
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from card_features import AGG_COLS, LAG_COL, NUNIQUE_COLS
+from encoder import CODEBOOK_PATH, CategoryEncoder
+from loader import CACHE_DIR, PRIMEVAL_DIR, TABLE_FILES
+from preprocess import (MERCHANT_CATEGORY_COLS, MERCHANT_DUPLICATE_COLS, MERCHANT_INF_COLS,
+                        MERCHANT_MERGE_COLS, MERCHANT_NUMERIC_COLS, MERCHANT_OBJECT_COLS, PREPROCESS_DIR,
+                        TRANSACTION_CATEGORY_COLS, TRANSACTION_OBJECT_COLS, MerchantCleaner, encode_cards,
+                        load_stage, merchant_stats_path, output_codebooks, write_output)
+from profiling import stage
+
+try:
+    import polars as pl
+    HAS_POLARS = True
+except ImportError:
+    HAS_POLARS = False
+
+logger = logging.getLogger('mylogger')
+
+LAZY_OUTPUT_FORMATS = ['csv', 'parquet']
+ROW_COL = '_row'
+# 与load_transactions一致，先new后history
+SOURCES = ['new_merchant_transactions', 'historical_transactions']
+# 与pandas后端中间表一致的列顺序（purchase_date被日期特征替换）
+TRANSACTION_COLS = ['authorized_flag', 'card_id', 'city_id', 'category_1', 'installments', 'category_3',
+                    'merchant_category_id', 'merchant_id', 'month_lag', 'purchase_amount', 'category_2', 'state_id',
+                    'subsector_id', 'purchase_month', 'purchase_hour_section', 'purchase_day']
+MERGED_COLS = MERCHANT_MERGE_COLS[1:]
+
+
+def _transaction_schema():
+    # 与loader的声明类型一致：purchase_amount为float32，category_2读为浮点以容纳缺失值
+    return {'authorized_flag': pl.String, 'card_id': pl.String, 'category_1': pl.String, 'category_3': pl.String,
+            'merchant_id': pl.String, 'purchase_date': pl.String, 'category_2': pl.Float64,
+            'purchase_amount': pl.Float32}
+
+
+def scan_transactions(primeval_dir=PRIMEVAL_DIR):
+    frames = [pl.scan_csv(os.path.join(primeval_dir, TABLE_FILES[name]), schema_overrides=_transaction_schema())
+              for name in SOURCES]
+    return pl.concat(frames, how='vertical').with_row_index(ROW_COL)
+
+
+def scan_merchants(primeval_dir=PRIMEVAL_DIR):
+    return pl.scan_csv(os.path.join(primeval_dir, TABLE_FILES['merchants']),
+                       schema_overrides={'merchant_id': pl.String, 'category_2': pl.Float64})
+
+
+def fit_codebooks(encoder, queries, fill=-1):
+    # queries: 码表名 -> 只含一列的LazyFrame；一次collect_all完成全部去重，公共的扫描只执行一次
+    keys = list(queries)
+    frames = pl.collect_all([queries[key].unique() for key in keys], engine='streaming')
+    for key, frame in zip(keys, frames):
+        encoder.update(key, frame.to_series().to_pandas(), fill=fill)
+
+
+def encode_expr(encoder, key, expr, fill=-1):
+    # 与CategoryEncoder.transform一致：缺失值按str(fill)取编码，码表中不存在的取值为-1
+    codebook = encoder.codebook[key]
+    return expr.cast(pl.String).fill_null(str(fill)).replace_strict(
+        codebook, list(range(len(codebook))), default=-1, return_dtype=pl.Int64)
+
+
+def fill_expr(col, dtype, value=-1):
+    return pl.col(col).fill_null(str(value) if dtype == pl.String else value)
+
+
+def date_exprs(col='purchase_date'):
+    # 与date_features一致：购买月份yyyymm、时间段hour//6、是否周末weekday//5（polars的weekday从1开始）
+    ts = pl.col(col).str.to_datetime('%Y-%m-%d %H:%M:%S')
+    return [
+        (ts.dt.year().cast(pl.Int64) * 100 + ts.dt.month().cast(pl.Int64)).alias('purchase_month'),
+        (ts.dt.hour().cast(pl.Int64) // 6).alias('purchase_hour_section'),
+        ((ts.dt.weekday().cast(pl.Int64) - 1) // 5).alias('purchase_day'),
+    ]
+
+
+def clean_merchant_lazy(merchant, encoder, cleaner=None):
+    # 与preprocess.clean_merchant步骤一致，只保留merge需要的字段，其余字段的计算由投影下推裁剪；
+    # 给出已拟合的MerchantCleaner时以其参数作为字面量，查询中不再对商户表计算统计量
+    schema = merchant.collect_schema()
+    merchant = merchant.with_columns(
+        [encode_expr(encoder, 'merchants.' + col, pl.col(col)).alias(col) for col in MERCHANT_OBJECT_COLS])
+    merchant = merchant.with_columns([fill_expr(col, schema[col]) for col in MERCHANT_CATEGORY_COLS
+                                      if col not in MERCHANT_OBJECT_COLS])
+    if cleaner is None:
+        inf_max = pl.max_horizontal([pl.col(col).replace(np.inf, -99).max() for col in MERCHANT_INF_COLS])
+        means = {col: pl.col(col).mean() for col in MERCHANT_NUMERIC_COLS}
+    else:
+        inf_max = pl.lit(cleaner.inf_max)
+        means = {col: pl.lit(cleaner.means[col]) for col in MERCHANT_NUMERIC_COLS}
+    merchant = merchant.with_columns([pl.when(pl.col(col) == np.inf).then(inf_max).otherwise(pl.col(col)).alias(col)
+                                      for col in MERCHANT_INF_COLS])
+    merchant = merchant.with_columns([pl.col(col).fill_null(means[col]) for col in MERCHANT_NUMERIC_COLS])
+    merchant = merchant.drop(MERCHANT_DUPLICATE_COLS[1:])
+    return merchant.unique(subset='merchant_id', keep='first', maintain_order=True)
+
+
+def build_transaction_lazy(transaction, merchant, encoder):
+    # 编码、日期特征与商户字段合并，未匹配的商户字段为缺失值
+    schema = transaction.collect_schema()
+    transaction = transaction.with_columns(
+        [encode_expr(encoder, 'transactions.' + col, pl.col(col)).alias(col) for col in TRANSACTION_OBJECT_COLS])
+    transaction = transaction.with_columns([fill_expr(col, schema[col]) for col in TRANSACTION_CATEGORY_COLS
+                                            if col not in TRANSACTION_OBJECT_COLS])
+    transaction = transaction.with_columns(pl.col('category_2').cast(pl.Int64), *date_exprs())
+    transaction = transaction.with_columns(
+        encode_expr(encoder, 'transactions.purchase_month', pl.col('purchase_month')).alias('purchase_month'))
+    transaction = transaction.join(merchant.select(['merchant_id'] + MERGED_COLS), on='merchant_id', how='left',
+                                   maintain_order='left')
+    return transaction.select([ROW_COL] + TRANSACTION_COLS + [pl.col(col).cast(pl.Float64) for col in MERGED_COLS])
+
+
+def card_diffs_lazy(transaction):
+    return transaction.with_columns(
+        [pl.col(col).diff().over('card_id').cast(pl.Float64).alias(col + '_diff')
+         for col in ['purchase_day', 'purchase_month']])
+
+
+def card_features_lazy(transaction, lags):
+    # 与card_features.card_features的列与顺序一致，卡按首次出现的行排列
+    aggs = [pl.col(ROW_COL).min().alias(ROW_COL), pl.len().cast(pl.Int64).alias('transaction_count')]
+    for col in AGG_COLS:
+        values = pl.col(col).cast(pl.Float64)
+        aggs += [values.sum().alias(col + '_sum'), values.mean().alias(col + '_mean'),
+                 values.std(ddof=1).alias(col + '_std'), values.min().alias(col + '_min'),
+                 values.max().alias(col + '_max')]
+    aggs += [pl.col(col).drop_nulls().n_unique().cast(pl.Int64).alias(col + '_nunique') for col in NUNIQUE_COLS]
+    for lag in lags:
+        in_lag = pl.col(LAG_COL) == lag
+        aggs += [in_lag.sum().cast(pl.Int64).alias('month_lag_%d_count' % lag),
+                 pl.col('purchase_amount').cast(pl.Float64).filter(in_lag).sum().alias(
+                     'month_lag_%d_purchase_amount_sum' % lag)]
+    return transaction.group_by('card_id').agg(aggs)
+
+
+def transaction_d_lazy(transaction):
+    return transaction.drop(ROW_COL).with_columns([pl.col(col).fill_null(-1).cast(pl.Int64) for col in MERGED_COLS])
+
+
+def transaction_g_lazy(transaction):
+    return card_diffs_lazy(transaction).drop(ROW_COL)
+
+
+def _sink(frame, path, fmt):
+    with stage('write', output=os.path.basename(path), format=fmt, backend='lazy'):
+        if fmt == 'parquet':
+            frame.sink_parquet(path)
+        else:
+            frame.sink_csv(path)
+    logger.info('%s written (lazy %s)' % (os.path.basename(path), fmt))
+
+
+def _partitioned(transaction, partitions, build, spill_dir, name):
+    # 按card_id的hash分区分别执行build并暂存为parquet，返回按原始行号排序的合并查询
+    paths = []
+    for k in range(partitions):
+        path = os.path.join(spill_dir, '%s_%d.parquet' % (name, k))
+        with stage('spill', output=name, partition=k, backend='lazy'):
+            build(transaction.filter(pl.col('card_id').hash(seed=0) % partitions == k)).sink_parquet(path)
+        paths.append(path)
+    return pl.scan_parquet(paths).sort(ROW_COL)
+
+
+def run_lazy(outputs=('d', 'g'), primeval_dir=PRIMEVAL_DIR, cache_dir=CACHE_DIR, preprocess_dir=PREPROCESS_DIR,
+             codebook_path=CODEBOOK_PATH, fmt='csv', partitions=1, spill_dir=None, refit_merchant=True):
+    if not HAS_POLARS:
+        raise ImportError('the lazy backend requires polars')
+    encoder = CategoryEncoder.load(codebook_path)
+
+    # 训练集/测试集很小，沿用pandas实现
+    train, test = load_stage('train', primeval_dir, cache_dir), load_stage('test', primeval_dir, cache_dir)
+    with stage('encode_cards', [train, test]) as s:
+        train, test = s.output(encode_cards(train, test, encoder))
+    write_output(train, preprocess_dir, 'train_pre', 'csv', output_codebooks(encoder))
+    write_output(test, preprocess_dir, 'test_pre', 'csv', output_codebooks(encoder))
+    del train
+    del test
+
+    # 码表更新顺序与pandas后端一致（商户字段、交易字符型字段、购买月份），保证持久化的码表完全相同
+    merchant = scan_merchants(primeval_dir)
+    raw = scan_transactions(primeval_dir)
+    with stage('fit_codebooks', backend='lazy'):
+        fit_codebooks(encoder, {'merchants.' + col: merchant.select(col) for col in MERCHANT_OBJECT_COLS})
+        queries = {'transactions.' + col: raw.select(col) for col in TRANSACTION_OBJECT_COLS}
+        queries['transactions.purchase_month'] = raw.select(date_exprs()[0])
+        fit_codebooks(encoder, queries)
+    encoder.save(codebook_path)
+
+    # refit_merchant为False时沿用pandas后端保存的商户清洗参数
+    cleaner = None if refit_merchant else MerchantCleaner.load(merchant_stats_path(codebook_path))
+    transaction = build_transaction_lazy(raw, clean_merchant_lazy(merchant, encoder, cleaner), encoder)
+    extension = '.parquet' if fmt == 'parquet' else '.csv'
+    spill_dir = spill_dir or tempfile.mkdtemp(dir=preprocess_dir)
+    os.makedirs(spill_dir, exist_ok=True)
+    try:
+        if 'd' in outputs:
+            _sink(transaction_d_lazy(transaction), os.path.join(preprocess_dir, 'transaction_d_pre' + extension), fmt)
+        if 'g' in outputs:
+            if partitions > 1:
+                result = _partitioned(transaction, partitions, card_diffs_lazy, spill_dir, 'g').drop(ROW_COL)
+            else:
+                result = transaction_g_lazy(transaction)
+            _sink(result, os.path.join(preprocess_dir, 'transaction_g_pre' + extension), fmt)
+        if 'card' in outputs:
+            lags = sorted(raw.select(pl.col(LAG_COL).unique()).collect(engine='streaming').to_series().to_list())
+            if partitions > 1:
+                result = _partitioned(transaction, partitions, lambda t: card_features_lazy(t, lags), spill_dir,
+                                      'card')
+            else:
+                result = card_features_lazy(transaction, lags).sort(ROW_COL)
+            _sink(result.drop(ROW_COL), os.path.join(preprocess_dir, 'card_features' + extension), fmt)
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
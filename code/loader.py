@@ -0,0 +1,139 @@
+# 原始数据统一加载
+# 首次加载时按声明的紧凑类型读取primeval下的csv，并转存为列式parquet缓存；
+# 之后只要缓存比原始csv新就直接读取缓存，避免各脚本重复解析文本。
+# 没有安装pyarrow时退化为按声明类型直接读取csv。
+# 读取后由downcast.py对未声明类型的字段按取值范围压缩，缓存中保存压缩后的类型。
+
+import hashlib
+import logging
+import os
+
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from downcast import optimize_memory
+
+logger = logging.getLogger('mylogger')
+
+PRIMEVAL_DIR = '../data/primeval'
+CACHE_DIR = '../data/primeval/cache'
+
+# 各表的声明类型，未列出的字段保持pandas默认类型
+TABLE_FILES = {
+    'train': 'train.csv',
+    'test': 'test.csv',
+    'merchants': 'merchants.csv',
+    'new_merchant_transactions': 'new_merchant_transactions.csv',
+    'historical_transactions': 'historical_transactions.csv',
+}
+
+CARD_DTYPES = {'card_id': 'category', 'feature_1': 'int8', 'feature_2': 'int8', 'feature_3': 'int8'}
+
+MERCHANT_DTYPES = {'merchant_id': 'category', 'merchant_group_id': 'int32', 'merchant_category_id': 'int16',
+                   'subsector_id': 'int8', 'category_1': 'category', 'most_recent_sales_range': 'category',
+                   'most_recent_purchases_range': 'category', 'active_months_lag3': 'int8',
+                   'active_months_lag6': 'int8', 'active_months_lag12': 'int8', 'category_4': 'category',
+                   'city_id': 'int16', 'state_id': 'int8', 'category_2': 'Int8'}
+
+TRANSACTION_DTYPES = {'authorized_flag': 'category', 'card_id': 'category', 'city_id': 'int16',
+                      'category_1': 'category', 'installments': 'int16', 'category_3': 'category',
+                      'merchant_category_id': 'int16', 'merchant_id': 'category', 'month_lag': 'int8',
+                      'purchase_amount': 'float32', 'category_2': 'Int8', 'state_id': 'int8',
+                      'subsector_id': 'int8'}
+
+TABLE_DTYPES = {
+    'train': CARD_DTYPES,
+    'test': CARD_DTYPES,
+    'merchants': MERCHANT_DTYPES,
+    'new_merchant_transactions': TRANSACTION_DTYPES,
+    'historical_transactions': TRANSACTION_DTYPES,
+}
+
+TABLE_DATE_COLS = {
+    'new_merchant_transactions': ['purchase_date'],
+    'historical_transactions': ['purchase_date'],
+}
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+def read_raw(name, primeval_dir=PRIMEVAL_DIR):
+    df = pd.read_csv(os.path.join(primeval_dir, TABLE_FILES[name]), dtype=TABLE_DTYPES[name])
+    for col in TABLE_DATE_COLS.get(name, []):
+        df[col] = pd.to_datetime(df[col], format='%Y-%m-%d %H:%M:%S')
+    return optimize_memory(df, name)
+
+
+def file_fingerprint(path, block_size=1 << 24):
+    if not os.path.exists(path):
+        return None
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+def cache_path(name, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, name + '.parquet')
+
+
+def is_fresh(name, primeval_dir=PRIMEVAL_DIR, cache_dir=CACHE_DIR):
+    path = cache_path(name, cache_dir)
+    return os.path.exists(path) and \
+        os.path.getmtime(path) >= os.path.getmtime(os.path.join(primeval_dir, TABLE_FILES[name]))
+
+
+def build_cache(name, primeval_dir=PRIMEVAL_DIR, cache_dir=CACHE_DIR):
+    df = read_raw(name, primeval_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    df.to_parquet(cache_path(name, cache_dir), index=False)
+    logger.info('cache built: %s %s' % (name, df.shape))
+    return df
+
+
+def load_table(name, columns=None, primeval_dir=PRIMEVAL_DIR, cache_dir=CACHE_DIR):
+    if not HAS_PYARROW:
+        df = read_raw(name, primeval_dir)
+        return df if columns is None else df[columns]
+    if is_fresh(name, primeval_dir, cache_dir):
+        # 压缩之前构建的缓存仍为默认类型，读取后同样压缩；已压缩的字段不会再变化
+        return optimize_memory(pd.read_parquet(cache_path(name, cache_dir), columns=columns), name)
+    df = build_cache(name, primeval_dir, cache_dir)
+    return df if columns is None else df[columns]
+
+
+def concat_tables(frames):
+    # category字段先统一类别再拼接，否则pd.concat会退化为object类型
+    frames = [df.copy(deep=False) for df in frames]
+    for col in frames[0].columns:
+        if all(isinstance(df[col].dtype, pd.CategoricalDtype) for df in frames):
+            categories = union_categoricals([df[col] for df in frames]).categories
+            for df in frames:
+                df[col] = df[col].cat.set_categories(categories)
+    return pd.concat(frames, axis=0, ignore_index=True)
+
+
+def load_transactions(columns=None, primeval_dir=PRIMEVAL_DIR, cache_dir=CACHE_DIR):
+    # 04与各基准使用的交易全表：先new后history进行拼接
+    return concat_tables([load_table(name, columns, primeval_dir, cache_dir)
+                          for name in ['new_merchant_transactions', 'historical_transactions']])
+
+
+def main():
+    # 一次性将全部原始表转换为缓存
+    logger.setLevel(logging.DEBUG)
+    logger.addHandler(logging.StreamHandler())
+    for name in TABLE_FILES:
+        if is_fresh(name):
+            logger.info('cache fresh: %s' % name)
+        else:
+            build_cache(name)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+# 日志输出配置
+# 各脚本统一使用名为mylogger的logger，原先在import时就以相对路径打开./log/...的FileHandler，
+# 这里改为由入口显式调用，输出文件、是否输出到控制台以及日志级别均可配置，日志目录不存在时自动创建。
+
+import logging
+import os
+
+LOG_DIR = './log'
+
+
+def setup_logger(log_file=None, console=False, level=logging.DEBUG, mode='w'):
+    logger = logging.getLogger('mylogger')
+    logger.setLevel(level)
+    # 重复调用时替换原有输出，避免同一条日志写多次
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    handlers = []
+    if log_file:
+        directory = os.path.dirname(log_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        handlers.append(logging.FileHandler(log_file, mode))
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setLevel(level)
+        handler.setFormatter(logging.Formatter())
+        logger.addHandler(handler)
+    return logger
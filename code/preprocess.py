@@ -0,0 +1,377 @@
+# 商户与交易数据预处理
+# 商户清洗、交易编码、日期特征与商户字段合并只计算一次得到公共中间表，
+# 方案1(transaction_d_pre)与方案2(transaction_g_pre)各自只是在中间表上的轻量收尾步骤。
+# 04_Date_Analysis.py与流式（分块）预处理等模式共用这里的各个步骤。
+# 各步骤以profiling.stage包裹，每步结束时在日志中输出一行包含耗时、行数与内存的json。
+
+import gc
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from card_features import card_features
+from card_layout import CARD_LAYOUT_NAME, build_card_layout, write_card_layout
+from columnar import read_table, write_table
+from date_features import add_date_features, parse_purchase_date
+from downcast import optimize_memory
+from encoder import CODEBOOK_PATH, CategoryEncoder
+from join import dense_keys, merge_merchant
+from loader import CACHE_DIR, PRIMEVAL_DIR, TABLE_FILES, file_fingerprint, load_table, load_transactions
+from profiling import stage
+from window_features import card_window_features
+
+logger = logging.getLogger('mylogger')
+
+PREPROCESS_DIR = '../data/primeval/preprocess'
+
+# 商户表字段划分
+MERCHANT_CATEGORY_COLS = ['merchant_id', 'merchant_group_id', 'merchant_category_id',
+                          'subsector_id', 'category_1',
+                          'most_recent_sales_range', 'most_recent_purchases_range',
+                          'category_4', 'city_id', 'state_id', 'category_2']
+MERCHANT_NUMERIC_COLS = ['numerical_1', 'numerical_2',
+                         'avg_sales_lag3', 'avg_purchases_lag3', 'active_months_lag3',
+                         'avg_sales_lag6', 'avg_purchases_lag6', 'active_months_lag6',
+                         'avg_sales_lag12', 'avg_purchases_lag12', 'active_months_lag12']
+MERCHANT_OBJECT_COLS = ['category_1', 'most_recent_sales_range', 'most_recent_purchases_range', 'category_4']
+MERCHANT_INF_COLS = ['avg_purchases_lag3', 'avg_purchases_lag6', 'avg_purchases_lag12']
+# 与transaction交易记录表格重复的列
+MERCHANT_DUPLICATE_COLS = ['merchant_id', 'merchant_category_id', 'subsector_id', 'category_1', 'city_id',
+                           'state_id', 'category_2']
+# merge到交易表中的商户字段
+MERCHANT_MERGE_COLS = ['merchant_id', 'most_recent_sales_range', 'most_recent_purchases_range', 'category_4']
+# 商户清洗参数与码表保存在同一目录；清洗后的商户表缓存在cache_dir下
+MERCHANT_STATS_FILE = 'merchant_stats.json'
+MERCHANT_CACHE_NAME = 'merchant_clean'
+
+# 交易表字段划分
+TRANSACTION_CATEGORY_COLS = ['authorized_flag', 'card_id', 'city_id', 'category_1',
+                             'category_3', 'merchant_category_id', 'merchant_id', 'category_2', 'state_id',
+                             'subsector_id']
+TRANSACTION_OBJECT_COLS = ['authorized_flag', 'category_1', 'category_3']
+# 读取时固定字符型字段的类型，避免分块时整块缺失被推断为float；purchase_amount与loader一致使用float32
+TRANSACTION_DTYPES = {'authorized_flag': str, 'card_id': str, 'category_1': str, 'category_3': str,
+                      'merchant_id': str, 'purchase_date': str, 'category_2': 'float64', 'purchase_amount': 'float32'}
+
+# 方案1中合并后的离散字段
+TRANSACTION_D_CATEGORY_COLS = ['authorized_flag', 'city_id', 'category_1',
+                               'category_3', 'merchant_category_id', 'month_lag', 'most_recent_sales_range',
+                               'most_recent_purchases_range', 'category_4',
+                               'purchase_month', 'purchase_hour_section', 'purchase_day']
+# 方案2中以card_id为粒度的差分列
+CARD_DIFF_COLS = ['purchase_day_diff', 'purchase_month_diff']
+# 中间表保留解析后的购买时间，供按卡按时间排序的布局使用，方案1/方案2的输出中不包含
+PURCHASE_DATE_COL = 'purchase_date'
+
+
+# 缺失值填充，兼容loader加载的category类型（先将填充值加入类别）
+def fillna_series(se, value=-1):
+    if not se.hasnans:
+        return se
+    if isinstance(se.dtype, pd.CategoricalDtype) and value not in se.cat.categories:
+        se = se.cat.add_categories([value])
+    return se.fillna(value)
+
+
+def fillna_cols(df, cols, value=-1):
+    for col in cols:
+        df[col] = fillna_series(df[col], value)
+    return df
+
+
+# 商户数值字段的清洗参数：替换无穷值所用的最大有限值与各列的均值
+# fit将数值字段取为一个float32块，一次向量化算出全部统计量（以float64累加），无穷值先替换再参与均值计算，与原先的步骤顺序一致；
+# 参数以json持久化，商户表更新后可以直接用已拟合的参数transform新的快照，不需要重新读取全量数据拟合。
+class MerchantCleaner(object):
+
+    def __init__(self, inf_max=None, means=None, fingerprint=None):
+        self.inf_max = inf_max
+        # 字段 -> 均值
+        self.means = means
+        # 拟合所用商户文件的指纹
+        self.fingerprint = fingerprint
+
+    def fit(self, merchant, fingerprint=None):
+        block = merchant[MERCHANT_NUMERIC_COLS].to_numpy(dtype=np.float32)
+        inf_cols = np.isin(MERCHANT_NUMERIC_COLS, MERCHANT_INF_COLS)
+        inf = np.isposinf(block) & inf_cols
+        # 与replace(np.inf, -99).max().max()一致：无穷值记为-99，缺失值不参与
+        self.inf_max = float(np.nanmax(np.where(inf, -99, block)[:, inf_cols]))
+        block[inf] = self.inf_max
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = np.nansum(block, axis=0, dtype=np.float64) / np.count_nonzero(~np.isnan(block), axis=0)
+        self.means = dict(zip(MERCHANT_NUMERIC_COLS, means.tolist()))
+        self.fingerprint = fingerprint
+        return self
+
+    def fill(self, merchant):
+        # 无穷值用最大值进行替换，缺失值用平均值进行填充。
+        values = merchant[MERCHANT_INF_COLS].to_numpy()
+        merchant[MERCHANT_INF_COLS] = np.where(np.isposinf(values), self.inf_max, values)
+        return merchant.fillna({col: self.means[col] for col in MERCHANT_NUMERIC_COLS})
+
+    def transform(self, merchant, encoder):
+        # 对非数值型的离散字段进行字典排序编码。
+        for col in MERCHANT_OBJECT_COLS:
+            merchant[col] = encoder.encode('merchants.' + col, merchant[col])
+
+        # 离散字段统一用-1进行填充。
+        merchant = fillna_cols(merchant, MERCHANT_CATEGORY_COLS)
+        merchant = self.fill(merchant)
+
+        # 去除与transaction交易记录表格重复的列，以及merchant_id的重复记录。
+        merchant = merchant.drop(MERCHANT_DUPLICATE_COLS[1:], axis=1)
+        merchant = merchant.drop_duplicates('merchant_id').reset_index(drop=True)
+        return merchant
+
+    def params(self):
+        return {'inf_max': self.inf_max, 'means': self.means, 'fingerprint': self.fingerprint}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.params(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        # 文件不存在时返回None
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return cls(**json.load(f))
+
+
+# 商户信息预处理，返回去重后的商户表；未给出清洗参数时在该商户表上拟合
+def clean_merchant(merchant, encoder, cleaner=None):
+    if cleaner is None:
+        cleaner = MerchantCleaner().fit(merchant)
+    return cleaner.transform(merchant, encoder)
+
+
+def merchant_stats_path(codebook_path=CODEBOOK_PATH):
+    return os.path.join(os.path.dirname(codebook_path), MERCHANT_STATS_FILE)
+
+
+# 清洗后的商户表，以列式格式缓存在cache_dir/merchant_clean下：
+# 商户文件指纹、清洗参数与商户字段的码表都与缓存一致时直接读取，不再加载与清洗。
+def merchant_cache_path(cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, MERCHANT_CACHE_NAME)
+
+
+# 返回(stat, fingerprint, fresh)：当前商户文件的大小与修改时间、sha1，以及已有缓存是否可以直接使用；
+# cleaner为None时只要求缓存基于同一份商户文件，否则还要求清洗参数与cleaner一致
+def merchant_cache_state(encoder, primeval_dir=PRIMEVAL_DIR, cache_dir=CACHE_DIR, cleaner=None):
+    path = merchant_cache_path(cache_dir)
+    meta = {}
+    if os.path.exists(path + '.json') and os.path.isdir(path):
+        with open(path + '.json') as f:
+            meta = json.load(f)
+    # 文件大小与修改时间都未变时沿用上次的sha1
+    source = os.path.join(primeval_dir, TABLE_FILES['merchants'])
+    stat = [os.stat(source).st_size, os.stat(source).st_mtime_ns]
+    fingerprint = meta['fingerprint'] if meta.get('stat') == stat else file_fingerprint(source)
+    expected = {'fingerprint': fingerprint} if cleaner is None else cleaner.params()
+    codebooks = {col: encoder.codebook.get('merchants.' + col) for col in MERCHANT_OBJECT_COLS}
+    fresh = (meta.get('fingerprint') == fingerprint and meta.get('codebooks') == codebooks
+             and all(meta['stats'].get(key) == value for key, value in expected.items()))
+    return stat, fingerprint, fresh
+
+
+# refit为False且stats_path已有拟合好的参数时沿用这些参数，否则在当前商户表上重新拟合并保存。
+def load_clean_merchant(encoder, primeval_dir=PRIMEVAL_DIR, cache_dir=CACHE_DIR, stats_path=None, refit=True):
+    stats_path = stats_path or merchant_stats_path()
+    path = merchant_cache_path(cache_dir)
+    cleaner = None if refit else MerchantCleaner.load(stats_path)
+    stat, fingerprint, fresh = merchant_cache_state(encoder, primeval_dir, cache_dir, cleaner)
+    if fresh:
+        logger.info('merchant: reuse cached cleaning')
+        with stage('clean_merchant', cached=True) as s:
+            return s.output(read_table(path))
+
+    merchant = load_stage('merchants', primeval_dir, cache_dir)
+    with stage('clean_merchant', merchant, cached=False) as s:
+        if cleaner is None:
+            cleaner = MerchantCleaner().fit(merchant, fingerprint)
+            cleaner.save(stats_path)
+        merchant = s.output(cleaner.transform(merchant, encoder))
+    write_table(merchant, path)
+    meta = {'stat': stat, 'fingerprint': fingerprint, 'stats': cleaner.params(),
+            'codebooks': {col: encoder.codebook.get('merchants.' + col) for col in MERCHANT_OBJECT_COLS}}
+    with open(path + '.json', 'w') as f:
+        json.dump(meta, f)
+    return merchant
+
+
+# 只读取04写出的商户缓存，不清洗、不更新码表、不写任何文件，供在线服务等只读的使用方；
+# 缓存不存在或与当前商户文件、已保存的清洗参数、码表不一致时报错，需要先运行04重新生成
+def read_clean_merchant(encoder, primeval_dir=PRIMEVAL_DIR, cache_dir=CACHE_DIR, stats_path=None):
+    path = merchant_cache_path(cache_dir)
+    if not os.path.isdir(path):
+        raise FileNotFoundError('cleaned merchant cache %s not found, run 04_Date_Analysis.py first' % path)
+    cleaner = MerchantCleaner.load(stats_path or merchant_stats_path())
+    if not merchant_cache_state(encoder, primeval_dir, cache_dir, cleaner)[2]:
+        raise ValueError('cleaned merchant cache %s is stale (merchants.csv, merchant stats or codebook changed), '
+                         'run 04_Date_Analysis.py first' % path)
+    return read_table(path)
+
+
+# 对首次活跃月份进行编码
+# 训练集与测试集共用同一份码表，保证同一月份在两者中的编码相同；缺失值与原先astype(str)一致记为'nan'
+def encode_cards(train, test, encoder):
+    encoder.update('first_active_month', train['first_active_month'], test['first_active_month'], fill='nan')
+    train['first_active_month'] = encoder.transform('first_active_month', train['first_active_month'], fill='nan')
+    test['first_active_month'] = encoder.transform('first_active_month', test['first_active_month'], fill='nan')
+    return train, test
+
+
+# 交易数据编码
+def encode_transaction(transaction, encoder):
+    # 对字符型的离散特征进行字典序编码以及缺失值填充。
+    with stage('encode', transaction) as s:
+        for col in TRANSACTION_OBJECT_COLS:
+            transaction[col] = encoder.encode('transactions.' + col, transaction[col])
+        transaction = fillna_cols(transaction, TRANSACTION_CATEGORY_COLS)
+        transaction['category_2'] = transaction['category_2'].astype(int)
+        s.output(transaction)
+
+    # 进行时间段的处理，简单起见进行月份、日期的星期数（工作日与周末）、以及
+    # 时间段（上午、下午、晚上、凌晨）的信息提取。
+    with stage('date_features', transaction) as s:
+        if not pd.api.types.is_datetime64_dtype(transaction[PURCHASE_DATE_COL]):
+            transaction[PURCHASE_DATE_COL] = parse_purchase_date(transaction[PURCHASE_DATE_COL])
+        transaction = add_date_features(transaction, PURCHASE_DATE_COL, drop=False)
+
+        # 对新生成的购买月份离散字段进行字典序编码。
+        transaction['purchase_month'] = encoder.encode('transactions.purchase_month', transaction['purchase_month'])
+        s.output(transaction)
+    return transaction
+
+
+# 以card_id进行groupby并提取出purchase_day/month进行差分，只依赖同一张卡内的行顺序
+def add_card_diffs(transaction):
+    with stage('diff', transaction) as s:
+        card_keys = dense_keys(transaction['card_id'])
+        transaction['purchase_day_diff'] = transaction.groupby(card_keys)['purchase_day'].diff()
+        transaction['purchase_month_diff'] = transaction.groupby(card_keys)['purchase_month'].diff()
+        return s.output(transaction)
+
+
+# 公共中间表：编码后的交易数据合并商户字段，未匹配的商户字段保留为缺失值；
+# diffs为True时一并计算以card_id为粒度的差分列（按块处理、卡被拆分到多个块时不应计算）
+def build_transaction(transaction, merchant, encoder, diffs=True):
+    transaction = downcast_stage(encode_transaction(transaction, encoder))
+    with stage('merge', transaction) as s:
+        transaction = s.output(merge_merchant(transaction, merchant, MERCHANT_MERGE_COLS[1:]))
+    if diffs:
+        transaction = add_card_diffs(transaction)
+    return downcast_stage(transaction)
+
+
+# 编码、日期特征、商户字段与差分得到的新列为int64/float64，按取值范围压缩后再进入下一步，降低中间表的峰值内存
+def downcast_stage(transaction):
+    with stage('downcast', transaction) as s:
+        return s.output(optimize_memory(transaction, 'transaction'))
+
+
+# 方案1：对缺失值进行-1填补。
+# 原先还会将离散字段化为字符串类型，但整数与其字符串写入csv的内容完全相同，这里不再额外复制一份字符串表。
+# 只替换浅拷贝中的少数列，不修改公共中间表。
+def transaction_d(transaction):
+    cols = MERCHANT_MERGE_COLS[1:]
+    transaction = transaction.copy(deep=False)
+    for col in CARD_DIFF_COLS + [PURCHASE_DATE_COL]:
+        if col in transaction.columns:
+            del transaction[col]
+    # 逐列赋值：对多列同时赋值会合并浅拷贝中的数据块，复制整张中间表
+    for col in cols:
+        transaction[col] = transaction[col].fillna(-1).astype(int)
+    return fillna_cols(transaction, TRANSACTION_D_CATEGORY_COLS)
+
+
+# 方案2：新增purchase_day_diff和purchase_month_diff两列，中间表中已有时直接输出。
+# 差分按行顺序计算，按时间顺序的差分见按卡布局transaction_card_pre。
+def transaction_g(transaction):
+    transaction = transaction.copy(deep=False)
+    if PURCHASE_DATE_COL in transaction.columns:
+        del transaction[PURCHASE_DATE_COL]
+    if all(col in transaction.columns for col in CARD_DIFF_COLS):
+        return transaction
+    return add_card_diffs(transaction)
+
+
+TRANSACTION_OUTPUTS = {
+    'd': ('transaction_d_pre', transaction_d),
+    'g': ('transaction_g_pre', transaction_g),
+    # 以card_id为粒度的聚合特征宽表，可与train_pre/test_pre按card_id关联
+    'card': ('card_features', card_features),
+    # 按(card_id, purchase_date)排序的交易表与每张卡的行区间，支持按卡内存映射查询，见card_layout.py
+    'layout': (CARD_LAYOUT_NAME, build_card_layout),
+    # 以最晚购买时间为截止的时间窗口特征（最近1/3/6个自然月、7/30天的消费、距上次购买天数等），见window_features.py
+    'window': ('card_window_features', card_window_features),
+}
+
+# csv: 文本输出<name>.csv；npy: 列式二进制目录<name>/，见columnar.py
+OUTPUT_FORMATS = ['csv', 'npy']
+
+
+# 输出中取值为码表编码的字段 -> 码表名
+def output_codebooks(encoder):
+    keys = {col: 'transactions.' + col for col in TRANSACTION_OBJECT_COLS + ['purchase_month']}
+    keys.update({col: 'merchants.' + col for col in MERCHANT_MERGE_COLS[1:]})
+    keys['first_active_month'] = 'first_active_month'
+    return {col: encoder.codebook[key] for col, key in keys.items() if key in encoder.codebook}
+
+
+def write_output(df, preprocess_dir, name, fmt='csv', codebooks=None):
+    with stage('write', df, output=name, format=fmt):
+        if name == CARD_LAYOUT_NAME:
+            # 按卡布局用于内存映射查询，总是以列式格式输出
+            write_card_layout(df, os.path.join(preprocess_dir, name), codebooks)
+        elif fmt == 'npy':
+            write_table(df, os.path.join(preprocess_dir, name), codebooks)
+        else:
+            df.to_csv(os.path.join(preprocess_dir, name + '.csv'), index=False)
+    logger.info('%s written (%s)' % (name, fmt))
+
+
+# 由公共中间表得到各输出（方案1/方案2的收尾步骤或卡粒度聚合特征）
+def derive_output(transaction, name):
+    filename, step = TRANSACTION_OUTPUTS[name]
+    with stage('derive', transaction, output=filename) as s:
+        return s.output(step(transaction))
+
+
+def load_stage(name, primeval_dir=PRIMEVAL_DIR, cache_dir=CACHE_DIR):
+    with stage('load', table=name) as s:
+        return s.output(load_table(name, primeval_dir=primeval_dir, cache_dir=cache_dir))
+
+
+def run(outputs=('d', 'g'), primeval_dir=PRIMEVAL_DIR, cache_dir=CACHE_DIR, preprocess_dir=PREPROCESS_DIR,
+        codebook_path=CODEBOOK_PATH, fmt='csv', refit_merchant=True):
+    encoder = CategoryEncoder.load(codebook_path)
+
+    train, test = load_stage('train', primeval_dir, cache_dir), load_stage('test', primeval_dir, cache_dir)
+    with stage('encode_cards', [train, test]) as s:
+        train, test = s.output(encode_cards(train, test, encoder))
+    write_output(train, preprocess_dir, 'train_pre', fmt, output_codebooks(encoder))
+    write_output(test, preprocess_dir, 'test_pre', fmt, output_codebooks(encoder))
+    del train
+    del test
+    gc.collect()
+
+    merchant = load_clean_merchant(encoder, primeval_dir, cache_dir, merchant_stats_path(codebook_path), refit_merchant)
+    # 先new后history进行拼接
+    with stage('load', table='transactions') as s:
+        transaction = s.output(load_transactions(primeval_dir=primeval_dir, cache_dir=cache_dir))
+    transaction = build_transaction(transaction, merchant, encoder)
+    del merchant
+    gc.collect()
+    encoder.save(codebook_path)
+
+    codebooks = output_codebooks(encoder)
+    for name in outputs:
+        write_output(derive_output(transaction, name), preprocess_dir, TRANSACTION_OUTPUTS[name][0], fmt, codebooks)
+        gc.collect()
+    return transaction
@@ -0,0 +1,154 @@
+# 分阶段性能剖析
+# 04运行缓慢或内存溢出时，日志中只有各输出写入完成的记录，无法判断是哪一步在数据更新后退化。
+# 这里用上下文管理器包裹加载、商户清洗、拼接、编码、日期特征、商户字段合并、差分与写入等各个阶段，
+# 每个阶段结束时通过mylogger输出一行json，记录墙钟时间、CPU时间、输入/输出行数、当前RSS与峰值RSS的增量；
+# 可选记录输入/输出DataFrame的memory_usage(deep=True)（object列需要逐个字符串计算，默认关闭），
+# 以及对每个阶段用cProfile采集调用剖析，.prof文件按阶段序号与名称保存，日志中附带累计耗时最多的函数。
+# 用法: with stage('merge', transaction) as s: transaction = s.output(merge_merchant(transaction, ...))
+# 日志中以{开头的行即为阶段记录，可直接用jq等工具解析。
+
+import cProfile
+import json
+import logging
+import os
+import pstats
+import resource
+import time
+
+import pandas as pd
+
+logger = logging.getLogger('mylogger')
+
+_CONFIG = {'enabled': True, 'memory': False, 'profile_dir': None, 'top': 10}
+# 当前正在采集的cProfile（cProfile不能嵌套，内层阶段不再单独采集）以及阶段序号
+_STATE = {'profiling': False, 'count': 0}
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def setup_profiler(enabled=True, memory=False, profile_dir=None, top=10):
+    _CONFIG.update(enabled=enabled, memory=memory, profile_dir=profile_dir, top=top)
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+
+
+def rss_mb():
+    # 当前常驻内存，仅Linux可用
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / 2 ** 20
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def peak_rss_mb():
+    # Linux下ru_maxrss单位为KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# 阶段的输入可以是多个DataFrame（如拼接），行数与内存按总和计
+def frame_rows(df):
+    if isinstance(df, (list, tuple)):
+        return sum(len(frame) for frame in df)
+    return None if df is None else len(df)
+
+
+def frame_memory_mb(df):
+    if df is None or not _CONFIG['memory']:
+        return None
+    if isinstance(df, (list, tuple)):
+        return sum(frame_memory_mb(frame) for frame in df)
+    if isinstance(df, pd.Series):
+        return df.memory_usage(index=True, deep=True) / 2 ** 20
+    return df.memory_usage(index=True, deep=True).sum() / 2 ** 20
+
+
+def _round(value, digits=3):
+    return None if value is None else round(value, digits)
+
+
+class Stage(object):
+
+    def __init__(self, name, frame=None, **fields):
+        self.name = name
+        self.fields = fields
+        self.rows_in = frame_rows(frame)
+        self.memory_in = frame_memory_mb(frame) if _CONFIG['enabled'] else None
+        self.frame_out = None
+        self.profiler = None
+
+    def output(self, frame):
+        # 记录阶段的输出并原样返回；行数与内存在计时结束后再统计，不计入阶段耗时
+        if _CONFIG['enabled']:
+            self.frame_out = frame
+        return frame
+
+    def __enter__(self):
+        if not _CONFIG['enabled']:
+            return self
+        _STATE['count'] += 1
+        self.index = _STATE['count']
+        self.peak = peak_rss_mb()
+        if _CONFIG['profile_dir'] and not _STATE['profiling']:
+            _STATE['profiling'] = True
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start, self.cpu = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if not _CONFIG['enabled']:
+            return False
+        wall, cpu = time.perf_counter() - self.start, time.process_time() - self.cpu
+        if self.profiler is not None:
+            self.profiler.disable()
+            _STATE['profiling'] = False
+        record = {'stage': self.name, 'status': 'ok' if exc_type is None else 'error', 'pid': os.getpid(),
+                  'wall_s': _round(wall), 'cpu_s': _round(cpu),
+                  'rows_in': self.rows_in, 'rows_out': frame_rows(self.frame_out),
+                  'memory_in_mb': _round(self.memory_in, 1),
+                  'memory_out_mb': _round(frame_memory_mb(self.frame_out), 1),
+                  'rss_mb': _round(rss_mb(), 1), 'peak_rss_delta_mb': _round(peak_rss_mb() - self.peak, 1)}
+        record.update(self.fields)
+        self.frame_out = None
+        if self.profiler is not None:
+            record.update(self._dump_profile())
+        logger.info(json.dumps(record))
+        return False
+
+    def _dump_profile(self):
+        # 多进程并行时各子进程的阶段序号相同，文件名中加上进程号
+        path = os.path.join(_CONFIG['profile_dir'], '%d_%03d_%s.prof' % (os.getpid(), self.index, self.name))
+        self.profiler.dump_stats(path)
+        stats = pstats.Stats(self.profiler)
+        # 按累计耗时排序的前若干个函数：文件:行号(函数名) -> 累计秒数
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:_CONFIG['top']]
+        top = [['%s:%d(%s)' % (os.path.basename(filename), line, func), round(cumulative, 3)]
+               for (filename, line, func), (_, _, _, cumulative, _) in functions]
+        return {'profile': path, 'profile_top': top}
+
+
+def stage(name, frame=None, **fields):
+    # frame为阶段的输入；fields为附加到记录中的其他字段（如输出格式、分块序号）
+    return Stage(name, frame, **fields)
+
+
+def read_records(log_file):
+    # 从日志文件中读取阶段记录
+    records = []
+    with open(log_file) as f:
+        for line in f:
+            if line.startswith('{'):
+                records.append(json.loads(line))
+    return records
+
+
+def summarize(records):
+    # 按阶段名汇总（同名阶段如多个输出的写入、各分块的编码累加）：阶段名 -> 次数、总耗时、总CPU时间、最大峰值增量
+    summary = {}
+    for record in records:
+        item = summary.setdefault(record['stage'], {'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_delta_mb': 0.0})
+        item['count'] += 1
+        item['wall_s'] = round(item['wall_s'] + record['wall_s'], 3)
+        item['cpu_s'] = round(item['cpu_s'] + record['cpu_s'], 3)
+        item['peak_rss_delta_mb'] = max(item['peak_rss_delta_mb'], record['peak_rss_delta_mb'])
+    return summary
@@ -0,0 +1,327 @@
+# 流式（近似）统计的数据探索
+# eda.py中的analyze_*需要整张表读入内存再计算describe/value_counts/nunique/isnull().sum()，
+# historical_transactions只为了输出统计结果也要全量加载。这里对各csv按块读取一遍，每块更新sketches.py中可合并的统计结构后即丢弃，
+# 内存占用只取决于块大小与草图大小：
+# - 行数、缺失值与无穷值个数以及数值字段的count/mean/std/min/max精确计算，25%/50%/75%分位数由KLL近似；
+# - 离散字段与FEATURES的两两组合精确计数（不同取值过多时退化为count-min），PSI由计数得到；
+# - card_id/merchant_id的nunique与交易表中商户重复字段的去重行数由HyperLogLog估计，id是否唯一、训练集与测试集是否
+#   不相交按估计值是否在3倍标准误差内一致来判断。
+# workers大于1时将每个文件按行边界切分为字节区间，由多个进程分别统计，再按区间顺序合并。
+# 汇总结果的字段与eda.run相同，基于HyperLogLog的字段为近似值；流式模式不绘图。
+# 用法: python eda.py transactions --streaming --workers 4 --log-file ./log/03_date_analysis.log
+
+import itertools
+import logging
+import multiprocessing
+import os
+
+import numpy as np
+import pandas as pd
+
+from drift import FEATURES, drift_scores
+from eda import DICTIONARY_PATH, STEPS, match_dictionary
+from loader import PRIMEVAL_DIR, TABLE_DTYPES, TABLE_FILES
+from preprocess import MERCHANT_CATEGORY_COLS, MERCHANT_INF_COLS, MERCHANT_NUMERIC_COLS, TRANSACTION_CATEGORY_COLS
+from profiling import stage
+from sketches import FrequencyCounter, HyperLogLog, KLLSketch, Moments, hash_values
+
+logger = logging.getLogger('mylogger')
+
+# 块大小决定峰值内存（约每10万行百MB，主要是字符串列），对耗时影响不大
+CHUNKSIZE = 200000
+TARGET_OUTLIER = -30
+TRANSACTION_NUMERIC_COLS = ['installments', 'month_lag', 'purchase_amount']
+TRANSACTION_TIME_COLS = ['purchase_date']
+ID_COLS = ['card_id', 'merchant_id']
+QUANTILES = [0.25, 0.5, 0.75]
+
+# 各表的统计方式：numeric数值字段，category精确计数的离散字段，joint组合计数的字段组，
+# distinct以HyperLogLog估计基数的字段（元组为多列组合的去重行数），below阈值以下的行数，dates只取最小/最大值的日期字段
+CARD_SPEC = {'category': FEATURES, 'joint': list(itertools.combinations(FEATURES, 2)), 'distinct': ['card_id']}
+TRANSACTION_SPEC = {'numeric': TRANSACTION_NUMERIC_COLS, 'distinct': ID_COLS, 'dates': TRANSACTION_TIME_COLS,
+                    'category': [col for col in TRANSACTION_CATEGORY_COLS if col not in ID_COLS]}
+TABLE_SPECS = {
+    'train': dict(CARD_SPEC, numeric=['target'], below={'target': TARGET_OUTLIER}),
+    'test': CARD_SPEC,
+    'merchants': {'numeric': MERCHANT_NUMERIC_COLS, 'distinct': ['merchant_id'],
+                  'category': [col for col in MERCHANT_CATEGORY_COLS if col != 'merchant_id']},
+    'new_merchant_transactions': TRANSACTION_SPEC,
+    'historical_transactions': TRANSACTION_SPEC,
+}
+STEP_TABLES = {'cards': ['train', 'test'], 'merchants': ['merchants'],
+               'transactions': ['historical_transactions', 'new_merchant_transactions']}
+
+
+class TableProfile(object):
+
+    def __init__(self, columns, spec):
+        self.columns = list(columns)
+        self.spec = spec
+        self.rows = 0
+        self.dtypes = None
+        self.nulls = pd.Series(0, index=self.columns, dtype=np.int64)
+        self.moments = {col: Moments() for col in spec.get('numeric', [])}
+        self.quantiles = {col: KLLSketch() for col in spec.get('numeric', [])}
+        self.counters = {key: FrequencyCounter() for key in spec.get('category', []) + spec.get('joint', [])}
+        self.distinct = {key: HyperLogLog() for key in spec.get('distinct', [])}
+        self.below = {col: 0 for col in spec.get('below', {})}
+        self.dates = {col: [None, None] for col in spec.get('dates', [])}
+
+    def update(self, chunk):
+        self.rows += len(chunk)
+        if self.dtypes is None:
+            self.dtypes = chunk.dtypes
+        self.nulls += chunk.isnull().sum().values
+        for col in self.moments:
+            values = chunk[col].to_numpy(dtype=np.float64, na_value=np.nan)
+            self.moments[col].update(values)
+            self.quantiles[col].update(values)
+            if col in self.below:
+                self.below[col] += int((values < self.spec['below'][col]).sum())
+        for key, counter in self.counters.items():
+            counter.update(chunk[list(key)] if isinstance(key, tuple) else chunk[key])
+        for key, sketch in self.distinct.items():
+            if isinstance(key, tuple):
+                sketch.update_hashes(hash_values(chunk[list(key)]))
+            else:
+                sketch.update(chunk[key])
+        for col, bounds in self.dates.items():
+            values = chunk[col].dropna()
+            if len(values):
+                bounds[0] = min(values.min(), bounds[0] or values.min())
+                bounds[1] = max(values.max(), bounds[1] or values.max())
+        return self
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.dtypes = self.dtypes if self.dtypes is not None else other.dtypes
+        self.nulls += other.nulls
+        for name in ['moments', 'quantiles', 'counters', 'distinct']:
+            for key, sketch in getattr(self, name).items():
+                sketch.merge(getattr(other, name)[key])
+        for col in self.below:
+            self.below[col] += other.below[col]
+        for col, bounds in self.dates.items():
+            values = [v for v in bounds + other.dates[col] if v is not None]
+            self.dates[col] = [min(values), max(values)] if values else [None, None]
+        return self
+
+    @property
+    def shape(self):
+        return [self.rows, len(self.columns)]
+
+    def describe(self):
+        # 与DataFrame.describe()相同的行，分位数为近似值
+        rows = {}
+        for col, moments in self.moments.items():
+            rows[col] = [moments.count, moments.average, moments.std, moments.min] + \
+                list(self.quantiles[col].quantiles(QUANTILES)) + [moments.max]
+        return pd.DataFrame(rows, index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'])
+
+    def nunique(self):
+        return pd.Series({key if isinstance(key, str) else '&'.join(key): sketch.estimate()
+                          for key, sketch in self.distinct.items()})
+
+    def value_counts(self, key):
+        return self.counters[key].value_counts()
+
+    def infs(self, cols):
+        return sum(self.moments[col].infs for col in cols)
+
+
+class RangeFile(object):
+    # 只读文件中[start, end)字节区间的文件对象，供pd.read_csv分块读取
+
+    def __init__(self, path, start, end):
+        self.file = open(path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        raise StopIteration
+
+    def close(self):
+        self.file.close()
+
+
+def header(path):
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def byte_ranges(path, parts):
+    # 表头之后的内容按行边界切分为至多parts个非空区间
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        bounds = [len(f.readline())]
+        for i in range(1, parts):
+            f.seek(max(bounds[0] + (size - bounds[0]) * i // parts, bounds[-1]))
+            f.readline()
+            bounds.append(min(f.tell(), size))
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if start < end]
+
+
+def read_range(path, start, end, chunksize=CHUNKSIZE, dtype=None):
+    f = RangeFile(path, start, end)
+    try:
+        for chunk in pd.read_csv(f, header=None, names=header(path), dtype=dtype, chunksize=chunksize):
+            yield chunk
+    finally:
+        f.close()
+
+
+def read_dtypes(name):
+    # 与loader的声明类型一致，但category字段按字符串读取：逐块推断类别并合并的开销远大于统计本身
+    return {col: str if dtype == 'category' else dtype for col, dtype in TABLE_DTYPES[name].items()}
+
+
+def profile_range(task):
+    name, path, start, end, spec, chunksize = task
+    profile = TableProfile(header(path), spec)
+    with stage('profile', table=name, start=start, end=end):
+        for chunk in read_range(path, start, end, chunksize, read_dtypes(name)):
+            profile.update(chunk)
+    return name, profile
+
+
+def profile_tables(names, primeval_dir=PRIMEVAL_DIR, chunksize=CHUNKSIZE, workers=1, specs=None):
+    # 表名 -> TableProfile；各区间的结果按区间顺序合并，与进程完成的先后无关
+    specs = specs or TABLE_SPECS
+    tasks = []
+    for name in names:
+        path = os.path.join(primeval_dir, TABLE_FILES[name])
+        tasks += [(name, path, start, end, specs[name], chunksize) for start, end in byte_ranges(path, workers)]
+    profiles = {}
+    if workers > 1:
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            results = list(pool.imap(profile_range, tasks))
+    else:
+        results = map(profile_range, tasks)
+    for name, profile in results:
+        profiles[name] = profiles[name].merge(profile) if name in profiles else profile
+    return profiles
+
+
+def _consistent(estimate, expected, sketch):
+    # HyperLogLog估计值与期望值的差在3倍标准误差以内
+    return abs(estimate - expected) <= 3 * sketch.error * max(expected, 1)
+
+
+def log_profile(name, profile):
+    logger.info('%s: %s' % (name, profile.shape))
+    logger.info(profile.dtypes)
+    logger.info(profile.nulls)
+    if profile.moments:
+        logger.info(profile.describe())
+    for key in profile.counters:
+        if isinstance(key, str):
+            logger.info(profile.value_counts(key).head(20).rename(key))
+    if profile.distinct:
+        logger.info(profile.nunique())
+    for col, bounds in profile.dates.items():
+        logger.info('%s: %s ~ %s' % (col, bounds[0], bounds[1]))
+
+
+def max_psi(train, test):
+    # 与drift_report(order=2)相同的单特征及两两组合，占比由精确计数得到
+    scores = []
+    for key in FEATURES + CARD_SPEC['joint']:
+        train_counts, test_counts = train.counters[key].counts, test.counters[key].counts
+        keys = list(dict.fromkeys(list(train_counts) + list(test_counts)))
+        p = np.array([train_counts.get(k, 0) for k in keys], dtype=np.float64)
+        q = np.array([test_counts.get(k, 0) for k in keys], dtype=np.float64)
+        scores.append(drift_scores(p / max(p.sum(), 1), q / max(q.sum(), 1))['psi'])
+    return max(scores)
+
+
+def analyze_cards(train, test):
+    log_profile('train', train)
+    log_profile('test', test)
+    train_sketch, test_sketch = train.distinct['card_id'], test.distinct['card_id']
+    train_unique = _consistent(train_sketch.estimate(), train.rows, train_sketch)
+    test_unique = _consistent(test_sketch.estimate(), test.rows, test_sketch)
+    union = HyperLogLog(train_sketch.p).merge(train_sketch).merge(test_sketch)
+    disjoint = _consistent(union.estimate(), train_sketch.estimate() + test_sketch.estimate(), union)
+    logger.info((train_unique, test_unique, disjoint))
+
+    target = train.moments['target']
+    lower, upper = target.average - 3 * target.std, target.average + 3 * target.std
+    logger.info((train.below['target'], lower, upper))
+    psi = max_psi(train, test)
+    logger.info(psi)
+    return {
+        'train_shape': train.shape,
+        'test_shape': test.shape,
+        'train_card_id_unique': bool(train_unique),
+        'test_card_id_unique': bool(test_unique),
+        'card_id_disjoint': bool(disjoint),
+        'train_null': {k: int(v) for k, v in train.nulls.items()},
+        'test_null': {k: int(v) for k, v in test.nulls.items()},
+        'target_outliers': train.below['target'],
+        'target_3sigma': [float(lower), float(upper)],
+        'max_psi': float(psi),
+    }
+
+
+def analyze_merchants(merchant, dictionary_path=DICTIONARY_PATH):
+    log_profile('merchants', merchant)
+    dictionary_match = match_dictionary(merchant.columns, dictionary_path)
+    return {
+        'shape': merchant.shape,
+        'merchant_id_nunique': merchant.distinct['merchant_id'].estimate(),
+        'dictionary_match': dictionary_match,
+        'null': {k: int(v) for k, v in merchant.nulls.items()},
+        'inf_count': merchant.infs(MERCHANT_INF_COLS),
+    }
+
+
+def analyze_transactions(history, new, merchant_columns):
+    log_profile('historical_transactions', history)
+    log_profile('new_merchant_transactions', new)
+    duplicate_cols = [col for col in merchant_columns if col in new.columns]
+    partitioned = len(TRANSACTION_NUMERIC_COLS) + len(TRANSACTION_CATEGORY_COLS) + len(TRANSACTION_TIME_COLS) == \
+        len(new.columns)
+    return {
+        'history_shape': history.shape,
+        'new_shape': new.shape,
+        'duplicate_cols': duplicate_cols,
+        'duplicate_rows': new.distinct[tuple(duplicate_cols)].estimate(),
+        'merchant_id_nunique': new.distinct['merchant_id'].estimate(),
+        'columns_partitioned': bool(partitioned),
+        'null': {col: int(new.nulls[col]) for col in TRANSACTION_CATEGORY_COLS},
+    }
+
+
+def run(steps=STEPS, primeval_dir=PRIMEVAL_DIR, chunksize=CHUNKSIZE, workers=1):
+    # 与eda.run相同的汇总；全部需要的表在同一个进程池中一遍统计完成
+    names = [name for step in STEPS if step in steps for name in STEP_TABLES[step]]
+    specs = dict(TABLE_SPECS)
+    merchant_columns = header(os.path.join(primeval_dir, TABLE_FILES['merchants']))
+    if 'transactions' in steps:
+        # 交易表中与商户表重复的字段组合的去重行数只在new_merchant_transactions上统计
+        columns = header(os.path.join(primeval_dir, TABLE_FILES['new_merchant_transactions']))
+        duplicate_cols = tuple(col for col in merchant_columns if col in columns)
+        specs['new_merchant_transactions'] = dict(TRANSACTION_SPEC, distinct=ID_COLS + [duplicate_cols])
+    profiles = profile_tables(names, primeval_dir, chunksize, workers, specs)
+
+    summary = {}
+    with pd.option_context('display.max_columns', None, 'display.max_rows', None):
+        if 'cards' in steps:
+            summary['cards'] = analyze_cards(profiles['train'], profiles['test'])
+        if 'merchants' in steps:
+            summary['merchants'] = analyze_merchants(profiles['merchants'],
+                                                     os.path.join(primeval_dir, 'Data_Dictionary.xlsx'))
+        if 'transactions' in steps:
+            summary['transactions'] = analyze_transactions(profiles['historical_transactions'],
+                                                           profiles['new_merchant_transactions'], merchant_columns)
+    return summary
@@ -0,0 +1,156 @@
+# 交易数据流式（分块）预处理
+# 04中一次性读入historical_transactions.csv并与new_merchant_transactions.csv拼接，峰值内存为文件大小的数倍。
+# 这里按块读取交易数据，逐块完成字典编码、缺失值填充、日期特征以及商户字段merge，并增量写出，
+# 输出与04方案1的transaction_d_pre.csv完全一致。商户表与04一样经preprocess.load_clean_merchant清洗，共用清洗缓存与参数。
+# --memory-limit-mb为峰值常驻内存的上限：块大小由样本估算，每块处理后按实测的每行内存与剩余空间缩小后续的块，
+# 峰值仍超过上限时抛出MemoryError并停止处理，此时应指定更小的--chunksize或调高上限。
+# 用法: python stream_preprocess.py --memory-limit-mb 4096
+#      python stream_preprocess.py --chunksize 2000000
+
+import argparse
+import gc
+import logging
+
+import numpy as np
+import pandas as pd
+
+from date_features import date_features
+from encoder import CODEBOOK_PATH, CategoryEncoder
+from join import MerchantAttributes
+from loader import CACHE_DIR
+from log_config import setup_logger
+from preprocess import (MERCHANT_MERGE_COLS, TRANSACTION_DTYPES, TRANSACTION_OBJECT_COLS, build_transaction,
+                        load_clean_merchant, merchant_stats_path, transaction_d)
+from profiling import peak_rss_mb, rss_mb, stage
+
+logger = logging.getLogger('mylogger')
+
+# 拼接顺序与04一致：先new后history
+TRANSACTION_FILES = ['new_merchant_transactions.csv', 'historical_transactions.csv']
+
+# 单块在处理过程中（字符串转换、merge等）相对于读入大小的放大系数
+WORKING_SET_FACTOR = 6
+# 按实测的每行内存缩小块时，只使用剩余空间的该比例
+HEADROOM = 0.8
+
+
+def read_chunks(paths, chunksize, usecols=None):
+    # chunksize为整数或返回下一块行数的函数，处理过程中可以缩小后续的块
+    size = chunksize if callable(chunksize) else lambda: chunksize
+    dtype = TRANSACTION_DTYPES
+    if usecols is not None:
+        dtype = {col: t for col, t in dtype.items() if col in usecols}
+    for path in paths:
+        with pd.read_csv(path, chunksize=size(), usecols=usecols, dtype=dtype) as reader:
+            while True:
+                try:
+                    chunk = reader.get_chunk(size())
+                except StopIteration:
+                    break
+                yield chunk
+
+
+def estimate_chunksize(path, memory_limit_mb, sample_rows=10000):
+    # 根据样本估算每行内存占用，在扣除当前已用内存后换算为每块行数
+    sample = pd.read_csv(path, nrows=sample_rows, dtype=TRANSACTION_DTYPES)
+    row_bytes = sample.memory_usage(deep=True).sum() / max(len(sample), 1)
+    budget = (memory_limit_mb - peak_rss_mb()) * 2 ** 20
+    if budget <= 0:
+        raise ValueError('memory limit %dMB is below the current resident size %.0fMB'
+                         % (memory_limit_mb, peak_rss_mb()))
+    return max(int(budget / (row_bytes * WORKING_SET_FACTOR)), 1)
+
+
+def limit_chunksize(chunksize, rows, start_mb, peak_before_mb, memory_limit_mb):
+    # 一块处理完成后检查内存上限并返回后续块的行数：start_mb为读入该块前的常驻内存，
+    # 峰值在该块中被刷新时，(峰值 - start_mb)即为该块的工作集，按每行占用与剩余空间缩小块，只缩小不放大
+    peak = peak_rss_mb()
+    if peak > memory_limit_mb:
+        raise MemoryError('peak rss %.0fMB exceeds memory limit %dMB on a chunk of %d rows, use a smaller --chunksize'
+                          % (peak, memory_limit_mb, rows))
+    if peak <= peak_before_mb or not rows:
+        return chunksize
+    row_mb = (peak - start_mb) / rows
+    fit = int((memory_limit_mb - rss_mb()) * HEADROOM / row_mb) if row_mb > 0 else chunksize
+    if fit < chunksize:
+        logger.info('chunksize %d -> %d (%.3fKB per row, peak rss %.0fMB)' % (chunksize, fit, row_mb * 1024, peak))
+    return max(min(chunksize, fit), 1)
+
+
+def fit_encoder(paths, chunksize, encoder):
+    # 第一遍只读取需要字典编码的字段，统计全量取值后一次性更新码表，保证分块编码与整表编码一致
+    uniques = {col: [] for col in TRANSACTION_OBJECT_COLS + ['purchase_month']}
+    for chunk in read_chunks(paths, chunksize, usecols=TRANSACTION_OBJECT_COLS + ['purchase_date']):
+        for col in TRANSACTION_OBJECT_COLS:
+            uniques[col].append(pd.Series(chunk[col].unique()))
+        uniques['purchase_month'].append(
+            pd.Series(np.unique(date_features(chunk['purchase_date'])['purchase_month'])))
+    for col, series in uniques.items():
+        encoder.update('transactions.' + col, *series)
+    return encoder
+
+
+def transform_chunk(transaction, merchant, encoder):
+    # 码表已在第一遍拟合完成，这里的编码不会再新增取值
+    return transaction_d(build_transaction(transaction, merchant, encoder, diffs=False))
+
+
+def stream_transaction_d(primeval_dir='../data/primeval', output='../data/primeval/preprocess/transaction_d_pre.csv',
+                         chunksize=None, memory_limit_mb=None, codebook_path=CODEBOOK_PATH, cache_dir=CACHE_DIR,
+                         refit_merchant=True):
+    encoder = CategoryEncoder.load(codebook_path)
+    merchant = load_clean_merchant(encoder, primeval_dir, cache_dir, merchant_stats_path(codebook_path), refit_merchant)
+    merchant = MerchantAttributes(merchant, MERCHANT_MERGE_COLS[1:])
+    gc.collect()
+
+    paths = ['%s/%s' % (primeval_dir, name) for name in TRANSACTION_FILES]
+    if chunksize is None:
+        if memory_limit_mb is None:
+            raise ValueError('either chunksize or memory_limit_mb must be given')
+        chunksize = estimate_chunksize(paths[-1], memory_limit_mb)
+    logger.info('stream preprocess chunksize: %d' % chunksize)
+
+    with stage('fit_encoder'):
+        encoder = fit_encoder(paths, chunksize, encoder)
+    encoder.save(codebook_path)
+
+    # 各块的输出只取决于码表，与块的划分无关，因此可以在处理过程中缩小块
+    sizes = [chunksize]
+    rows = 0
+    start_mb, peak_before_mb = rss_mb(), peak_rss_mb()
+    for i, chunk in enumerate(read_chunks(paths, lambda: sizes[-1])):
+        chunk_rows = len(chunk)
+        chunk = transform_chunk(chunk, merchant, encoder)
+        with stage('write', chunk, output=output, chunk=i):
+            chunk.to_csv(output, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+        rows += chunk_rows
+        del chunk
+        gc.collect()
+        logger.info('chunk %d done, rows: %d, peak rss: %.0fMB' % (i, rows, peak_rss_mb()))
+        if memory_limit_mb is not None:
+            sizes.append(limit_chunksize(sizes[-1], chunk_rows, start_mb, peak_before_mb, memory_limit_mb))
+        start_mb, peak_before_mb = rss_mb(), peak_rss_mb()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--primeval-dir', default='../data/primeval')
+    parser.add_argument('--output', default='../data/primeval/preprocess/transaction_d_pre.csv')
+    parser.add_argument('--chunksize', type=int, default=None)
+    # 峰值常驻内存的上限，未指定--chunksize时据此估算块大小
+    parser.add_argument('--memory-limit-mb', type=int, default=None)
+    # 沿用上次保存的商户清洗参数，与04的同名参数一致
+    parser.add_argument('--frozen-merchant-stats', action='store_true')
+    parser.add_argument('--log-file', default='./log/stream_preprocess.log')
+    parser.add_argument('--console', action='store_true')
+    args = parser.parse_args()
+
+    setup_logger(args.log_file, console=args.console)
+
+    stream_transaction_d(args.primeval_dir, args.output, args.chunksize, args.memory_limit_mb,
+                         refit_merchant=not args.frozen_merchant_stats)
+
+
+if __name__ == '__main__':
+    main()
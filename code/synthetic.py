@@ -0,0 +1,246 @@
+# 与Elo原始数据格式一致的合成数据
+# data/primeval下不附带原始数据，这里按固定随机种子生成train/test/merchants/historical/new交易五个csv，
+# 字段、取值格式与基数与原始数据一致：约32.5万张卡、约33.5万条商户记录（含重复的merchant_id）、
+# avg_purchases_lag*中的inf、category_2/category_3与merchant_id中的缺失值，交易行数可在百万到上亿之间配置。
+# 每张卡有一个参考月份，month_lag与purchase_date相互一致；交易按块生成并追加写入，内存占用与总行数无关。
+# make_tables不写csv，直接在内存中返回同样的数据（取值与类型与写出后经loader加载的结果相同），
+# make_encoded_transaction进一步得到preprocess的公共中间表，供只需要DataFrame的基准脚本使用。
+# 用法: python synthetic.py --rows 10000000 --output ../data/primeval --seed 0
+
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from downcast import optimize_memory
+from loader import TABLE_DTYPES, TABLE_FILES, concat_tables
+
+logger = logging.getLogger('mylogger')
+
+CARDS = 325540
+TRAIN_CARDS = 201917
+MERCHANT_ROWS = 334696
+DUPLICATE_MERCHANTS = 63
+NEW_RATIO = 0.063
+CHUNKSIZE = 1000000
+
+# 交易日期范围：history为2017-01至2018-02，new为2017-03至2018-04，月份以2017-01为0计
+FIRST_MONTH = np.datetime64('2017-01', 'M')
+FIRST_ACTIVE_MONTHS = pd.period_range('2011-11', '2018-02', freq='M').astype(str)
+TRANSACTION_COLS = ['authorized_flag', 'card_id', 'city_id', 'category_1', 'installments', 'category_3',
+                    'merchant_category_id', 'merchant_id', 'month_lag', 'purchase_amount', 'purchase_date',
+                    'category_2', 'state_id', 'subsector_id']
+INSTALLMENTS = [-1, 0, 1, 2, 3, 4, 5, 6, 10, 12, 999]
+INSTALLMENTS_P = [0.005, 0.52, 0.40, 0.025, 0.02, 0.01, 0.006, 0.005, 0.004, 0.004, 0.001]
+
+
+def make_ids(rng, prefix, n):
+    # 10位十六进制的随机不重复编号
+    values = np.unique(rng.randint(0, 16 ** 10 - 1, int(n * 1.1) + 16, dtype=np.int64))
+    rng.shuffle(values)
+    return np.array(['%s%010x' % (prefix, v) for v in values[:n]], dtype=object)
+
+
+def with_nan(rng, values, ratio):
+    values = pd.Series(values, dtype=object if values.dtype == object else np.float64)
+    values[rng.rand(len(values)) < ratio] = np.nan
+    return values
+
+
+def make_cards(rng, card_ids, n_train):
+    # 激活月份偏向近期；训练集目标值约1%为-33.22的异常值
+    weights = np.linspace(0.2, 1, len(FIRST_ACTIVE_MONTHS)) ** 3
+    cards = pd.DataFrame({
+        'first_active_month': rng.choice(FIRST_ACTIVE_MONTHS, len(card_ids), p=weights / weights.sum()),
+        'card_id': card_ids,
+        'feature_1': rng.choice([1, 2, 3, 4, 5], len(card_ids), p=[0.08, 0.21, 0.37, 0.22, 0.12]),
+        'feature_2': rng.choice([1, 2, 3], len(card_ids), p=[0.44, 0.37, 0.19]),
+        'feature_3': rng.choice([0, 1], len(card_ids), p=[0.43, 0.57]),
+    })
+    train = cards.iloc[:n_train].reset_index(drop=True)
+    test = cards.iloc[n_train:].reset_index(drop=True)
+    target = rng.standard_t(5, n_train) * 1.5
+    target[rng.rand(n_train) < 0.011] = -33.21928095
+    train['target'] = np.round(target, 8)
+    # 测试集有一条缺失的激活月份
+    test.loc[rng.randint(len(test)), 'first_active_month'] = np.nan
+    return train, test
+
+
+def make_merchants(rng, rows, duplicates):
+    unique = rows - duplicates
+    merchant_ids = make_ids(rng, 'M_ID_', unique)
+    # 重复的merchant_id取已有编号，其余字段重新抽取
+    ids = np.concatenate([merchant_ids, rng.choice(merchant_ids, duplicates, replace=False)])
+    ids = ids[rng.permutation(rows)]
+    ranges = ['A', 'B', 'C', 'D', 'E']
+    merchant = pd.DataFrame({
+        'merchant_id': ids,
+        'merchant_group_id': rng.randint(1, 112587, rows),
+        'merchant_category_id': rng.randint(-1, 892, rows),
+        'subsector_id': rng.randint(-1, 41, rows),
+        'numerical_1': np.round(rng.exponential(0.3, rows) - 0.057, 8),
+        'numerical_2': np.round(rng.exponential(0.3, rows) - 0.057, 8),
+        'category_1': rng.choice(['N', 'Y'], rows, p=[0.98, 0.02]),
+        'most_recent_sales_range': rng.choice(ranges, rows, p=[0.01, 0.02, 0.11, 0.35, 0.51]),
+        'most_recent_purchases_range': rng.choice(ranges, rows, p=[0.01, 0.02, 0.12, 0.35, 0.50]),
+    })
+    for lag in [3, 6, 12]:
+        merchant['avg_sales_lag%d' % lag] = np.round(rng.lognormal(0, 0.5, rows), 2)
+        merchant['avg_purchases_lag%d' % lag] = rng.lognormal(0, 0.5, rows)
+        merchant['active_months_lag%d' % lag] = np.minimum(lag, rng.geometric(0.05, rows))
+    # 原始数据中有3条商户记录的avg_purchases_lag3/6/12为inf，13条的avg_sales_lag3/6/12同时缺失
+    inf_rows = rng.choice(rows, 3, replace=False)
+    nan_rows = rng.choice(rows, 13, replace=False)
+    for lag in [3, 6, 12]:
+        merchant.loc[inf_rows, 'avg_purchases_lag%d' % lag] = np.inf
+        merchant.loc[nan_rows, 'avg_sales_lag%d' % lag] = np.nan
+        merchant.loc[nan_rows, 'avg_purchases_lag%d' % lag] = np.nan
+    merchant['category_4'] = rng.choice(['N', 'Y'], rows, p=[0.7, 0.3])
+    merchant['city_id'] = rng.randint(-1, 348, rows)
+    merchant['state_id'] = rng.randint(-1, 25, rows)
+    merchant['category_2'] = with_nan(rng, rng.randint(1, 6, rows), 0.035)
+    return merchant
+
+
+class TransactionSampler(object):
+    # 卡的交易活跃度服从对数正态分布，商户的类别、子类、城市与州沿用商户表中的取值
+
+    def __init__(self, rng, card_ids, merchant):
+        self.card_ids = card_ids
+        weights = rng.lognormal(0, 1, len(card_ids))
+        self.card_cdf = np.cumsum(weights) / weights.sum()
+        # 参考月份（month_lag为0的月份）大多为2018-02，少数更早
+        self.card_ref = 13 - np.minimum(rng.geometric(0.7, len(card_ids)) - 1, 12)
+        merchant = merchant.drop_duplicates('merchant_id')
+        self.merchant_ids = merchant['merchant_id'].values
+        self.merchant_attrs = merchant[['merchant_category_id', 'subsector_id', 'city_id', 'state_id']].values
+
+    def sample(self, rng, n, new):
+        card = np.minimum(np.searchsorted(self.card_cdf, rng.rand(n)), len(self.card_ids) - 1)
+        lag = rng.randint(1, 3, n) if new else rng.randint(-13, 1, n)
+        # 参考月份较早的卡只有2017-01之后的交易
+        lag = np.maximum(lag, -self.card_ref[card])
+        month = self.card_ref[card] + lag
+        start = (FIRST_MONTH + month).astype('datetime64[s]')
+        seconds = ((FIRST_MONTH + month + 1).astype('datetime64[s]') - start).astype(np.int64)
+        purchase_date = start + (rng.rand(n) * seconds).astype(np.int64)
+
+        merchant = rng.randint(0, len(self.merchant_ids), n)
+        attrs = self.merchant_attrs[merchant]
+        installments = rng.choice(INSTALLMENTS, n, p=INSTALLMENTS_P)
+        category_3 = np.where(installments == 0, 'A', np.where(installments == 1, 'B', 'C')).astype(object)
+        return pd.DataFrame({
+            'authorized_flag': 'Y' if new else rng.choice(['Y', 'N'], n, p=[0.91, 0.09]),
+            'card_id': self.card_ids[card],
+            'city_id': np.where(rng.rand(n) < 0.08, -1, attrs[:, 2]),
+            'category_1': rng.choice(['N', 'Y'], n, p=[0.93, 0.07]),
+            'installments': installments,
+            'category_3': with_nan(rng, category_3, 0.028 if new else 0.006),
+            'merchant_category_id': attrs[:, 0],
+            'merchant_id': with_nan(rng, self.merchant_ids[merchant], 0.005),
+            'month_lag': lag,
+            'purchase_amount': np.round(rng.lognormal(-3, 1.2, n) - 0.746, 8),
+            'purchase_date': purchase_date,
+            'category_2': with_nan(rng, rng.randint(1, 6, n), 0.057 if new else 0.091),
+            'state_id': np.where(rng.rand(n) < 0.08, -1, attrs[:, 3]),
+            'subsector_id': attrs[:, 1],
+        }, columns=TRANSACTION_COLS)
+
+
+def transaction_chunks(sampler, rows, new, seed, chunksize=CHUNKSIZE):
+    # 每块使用(seed, 块序号)派生的随机数，结果只取决于种子、行数与块大小
+    for i, start in enumerate(range(0, rows, chunksize)):
+        rng = np.random.RandomState([seed, int(new), i])
+        yield sampler.sample(rng, min(chunksize, rows - start), new)
+
+
+def write_transactions(path, sampler, rows, new, seed, chunksize=CHUNKSIZE):
+    for i, chunk in enumerate(transaction_chunks(sampler, rows, new, seed, chunksize)):
+        chunk.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, index=False,
+                     date_format='%Y-%m-%d %H:%M:%S')
+    if rows == 0:
+        pd.DataFrame(columns=TRANSACTION_COLS).to_csv(path, index=False)
+
+
+def make_sources(seed, cards, merchants):
+    # 返回(训练集, 测试集, 商户表, 交易采样器)，随机数的使用顺序固定，generate与make_tables得到相同的数据
+    rng = np.random.RandomState(seed)
+    card_ids = make_ids(rng, 'C_ID_', cards)
+    train, test = make_cards(rng, card_ids, int(round(cards * TRAIN_CARDS / CARDS)))
+    merchant = make_merchants(rng, merchants, min(DUPLICATE_MERCHANTS, merchants // 100))
+    return train, test, merchant, TransactionSampler(rng, card_ids, merchant)
+
+
+def generate(output_dir, rows=1000000, cards=CARDS, merchants=MERCHANT_ROWS, seed=0, new_ratio=NEW_RATIO,
+             chunksize=CHUNKSIZE):
+    os.makedirs(output_dir, exist_ok=True)
+    train, test, merchant, sampler = make_sources(seed, cards, merchants)
+    train.to_csv(os.path.join(output_dir, TABLE_FILES['train']), index=False)
+    test.to_csv(os.path.join(output_dir, TABLE_FILES['test']), index=False)
+    merchant.to_csv(os.path.join(output_dir, TABLE_FILES['merchants']), index=False)
+
+    new_rows = int(round(rows * new_ratio))
+    write_transactions(os.path.join(output_dir, TABLE_FILES['new_merchant_transactions']), sampler, new_rows,
+                       True, seed, chunksize)
+    write_transactions(os.path.join(output_dir, TABLE_FILES['historical_transactions']), sampler, rows - new_rows,
+                       False, seed, chunksize)
+    logger.info('synthetic data: %d cards, %d merchant rows, %d transactions -> %s'
+                % (cards, merchants, rows, output_dir))
+
+
+def typed_table(df, name):
+    # 按loader中声明的字段类型转换
+    return df.astype({col: dtype for col, dtype in TABLE_DTYPES[name].items() if col in df.columns})
+
+
+def make_tables(rows=1000000, cards=CARDS, merchants=MERCHANT_ROWS, seed=0, new_ratio=NEW_RATIO,
+                chunksize=CHUNKSIZE):
+    # 返回(交易表, 商户表)：交易表为new与history按04的顺序拼接；每块生成后即转换类型，不保留字符串形式的整表
+    _, _, merchant, sampler = make_sources(seed, cards, merchants)
+    new_rows = int(round(rows * new_ratio))
+    frames = []
+    for name, n, new in [('new_merchant_transactions', new_rows, True),
+                         ('historical_transactions', rows - new_rows, False)]:
+        frames += [typed_table(chunk, name) for chunk in transaction_chunks(sampler, n, new, seed, chunksize)]
+    transaction = optimize_memory(concat_tables(frames), 'transactions')
+    return transaction, optimize_memory(typed_table(merchant, 'merchants'), 'merchants')
+
+
+def make_encoded_transaction(rows=1000000, cards=CARDS, merchants=MERCHANT_ROWS, seed=0):
+    # make_tables的交易表经preprocess.build_transaction编码、提取日期特征并合并商户字段（不计算差分），返回(中间表, 码表)
+    from encoder import CategoryEncoder
+    from preprocess import build_transaction, clean_merchant
+    transaction, merchant = make_tables(rows, cards, merchants, seed)
+    encoder = CategoryEncoder()
+    return build_transaction(transaction, clean_merchant(merchant, encoder), encoder, diffs=False), encoder
+
+
+def make_purchase_dates(rows, seed=0):
+    # 与交易csv中purchase_date格式相同的时间字符串，2017-01至2018-04之间的秒级时间
+    rng = np.random.RandomState(seed)
+    start = FIRST_MONTH.astype('datetime64[s]').astype(np.int64)
+    end = (FIRST_MONTH + 16).astype('datetime64[s]').astype(np.int64)
+    seconds = rng.randint(start, end, size=rows).astype('datetime64[s]')
+    return pd.Series(np.datetime_as_string(seconds).astype(object)).str.replace('T', ' ', regex=False)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output', default='../data/primeval')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--cards', type=int, default=CARDS)
+    parser.add_argument('--merchants', type=int, default=MERCHANT_ROWS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    args = parser.parse_args()
+
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler())
+    generate(args.output, args.rows, args.cards, args.merchants, args.seed, chunksize=args.chunksize)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# 按时间窗口的卡粒度特征
+# 04只提取购买月份、时间段、星期与按行顺序的一阶差分，模型还需要最近1/3/6个月的消费、距上次购买的天数、
+# 按时间衰减加权的消费金额等窗口特征，用pandas的groupby().rolling()在数千万行上非常慢。
+# 这里在按(card_id, purchase_date)排序的布局（见card_layout.py）上计算，不再分组：
+# - 月份窗口：按购买时间距截止时间所在自然月的月数，先按(卡, 月数)一次bincount得到每张卡每个月的次数与金额，
+#   再沿月数累加，任意多个窗口都只是累加结果上的一次取值；
+# - 天数窗口与距上次购买的天数：(卡序号, 秒)组合为单调不减的键，窗口两端的指针由searchsorted一次得到，
+#   窗口内的次数与金额为指针之差与金额前缀和之差；
+# - 逐行的滚动窗口(rolling_windows)同样由指针与前缀和得到，与groupby('card_id').rolling('30D')的结果一致。
+# reference_date为截止时间（整体一个时间或每张卡一个），全部特征都只使用截止时间及之前的交易，保证特征不含未来信息：
+# 最近1个月为截止时间所在的自然月（到截止时间为止），最近3个月再往前加两个自然月，以此类推；
+# 不使用month_lag，month_lag以每张卡各自的参考月份为0，与截止时间无关。
+# purchase_amount的缺失值在金额合计中按0计，次数中照常计入。
+
+import numpy as np
+import pandas as pd
+
+from card_layout import card_order
+
+MONTH_WINDOWS = [1, 3, 6]
+DAY_WINDOWS = [7, 30]
+HALFLIVES = [30]
+DAY_SECONDS = 86400
+
+
+def _seconds(dates):
+    return np.asarray(dates).astype('datetime64[s]').view(np.int64)
+
+
+class TimeKeys(object):
+    # 按卡连续、卡内按时间排序的行 -> 单调不减的int64键 卡序号 * span + 秒；
+    # 查询的时间裁剪到本卡的键区间内，指针不会越过卡的边界
+
+    def __init__(self, codes, seconds):
+        self.base = int(seconds.min()) if len(seconds) else 0
+        self.span = (int(seconds.max()) - self.base + 3) if len(seconds) else 3
+        self.keys = self.key(codes, seconds)
+
+    def key(self, codes, seconds):
+        offset = np.clip(np.asarray(seconds, dtype=np.int64) - self.base, -1, self.span - 2) + 1
+        return np.asarray(codes, dtype=np.int64) * self.span + offset
+
+    def after(self, codes, seconds):
+        # 每个查询在本卡内第一笔时间晚于seconds的交易的行号
+        return np.searchsorted(self.keys, self.key(codes, seconds), side='right')
+
+
+def _prefix_sum(values):
+    values = np.nan_to_num(np.asarray(values, dtype=np.float64))
+    return np.concatenate([[0.0], np.cumsum(values)])
+
+
+def rolling_windows(codes, dates, amount, windows=DAY_WINDOWS):
+    # 逐行的滚动窗口：每笔交易之前windows天内（含本笔，窗口左开右闭）同一张卡的交易次数、金额合计与均值
+    # codes为每行的卡序号，行须按(codes, dates)排序
+    seconds = _seconds(dates)
+    keys = TimeKeys(codes, seconds)
+    prefix = _prefix_sum(amount)
+    end = np.arange(1, len(seconds) + 1)
+    features = {}
+    for days in windows:
+        start = keys.after(codes, seconds - days * DAY_SECONDS)
+        count = end - start
+        total = prefix[end] - prefix[start]
+        features['count_%dd' % days] = count
+        features['purchase_amount_sum_%dd' % days] = total
+        features['purchase_amount_mean_%dd' % days] = total / count
+    return features
+
+
+def _months(seconds):
+    # 1970-01起的自然月序号
+    return np.asarray(seconds, dtype='datetime64[s]').astype('datetime64[M]').view(np.int64)
+
+
+def window_feature_arrays(offsets, dates, amount, reference_date=None, month_windows=MONTH_WINDOWS,
+                          day_windows=DAY_WINDOWS, halflives=HALFLIVES):
+    # 每张卡一行的窗口特征：列名 -> 数组；offsets为每张卡的行区间起点（长度为卡数+1）
+    # reference_date为None时取全部交易中最晚的购买时间
+    cards = len(offsets) - 1
+    counts = np.diff(offsets)
+    codes = np.repeat(np.arange(cards, dtype=np.int64), counts)
+    seconds = _seconds(dates)
+    amount = np.nan_to_num(np.asarray(amount, dtype=np.float64))
+    if reference_date is None:
+        reference = np.full(cards, seconds.max() if len(seconds) else 0, dtype=np.int64)
+    else:
+        reference = np.broadcast_to(_seconds(np.atleast_1d(np.asarray(reference_date, dtype='datetime64[s]'))),
+                                    (cards,)).astype(np.int64)
+    keys = TimeKeys(codes, seconds)
+    prefix = _prefix_sum(amount)
+    card_rows = np.arange(cards, dtype=np.int64)
+    # 截止时间之前的交易是每张卡的前缀，end为前缀的终点
+    start, end = offsets[:-1], keys.after(card_rows, reference)
+    visible = np.arange(len(seconds)) < np.repeat(end, counts)
+
+    features = {}
+    if month_windows:
+        # 距截止时间所在自然月的月数为0, 1, ...（截止时间之前的交易不会为负）；只需要最大窗口以内的月份
+        width = max(month_windows)
+        months_ago = _months(reference)[codes] - _months(seconds)
+        mask = visible & (months_ago < width)
+        flat = codes[mask] * width + months_ago[mask]
+        month_counts = np.bincount(flat, minlength=cards * width).reshape(cards, width).cumsum(axis=1)
+        month_totals = np.bincount(flat, weights=amount[mask], minlength=cards * width).reshape(cards, width)
+        month_totals = month_totals.cumsum(axis=1)
+        for months in month_windows:
+            features['count_%dm' % months] = month_counts[:, months - 1]
+            features['purchase_amount_sum_%dm' % months] = month_totals[:, months - 1]
+    for days in day_windows:
+        window_start = keys.after(card_rows, reference - days * DAY_SECONDS)
+        features['count_%dd' % days] = end - window_start
+        features['purchase_amount_sum_%dd' % days] = prefix[end] - prefix[window_start]
+    # 截止时间之前没有交易的卡为缺失值
+    last = seconds[np.maximum(end - 1, 0)]
+    features['days_since_last'] = np.where(end > start, (reference - last) / DAY_SECONDS, np.nan)
+    for halflife in halflives:
+        age = (reference[codes] - seconds) / (halflife * DAY_SECONDS)
+        weights = np.where(visible, np.power(0.5, age), 0.0)
+        features['purchase_amount_recency_%dd' % halflife] = np.bincount(codes, weights=amount * weights,
+                                                                         minlength=cards)
+    return features
+
+
+def layout_window_features(layout, reference_date=None, **kwargs):
+    # 在CardLayout（transaction_card_pre）上计算，各列为内存映射数组，卡按卡号排序输出
+    features = {'card_id': np.asarray(layout.card_ids, dtype=object)}
+    features.update(window_feature_arrays(layout.offsets, layout.array('purchase_date'),
+                                          layout.array('purchase_amount'), reference_date, **kwargs))
+    return pd.DataFrame(features)
+
+
+def card_window_features(transaction, reference_date=None, **kwargs):
+    # 在公共中间表上计算：先按(卡号, 购买时间)排序得到与布局相同的行顺序
+    order, offsets, card_ids = card_order(transaction['card_id'], transaction['purchase_date'])
+    features = {'card_id': card_ids}
+    features.update(window_feature_arrays(offsets, transaction['purchase_date'].values[order],
+                                          transaction['purchase_amount'].values[order], reference_date, **kwargs))
+    return pd.DataFrame(features)